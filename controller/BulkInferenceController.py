@@ -0,0 +1,100 @@
+from fastapi import APIRouter, HTTPException, BackgroundTasks
+from entity.request.InferenceModel import BulkInferenceRequest
+from entity.response.ResponseModel import BaseResponse, TrainTaskResponse
+from service.inference.BulkInferenceService import BulkInferenceService
+from service.inference.ModelRegistry import ModelRegistry
+from controller import InferenceController
+from typing import Dict, Any
+
+router = APIRouter(prefix="/api/bulk", tags=["离线批量推理"])
+bulk_service = BulkInferenceService()
+
+
+def configure(config: Dict[str, Any]):
+    """按config.yaml的inference.bulk创建离线批量推理服务"""
+    global bulk_service
+    bulk_config = (config.get('inference', {}) or {}).get('bulk', {}) or {}
+    bulk_service = BulkInferenceService(
+        max_workers=bulk_config.get('max_concurrent_jobs', 1),
+        checkpoint_every=bulk_config.get('checkpoint_every', 64)
+    )
+
+
+@router.post("/start", response_model=TrainTaskResponse)
+async def start_bulk_inference(background_tasks: BackgroundTasks, request: BulkInferenceRequest):
+    """启动离线批量推理任务（异步），输出路径已有检查点时从断点继续"""
+    registry = InferenceController.get_registry()
+    if request.model_path:
+        model_key = ModelRegistry.make_key(request.model_path, request.lora_adapter_path, request.dtype)
+    elif registry.default_key:
+        model_key = registry.default_key
+    else:
+        raise HTTPException(status_code=503, detail="推理服务未初始化")
+
+    try:
+        task_id = bulk_service.create_task(
+            request.input_path.replace('\\', '/'),
+            request.output_path.replace('\\', '/'),
+            {
+                'model_key': list(model_key),
+                'adapter_id': request.adapter_id,
+                'prompt_field': request.prompt_field,
+                'max_new_tokens': request.max_tokens,
+                'temperature': request.temperature,
+                'seed': request.seed,
+                'batch_size': request.batch_size,
+                'resume': request.resume
+            }
+        )
+
+        # 在后台执行
+        background_tasks.add_task(bulk_service.start_task_async, task_id, registry)
+
+        return TrainTaskResponse(
+            task_id=task_id,
+            status="pending",
+            message="离线批量推理任务已创建，正在后台执行"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/status/{task_id}", response_model=BaseResponse)
+async def get_task_status(task_id: str):
+    """查询任务进度、吞吐与预计剩余时间"""
+    task = bulk_service.get_task_status(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    return BaseResponse(
+        success=True,
+        message=f"任务状态: {task.status.value}",
+        data=task.dict()
+    )
+
+
+@router.post("/cancel/{task_id}", response_model=BaseResponse)
+async def cancel_task(task_id: str):
+    """取消任务（已写出的结果与检查点保留，重新提交即可继续）"""
+    if not bulk_service.cancel_task(task_id):
+        raise HTTPException(status_code=404, detail="任务不存在或已结束")
+
+    return BaseResponse(
+        success=True,
+        message="任务已取消",
+        data=bulk_service.get_task_status(task_id).dict()
+    )
+
+
+@router.get("/tasks", response_model=BaseResponse)
+async def get_all_tasks():
+    """获取所有离线批量推理任务"""
+    tasks_list = [task.dict() for task in bulk_service.get_all_tasks().values()]
+
+    return BaseResponse(
+        success=True,
+        message=f"共 {len(tasks_list)} 个任务",
+        data=tasks_list
+    )
@@ -2,11 +2,18 @@ from fastapi import APIRouter, HTTPException
 from entity.request.EvalModel import EvalRequest, EvalResult
 from entity.response.ResponseModel import BaseResponse
 from service.eval.EvalService import EvalService
+from typing import Dict, Any
 
 router = APIRouter(prefix="/api/eval", tags=["模型评估"])
 eval_service = EvalService()
 
 
+def configure(config: Dict[str, Any]):
+    """按config.yaml的inference.merged_lora创建评估服务（与推理服务共用合并权重缓存）"""
+    global eval_service
+    eval_service = EvalService(merged_config=(config.get('inference', {}) or {}).get('merged_lora'))
+
+
 @router.post("/evaluate", response_model=BaseResponse)
 async def evaluate_model(request: EvalRequest):
     """评估模型性能"""
@@ -16,7 +23,8 @@ async def evaluate_model(request: EvalRequest):
             dataset_path=request.dataset_path,
             metrics=request.metrics,
             batch_size=request.batch_size,
-            lora_adapter_path=request.lora_adapter_path
+            lora_adapter_path=request.lora_adapter_path,
+            merge_lora=request.merge_lora
         )
 
         eval_result = EvalResult(
@@ -13,7 +13,8 @@ async def export_to_onnx(request: ExportRequest):
         result = export_service.export_to_onnx(
             model_path=request.model_path,
             output_path=request.output_path,
-            opset_version=request.opset_version
+            opset_version=request.opset_version,
+            with_past=request.with_past
         )
 
         return ExportResponse(**result)
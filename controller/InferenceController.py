@@ -1,109 +1,710 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
-from entity.request.InferenceModel import ChatRequest, ChatResponse, BatchInferenceRequest
+from entity.request.InferenceModel import ChatRequest, ChatResponse, BatchInferenceRequest, ModelLoadRequest, \
+    AdapterLoadRequest
 from entity.response.ResponseModel import BaseResponse
-from service.inference.InferenceService import InferenceService
-from typing import Optional
+from service.inference.ModelRegistry import ModelRegistry, ModelHandle, ModelKey
+from service.inference.InferenceWorkerPool import InferenceWorkerPool, QueueFullError
+from service.inference.ResponseCache import ResponseCache
+from service.inference.SingleFlight import SingleFlight
+from service.inference.ConstraintCompiler import ConstraintCompiler
+from service.inference.IncrementalDetokenizer import IncrementalDetokenizer
+from typing import Optional, Dict, Any, AsyncGenerator, List, Tuple
+from threading import Event
+import asyncio
+import functools
+import json
+import os
+import time
 
 router = APIRouter(prefix="/api/inference", tags=["模型推理"])
 
-# 全局推理服务实例（需要在main.py中初始化）
-inference_service: Optional[InferenceService] = None
+# 全局模型注册表（需要在main.py中初始化），按 (model_path, lora_adapter_path, dtype) 复用已加载模型
+model_registry: Optional[ModelRegistry] = None
+# 推理工作线程池，批量推理、投机解码等阻塞的generate不在事件循环中执行
+worker_pool: Optional[InferenceWorkerPool] = None
+# 进行中的确定性请求，相同请求同时到达时共享一次生成
+single_flight = SingleFlight()
+# 服务端的请求预算（config.yaml中的inference.budgets）
+budgets: Dict[str, Any] = {}
+# 非流式请求等待结果期间检查客户端连接的间隔（秒）
+DISCONNECT_POLL_SECONDS = 0.5
+# 批量推理结果流长时间无人读取（客户端在响应开始前断开）时，生产者放弃并释放模型（秒）
+BATCH_STALL_SECONDS = 120
 
 
-def init_inference_service(model_path: str, lora_adapter_path: Optional[str] = None):
-    """初始化推理服务"""
-    global inference_service
-    inference_service = InferenceService(model_path, lora_adapter_path)
+def configure(config: Dict[str, Any]):
+    """
+    按config.yaml创建模型注册表与推理工作线程池
+    api.max_queue_size 同时作为每个推理引擎和工作线程池队列的上限
+    """
+    global model_registry, worker_pool, budgets
+    inference_config = dict(config.get('inference', {}) or {})
+    budgets = inference_config.get('budgets', {}) or {}
+    max_queue_size = (config.get('api', {}) or {}).get('max_queue_size', 100)
 
+    engine_config = dict(inference_config.get('engine', {}) or {})
+    engine_config.setdefault('max_queue_size', max_queue_size)
+    inference_config['engine'] = engine_config
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    """聊天推理（非流式）"""
-    global inference_service
+    # 语义缓存的向量索引默认保存在向量库目录（chroma.save_path）下
+    semantic_config = dict(inference_config.get('semantic_cache', {}) or {})
+    chroma_save_path = (config.get('chroma', {}) or {}).get('save_path')
+    if chroma_save_path and not semantic_config.get('save_path'):
+        semantic_config['save_path'] = os.path.join(chroma_save_path.replace('\\', '/'), "semantic_cache")
+    inference_config['semantic_cache'] = semantic_config
+
+    registry_config = inference_config.get('registry', {}) or {}
+    model_registry = ModelRegistry(
+        max_models=registry_config.get('max_models', 2),
+        max_memory_mb=registry_config.get('max_memory_mb'),
+        service_config=inference_config
+    )
+    worker_pool = InferenceWorkerPool(
+        num_workers=inference_config.get('worker_threads', 1),
+        max_queue_size=max_queue_size,
+        name="inference-worker"
+    )
+
+
+def get_registry() -> ModelRegistry:
+    """获取模型注册表，未配置时使用默认配置创建"""
+    if model_registry is None:
+        configure({})
+    return model_registry
 
-    # 如果提供了model_path，动态初始化服务
-    if request.model_path:
-        inference_service = InferenceService(request.model_path)
 
-    if not inference_service:
+def _queue_full(e: QueueFullError) -> HTTPException:
+    """队列已满时返回429，并通过Retry-After提示客户端重试时间"""
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def init_inference_service(model_path: str, lora_adapter_path: Optional[str] = None):
+    """初始化推理服务，加载默认模型"""
+    registry = get_registry()
+    key = ModelRegistry.make_key(model_path, lora_adapter_path)
+    registry.load(key)
+    registry.default_key = key
+
+
+def _resolve_key(model_path: Optional[str], lora_adapter_path: Optional[str] = None,
+                 dtype: Optional[str] = None) -> ModelKey:
+    """解析模型键，未指定model_path时使用默认模型"""
+    if model_registry is None:
         raise HTTPException(status_code=503, detail="推理服务未初始化")
 
+    if model_path:
+        return ModelRegistry.make_key(model_path, lora_adapter_path, dtype)
+    if model_registry.default_key:
+        return model_registry.default_key
+    raise HTTPException(status_code=503, detail="推理服务未初始化")
+
+
+def _build_chat_config(request: ChatRequest) -> Dict[str, Any]:
+    """将聊天请求转换为推理配置，生成长度与墙钟时间不超过服务端预算"""
+    max_new_tokens = request.max_tokens
+    if budgets.get('max_new_tokens'):
+        max_new_tokens = min(max_new_tokens, budgets['max_new_tokens'])
+    timeout_seconds = request.timeout_seconds or budgets.get('max_request_seconds')
+    if timeout_seconds and budgets.get('max_request_seconds'):
+        timeout_seconds = min(timeout_seconds, budgets['max_request_seconds'])
+    return {
+        'max_new_tokens': max_new_tokens,
+        'timeout_seconds': timeout_seconds,
+        'temperature': request.temperature,
+        'top_p': request.top_p,
+        'top_k': request.top_k,
+        'seed': request.seed,
+        'enable_thinking': request.enable_thinking,
+        'adapter_id': request.adapter_id,
+        'num_speculative_tokens': request.num_speculative_tokens,
+        'session_id': request.session_id,
+        'stop': request.stop,
+        'n': request.n,
+        'json_schema': request.json_schema,
+        'regex': request.regex
+    }
+
+
+def _check_n_best(n: int, temperature: float):
+    """n > 1 需要采样：贪心解码的n个候选完全相同，只会多花n倍的计算"""
+    if n > 1 and temperature <= 0:
+        raise HTTPException(status_code=400, detail="n > 1 需要采样（temperature > 0）")
+
+
+async def _acquire_model_by_key(key: ModelKey) -> ModelHandle:
+    """获取模型并持有引用，首次加载耗时较长，放到线程池中执行"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, model_registry.acquire, key)
+
+
+async def _acquire_model(request) -> ModelHandle:
+    """按请求中的模型参数获取模型，未指定model_path时使用默认模型"""
+    return await _acquire_model_by_key(_resolve_key(request.model_path, request.lora_adapter_path, request.dtype))
+
+
+async def _release_model(handle: ModelHandle):
+    """释放模型引用；最后一个引用可能触发模型卸载（停止引擎、保存缓存），放到线程池中执行"""
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, model_registry.release, handle)
+
+
+async def _compile_constraint(handle: ModelHandle, config: Dict[str, Any]):
+    """
+    首次使用某个约束（json_schema / regex）时编译耗时较长，提交前在线程池中编译，约束无效时返回400
+    Returns:
+        约束索引（提交时传给推理引擎，不在事件循环中再次查找），没有约束时为None
+    """
+    if not ConstraintCompiler.has_constraint(config):
+        return None
+    loop = asyncio.get_event_loop()
+    try:
+        return await loop.run_in_executor(None, handle.service.compile_constraint, config)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"约束解码参数无效: {e}")
+
+
+def _response_cache_key(handle: ModelHandle, messages: List[Dict[str, str]], config: Dict[str, Any]) -> Optional[str]:
+    """确定性请求的缓存键（用于响应缓存与相同请求合并），非确定性请求返回None"""
+    if not ResponseCache.is_cacheable(config):
+        return None
+    prompt = handle.service.build_prompt(messages, config.get('enable_thinking', False))
+    return handle.service.response_cache_key(prompt, config)[0]
+
+
+def _cached_response(cache_key: Optional[str]) -> Optional[Dict[str, Any]]:
+    """查找响应缓存"""
+    if cache_key is None or model_registry.response_cache is None:
+        return None
+    return model_registry.response_cache.get(cache_key)
+
+
+async def _semantic_lookup(handle: ModelHandle, messages: List[Dict[str, str]], config: Dict[str, Any],
+                           cache_key: Optional[str]) -> Tuple[Optional[Any], Optional[Tuple[Dict[str, Any], float]]]:
+    """
+    精确匹配未命中的确定性请求查找语义缓存，提示词向量的前向计算放到线程池中执行
+    Returns:
+        (提示词向量, (缓存结果, 相似度))；未启用语义缓存或模型不支持时均为None，未命中时后者为None
+    """
+    semantic_cache = model_registry.semantic_cache
+    if semantic_cache is None or cache_key is None or not handle.service.supports_embedding:
+        return None, None
+    loop = asyncio.get_event_loop()
+    embeddings, hits = await loop.run_in_executor(
+        None, handle.service.semantic_lookup, semantic_cache, [messages], config
+    )
+    return embeddings, hits[0]
+
+
+def _store_response(handle: ModelHandle, cache_key: Optional[str], config: Dict[str, Any], result: Dict[str, Any],
+                    embedding=None):
+    """将生成结果写入响应缓存，有提示词向量时同时写入语义缓存"""
+    if cache_key is None or model_registry.response_cache is None:
+        return
+    # 超时截断的结果与本次请求的耗时有关，不缓存
+    if result.get('finish_reason') == "timeout":
+        return
+    service = handle.service
+    if service is None:
+        return
+    value = {name: result.get(name) for name in ('content', 'thinking_content', 'finish_reason', 'output_ids')}
+    adapter = service.adapters.resolve(config.get('adapter_id'))
+    model_registry.response_cache.put(cache_key, value, service.model_id, service.model_version, adapter)
+    if embedding is not None and model_registry.semantic_cache is not None:
+        service.semantic_store(model_registry.semantic_cache, embedding, [value], config)
+
+
+async def _replay_stream(handle: ModelHandle, cached: Dict[str, Any], config: Dict[str, Any]) -> AsyncGenerator[str, None]:
+    """以与实时生成相同的SSE格式回放缓存的token"""
+    output_ids = cached.get('output_ids')
+    if not output_ids:
+        if cached.get('thinking_content'):
+            yield IncrementalDetokenizer.format_sse("thinking", cached['thinking_content'])
+        yield IncrementalDetokenizer.format_sse("content", cached['content'])
+        return
+
+    async def token_ids():
+        for token_id in output_ids:
+            yield token_id
+
+    detokenizer = IncrementalDetokenizer(handle.service.tokenizer, config.get('enable_thinking', False), config.get('stop'))
+    async for chunk in detokenizer.iter_sse(token_ids()):
+        yield chunk
+
+
+async def _release_after_stream(handle: ModelHandle, stream: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+    """流式输出结束后释放模型引用；客户端断开时关闭生成流，取消底层请求"""
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await stream.aclose()
+        await _release_model(handle)
+
+
+async def _until_disconnected(http_request: Request, awaitable):
+    """
+    等待生成结果，期间轮询客户端连接
+    客户端断开时取消生成（推理引擎中的序列在下一个token边界结束），返回499
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                raise HTTPException(status_code=499, detail="客户端已断开")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def _generate_chat(handle: ModelHandle, messages: List[Dict[str, str]], config: Dict[str, Any],
+                         cache_key: Optional[str], embedding=None, constraint=None) -> Dict[str, Any]:
+    """执行一次非流式生成并写入响应缓存"""
+    if config['speculative']:
+        # 投机解码逐请求执行，放到工作线程池中；等待被取消时通过事件结束执行中的解码
+        cancel_event = Event()
+        try:
+            result = await asyncio.wrap_future(
+                worker_pool.submit(handle.service.generate_speculative, messages, config, cancel_event)
+            )
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
+    else:
+        result = await handle.engine.generate(messages, config, constraint=constraint)
+    _store_response(handle, cache_key, config, result, embedding)
+    return result
+
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, http_request: Request):
+    """聊天推理（非流式），客户端断开时取消生成"""
+    _check_n_best(request.n, request.temperature)
+    handle = await _acquire_model(request)
+
     try:
         messages = [msg.dict() for msg in request.messages]
-        config = {
-            'max_new_tokens': request.max_tokens,
-            'temperature': request.temperature,
-            'top_p': request.top_p,
-            'top_k': request.top_k,
-            'enable_thinking': request.enable_thinking
-        }
+        config = _build_chat_config(request)
+
+        speculative = request.speculative
+        if speculative is None:
+            speculative = handle.service.speculative_config.get('enabled', False)
+        # 投机解码逐请求执行，n-best采样由推理引擎在一次prefill后分叉；约束解码只在推理引擎中执行
+        config['speculative'] = speculative and request.n == 1 and not ConstraintCompiler.has_constraint(config)
+        constraint = await _compile_constraint(handle, config)
 
-        result = inference_service.generate(messages, config)
+        cache_key = _response_cache_key(handle, messages, config)
+        cached = _cached_response(cache_key)
+        if cached is not None:
+            return ChatResponse(
+                content=cached['content'],
+                thinking_content=cached.get('thinking_content'),
+                finish_reason=cached.get('finish_reason') or "stop",
+                metrics={'response_cache': "hit"}
+            )
+        embedding, semantic_hit = await _semantic_lookup(handle, messages, config, cache_key)
+        if semantic_hit is not None:
+            cached, similarity = semantic_hit
+            return ChatResponse(
+                content=cached['content'],
+                thinking_content=cached.get('thinking_content'),
+                finish_reason=cached.get('finish_reason') or "stop",
+                metrics={'response_cache': "semantic_hit", 'similarity': round(similarity, 4)}
+            )
+
+        metrics = {}
+        if cache_key is None:
+            result = await _until_disconnected(http_request, _generate_chat(handle, messages, config, cache_key,
+                                                                            constraint=constraint))
+        else:
+            # 相同的确定性请求正在生成时直接共享其结果，全部等待方断开后才取消生成
+            result, coalesced = await _until_disconnected(http_request, single_flight.run(
+                cache_key, functools.partial(_generate_chat, handle, messages, config, cache_key, embedding, constraint)
+            ))
+            if coalesced:
+                metrics['coalesced'] = True
+        if 'speculative' in result:
+            metrics['speculative'] = result['speculative']
 
         return ChatResponse(
             content=result['content'],
             thinking_content=result.get('thinking_content'),
-            finish_reason="stop"
+            finish_reason=result.get('finish_reason', "stop"),
+            choices=result.get('choices'),
+            metrics=metrics or None
         )
+    except QueueFullError as e:
+        raise _queue_full(e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await _release_model(handle)
 
 
 @router.post("/chat/stream")
 async def chat_stream(request: ChatRequest):
     """聊天推理（流式输出SSE）"""
-    global inference_service
+    if request.n > 1:
+        raise HTTPException(status_code=400, detail="n > 1 不支持流式输出")
+    handle = await _acquire_model(request)
+
+    try:
+        messages = [msg.dict() for msg in request.messages]
+        config = _build_chat_config(request)
+        constraint = await _compile_constraint(handle, config)
 
-    # 如果提供了model_path，动态初始化服务
-    if request.model_path:
-        inference_service = InferenceService(request.model_path)
+        cache_key = _response_cache_key(handle, messages, config)
+        cached = _cached_response(cache_key)
+        embedding = None
+        if cached is None:
+            embedding, semantic_hit = await _semantic_lookup(handle, messages, config, cache_key)
+            if semantic_hit is not None:
+                cached = semantic_hit[0]
+        if cached is not None:
+            stream = _release_after_stream(handle, _replay_stream(handle, cached, config))
+        elif cache_key is None:
+            stream = _release_after_stream(handle, handle.engine.generate_stream(messages, config,
+                                                                                 constraint=constraint))
+        else:
+            def start():
+                on_result = functools.partial(_store_response, handle, cache_key, config, embedding=embedding)
+                return _release_after_stream(handle, handle.engine.generate_stream(messages, config, on_result,
+                                                                                   constraint))
+
+            # 相同的确定性请求正在生成时订阅其token流（从头回放）；
+            # 发起请求的模型引用由后台生成流持有，生成结束后释放
+            stream, coalesced = single_flight.stream(cache_key, start)
+            if coalesced:
+                stream = _release_after_stream(handle, stream)
+
+        return StreamingResponse(stream, media_type="text/event-stream")
+    except QueueFullError as e:
+        await _release_model(handle)
+        raise _queue_full(e)
+    except HTTPException:
+        await _release_model(handle)
+        raise
+    except Exception as e:
+        await _release_model(handle)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _put_result(loop: asyncio.AbstractEventLoop, results: asyncio.Queue, stopped: Event, item) -> bool:
+    """
+    在工作线程中向有界结果队列写入一项；队列满时分段等待，消费者已停止或长时间不读取时放弃
+    Returns:
+        是否写入成功
+    """
+    deadline = time.time() + BATCH_STALL_SECONDS
+    while not stopped.is_set():
+        future = asyncio.run_coroutine_threadsafe(
+            asyncio.wait_for(results.put(item), DISCONNECT_POLL_SECONDS), loop
+        )
+        try:
+            future.result()
+            return True
+        except (asyncio.TimeoutError, TimeoutError):
+            if time.time() > deadline:
+                stopped.set()
+    return False
 
-    if not inference_service:
-        raise HTTPException(status_code=503, detail="推理服务未初始化")
 
+def _produce_batch(loop: asyncio.AbstractEventLoop, results: asyncio.Queue, stopped: Event, handle: ModelHandle,
+                   prompts: List[str], config: Dict[str, Any]):
+    """
+    在工作线程中逐个micro-batch生成，结果经有界队列交给事件循环；队列满时等待，客户端断开后停止；
+    模型引用由生产者持有，生成结束或放弃后释放（结果流可能从未被读取）
+    """
+    try:
+        for index, content, cached in handle.service.iter_cached_batch_generate(prompts, config,
+                                                                                model_registry.response_cache,
+                                                                                model_registry.semantic_cache):
+            item = {"index": index, "result": content, "cached": cached}
+            if not _put_result(loop, results, stopped, item):
+                return
+    except Exception as e:
+        _put_result(loop, results, stopped, {"error": str(e)})
+    finally:
+        _put_result(loop, results, stopped, None)
+        model_registry.release(handle)
+
+
+async def _stream_batch(handle: ModelHandle, prompts: List[str], config: Dict[str, Any]) -> AsyncGenerator[str, None]:
+    """批量推理结果以NDJSON逐行输出，最后一行为汇总"""
+    results: asyncio.Queue = asyncio.Queue(maxsize=max(config['batch_size'] * 2, 16))
+    stopped = Event()
+    # 入队失败（队列已满）时直接抛出，由调用方返回429并释放模型
+    worker_pool.submit(_produce_batch, asyncio.get_running_loop(), results, stopped, handle, prompts, config)
+
+    async def lines() -> AsyncGenerator[str, None]:
+        completed = cache_hits = 0
+        try:
+            while True:
+                item = await results.get()
+                if item is None:
+                    break
+                if 'error' not in item:
+                    completed += 1
+                    cache_hits += item['cached']
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+            yield json.dumps({"done": True, "total": len(prompts), "completed": completed,
+                              "cache_hits": cache_hits}) + "\n"
+        finally:
+            # 客户端提前断开：通知生产者停止，并清空队列让阻塞中的写入返回
+            stopped.set()
+            while not results.empty():
+                results.get_nowait()
+
+    return lines()
+
+
+@router.post("/batch")
+async def batch_inference(request: BatchInferenceRequest):
+    """批量推理（stream为True时以NDJSON逐条返回）"""
+    _check_n_best(request.n, request.temperature)
+    handle = await _acquire_model(request)
+
+    streaming = False
     try:
-        messages = [msg.dict() for msg in request.messages]
         config = {
             'max_new_tokens': request.max_tokens,
             'temperature': request.temperature,
-            'top_p': request.top_p,
-            'top_k': request.top_k,
-            'enable_thinking': request.enable_thinking
+            'seed': request.seed,
+            'batch_size': request.batch_size,
+            'length_bucketing': request.length_bucketing,
+            'adapter_id': request.adapter_id,
+            'n': request.n
         }
 
-        return StreamingResponse(
-            inference_service.generate_stream(messages, config),
-            media_type="text/event-stream"
+        if request.stream:
+            # 模型引用由后台生产者在生成结束后释放
+            stream = await _stream_batch(handle, request.prompts, config)
+            streaming = True
+            return StreamingResponse(stream, media_type="application/x-ndjson")
+
+        results, cache_hits = await asyncio.wrap_future(worker_pool.submit(
+            handle.service.cached_batch_generate, request.prompts, config, model_registry.response_cache,
+            model_registry.semantic_cache
+        ))
+
+        return BaseResponse(
+            success=True,
+            message=f"批量推理完成，共 {len(results)} 条",
+            data={"results": results, "cache_hits": cache_hits}
         )
+    except QueueFullError as e:
+        raise _queue_full(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not streaming:
+            await _release_model(handle)
 
 
-@router.post("/batch", response_model=BaseResponse)
-async def batch_inference(request: BatchInferenceRequest):
-    """批量推理"""
-    global inference_service
+@router.get("/engine/stats", response_model=BaseResponse)
+async def engine_stats():
+    """默认模型推理引擎运行统计"""
+    if model_registry is None or not model_registry.default_key:
+        raise HTTPException(status_code=503, detail="推理服务未初始化")
 
-    # 如果提供了model_path，动态初始化服务
-    if request.model_path:
-        inference_service = InferenceService(request.model_path)
+    handle = model_registry.handles.get(model_registry.default_key)
+    return BaseResponse(
+        success=True,
+        message="推理引擎统计",
+        data=handle.engine.stats() if handle else None
+    )
 
-    if not inference_service:
-        raise HTTPException(status_code=503, detail="推理服务未初始化")
 
-    try:
-        config = {
-            'max_new_tokens': request.max_tokens,
-            'temperature': request.temperature
+@router.get("/queue/stats", response_model=BaseResponse)
+async def queue_stats():
+    """推理队列深度与等待时间"""
+    registry = get_registry()
+    engines = {}
+    for handle in list(registry.handles.values()):
+        stats = handle.engine.stats()
+        engines[handle.key[0]] = {
+            name: stats[name] for name in
+            ('waiting', 'max_queue_size', 'running', 'total_rejected', 'avg_queue_wait_seconds', 'max_queue_wait_seconds')
+        }
+
+    return BaseResponse(
+        success=True,
+        message="推理队列统计",
+        data={
+            "engines": engines,
+            "workers": worker_pool.stats() if worker_pool else None
+        }
+    )
+
+
+@router.get("/cache/stats", response_model=BaseResponse)
+async def response_cache_stats():
+    """响应缓存、语义缓存命中与相同请求合并统计"""
+    registry = get_registry()
+    return BaseResponse(
+        success=True,
+        message="响应缓存统计",
+        data={
+            "response_cache": registry.response_cache.stats() if registry.response_cache is not None else None,
+            "semantic_cache": registry.semantic_cache.stats() if registry.semantic_cache is not None else None,
+            "single_flight": single_flight.stats()
         }
+    )
+
+
+@router.delete("/sessions/{session_id}", response_model=BaseResponse)
+async def drop_session(session_id: str):
+    """删除会话在各个已加载模型上保存的KV"""
+    registry = get_registry()
+    loop = asyncio.get_event_loop()
+    dropped = 0
+    for handle in list(registry.handles.values()):
+        service = handle.service
+        if service is not None and await loop.run_in_executor(None, service.drop_session, session_id):
+            dropped += 1
+
+    return BaseResponse(
+        success=True,
+        message="会话已删除" if dropped else "会话不存在",
+        data={"session_id": session_id, "models": dropped}
+    )
+
+
+@router.get("/models", response_model=BaseResponse)
+async def list_models():
+    """列出已加载的模型"""
+    registry = get_registry()
+    models = registry.list_models()
+
+    return BaseResponse(
+        success=True,
+        message=f"共 {len(models)} 个已加载模型",
+        data={
+            "models": models,
+            "total_size_mb": round(registry.total_bytes() / 1024 / 1024, 2),
+            "max_models": registry.max_models
+        }
+    )
+
 
-        results = inference_service.batch_generate(request.prompts, config)
+@router.post("/models/load", response_model=BaseResponse)
+async def load_model(request: ModelLoadRequest):
+    """加载模型到注册表"""
+    registry = get_registry()
+
+    try:
+        key = ModelRegistry.make_key(request.model_path, request.lora_adapter_path, request.dtype)
+        loop = asyncio.get_event_loop()
+        handle = await loop.run_in_executor(None, registry.load, key)
+        if request.set_default:
+            registry.default_key = key
 
         return BaseResponse(
             success=True,
-            message=f"批量推理完成，共 {len(results)} 条",
-            data={"results": results}
+            message="模型加载完成",
+            data=handle.to_dict()
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/models/unload", response_model=BaseResponse)
+async def unload_model(request: ModelLoadRequest):
+    """从注册表卸载模型，仍有请求在使用时等其结束后卸载"""
+    registry = get_registry()
+    key = ModelRegistry.make_key(request.model_path, request.lora_adapter_path, request.dtype)
+
+    loop = asyncio.get_event_loop()
+    if not await loop.run_in_executor(None, registry.unload, key):
+        raise HTTPException(status_code=404, detail="模型未加载")
+
+    return BaseResponse(
+        success=True,
+        message="模型已卸载",
+        data={"model_path": key[0], "lora_adapter_path": key[1], "dtype": key[2]}
+    )
+
+
+@router.post("/models/reload", response_model=BaseResponse)
+async def reload_model(request: ModelLoadRequest):
+    """LoRA适配器重新训练后热更新：后台重建合并权重并加载新模型，完成前请求继续使用旧模型"""
+    registry = get_registry()
+    key = ModelRegistry.make_key(request.model_path, request.lora_adapter_path, request.dtype)
+
+    if not registry.reload(key):
+        raise HTTPException(status_code=404, detail="模型未加载")
+
+    return BaseResponse(
+        success=True,
+        message="模型正在后台重新加载",
+        data={"model_path": key[0], "lora_adapter_path": key[1], "dtype": key[2]}
+    )
+
+
+@router.get("/adapters", response_model=BaseResponse)
+async def list_adapters(model_path: Optional[str] = None):
+    """列出模型上注册和已加载的LoRA适配器"""
+    handle = await _acquire_model_by_key(_resolve_key(model_path))
+    try:
+        adapters = handle.service.adapters.list_adapters()
+        return BaseResponse(
+            success=True,
+            message=f"共 {len(adapters)} 个适配器",
+            data={"adapters": adapters}
+        )
+    finally:
+        await _release_model(handle)
+
+
+@router.post("/adapters/load", response_model=BaseResponse)
+async def load_adapter(request: AdapterLoadRequest):
+    """注册LoRA适配器，并可立即加载到共享的基础模型上"""
+    handle = await _acquire_model_by_key(_resolve_key(request.model_path))
+    try:
+        adapters = handle.service.adapters
+        if request.adapter_path:
+            adapters.register(request.adapter_id, request.adapter_path)
+            # 适配器权重可能已变化，旧的缓存结果失效
+            if model_registry.response_cache is not None:
+                model_registry.response_cache.invalidate(handle.service.model_id, adapter=request.adapter_id)
+            if model_registry.semantic_cache is not None:
+                model_registry.semantic_cache.invalidate(handle.service.model_id, adapter=request.adapter_id)
+        if request.preload:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, adapters.preload, adapters.resolve(request.adapter_id))
+
+        return BaseResponse(
+            success=True,
+            message="适配器已就绪",
+            data={"adapters": adapters.list_adapters()}
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await _release_model(handle)
+
+
+@router.post("/adapters/unload", response_model=BaseResponse)
+async def unload_adapter(request: AdapterLoadRequest):
+    """从内存卸载LoRA适配器（注册信息保留，下次请求时重新加载）"""
+    handle = await _acquire_model_by_key(_resolve_key(request.model_path))
+    try:
+        loop = asyncio.get_event_loop()
+        unloaded = await loop.run_in_executor(None, handle.service.adapters.unload, request.adapter_id)
+        if not unloaded:
+            raise HTTPException(status_code=404, detail="适配器未加载或为常驻适配器")
+
+        return BaseResponse(
+            success=True,
+            message="适配器已卸载",
+            data={"adapters": handle.service.adapters.list_adapters()}
+        )
+    finally:
+        await _release_model(handle)
@@ -9,6 +9,7 @@ class EvalRequest(BaseModel):
     metrics: List[str] = Field(default=['accuracy', 'loss'], description="评估指标")
     batch_size: int = Field(default=8, description="批次大小")
     lora_adapter_path: Optional[str] = Field(default=None, description="lora地址")
+    merge_lora: bool = Field(default=False, description="是否将LoRA合并进权重后评估（复用合并权重缓存）")
 
 class EvalResult(BaseModel):
     """评估结果模型"""
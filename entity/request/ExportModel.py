@@ -8,6 +8,7 @@ class ExportRequest(BaseModel):
     export_format: Literal['onnx', 'torchscript', 'safetensors'] = Field(default='onnx', description="导出格式")
     output_path: str = Field(..., description="输出路径")
     opset_version: int = Field(default=14, description="ONNX opset版本")
+    with_past: bool = Field(default=False, description="是否导出KV缓存输入输出（ONNX推理后端可复用KV）")
 
 
 class ExportResponse(BaseModel):
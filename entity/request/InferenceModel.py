@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 
 
 class ChatMessage(BaseModel):
@@ -13,20 +13,43 @@ class ChatRequest(BaseModel):
     model_config = ConfigDict(protected_namespaces=())
 
     model_path: Optional[str] = Field(default=None, description="模型路径（可选，用于动态加载）")
+    lora_adapter_path: Optional[str] = Field(default=None, description="LoRA适配器路径（可选，与model_path一起使用）")
+    dtype: str = Field(default="bfloat16", description="权重精度: bfloat16, float16, float32, int8（CPU动态量化，LoRA合并后量化）")
+    adapter_id: Optional[str] = Field(default=None, description="LoRA适配器id（共享基础模型，__base__表示不使用适配器）")
     messages: List[ChatMessage] = Field(..., description="对话消息列表")
     max_tokens: int = Field(default=512, description="最大生成token数")
     temperature: float = Field(default=0.7, description="温度参数")
     top_p: float = Field(default=0.8, description="top_p采样")
     top_k: int = Field(default=20, description="top_k采样")
+    seed: Optional[int] = Field(default=None, description="随机种子（指定后采样结果可复现，并可命中响应缓存）")
     stream: bool = Field(default=False, description="是否流式输出")
     enable_thinking: bool = Field(default=False, description="是否启用thinking模式")
+    speculative: Optional[bool] = Field(default=None, description="是否使用投机解码（为空时使用配置文件中的默认值）")
+    num_speculative_tokens: Optional[int] = Field(default=None, ge=1, description="投机解码每轮草稿token数")
+    stop: Optional[List[str]] = Field(default=None, description="停止序列（输出中出现时截断并结束）")
+    session_id: Optional[str] = Field(default=None, description="多轮对话会话id（指定后服务端保存本轮结束时的KV，下一轮只prefill新增的消息）")
+    timeout_seconds: Optional[float] = Field(default=None, gt=0, description="请求的墙钟时间上限（秒），超时返回已生成的部分，不超过服务端的inference.budgets.max_request_seconds")
+    n: int = Field(default=1, ge=1, le=16, description="采样的候选数（提示词只prefill一次，各候选在同一批次中解码；大于1时需要temperature > 0，不支持流式输出与投机解码）")
+    json_schema: Optional[Dict[str, Any]] = Field(default=None, description="约束解码：输出必须符合的JSON Schema（属性按声明顺序输出；字符串maxLength只在64以内严格限制，minLength不能超过64；不支持thinking模式与投机解码）")
+    regex: Optional[str] = Field(default=None, description="约束解码：输出必须完整匹配的正则表达式（与json_schema二选一）")
+
+
+class ChatChoice(BaseModel):
+    """n-best采样的一个候选"""
+    index: int = Field(..., description="采样序号")
+    content: str = Field(..., description="生成的内容")
+    thinking_content: Optional[str] = Field(default=None, description="思考过程内容")
+    finish_reason: str = Field(default="stop", description="结束原因")
+    cumulative_logprob: float = Field(..., description="生成token的累计对数概率")
 
 
 class ChatResponse(BaseModel):
     """聊天响应模型"""
-    content: str = Field(..., description="生成的内容")
+    content: str = Field(..., description="生成的内容（n大于1时为累计对数概率最高的候选）")
     thinking_content: Optional[str] = Field(default=None, description="思考过程内容")
     finish_reason: str = Field(default="stop", description="结束原因")
+    choices: Optional[List[ChatChoice]] = Field(default=None, description="n大于1时的全部候选，按累计对数概率从高到低排列")
+    metrics: Optional[Dict[str, Any]] = Field(default=None, description="本次请求的推理统计")
 
 
 class BatchInferenceRequest(BaseModel):
@@ -34,6 +57,52 @@ class BatchInferenceRequest(BaseModel):
     model_config = ConfigDict(protected_namespaces=())
 
     model_path: Optional[str] = Field(default=None, description="模型路径（可选，用于动态加载）")
+    lora_adapter_path: Optional[str] = Field(default=None, description="LoRA适配器路径（可选，与model_path一起使用）")
+    dtype: str = Field(default="bfloat16", description="权重精度: bfloat16, float16, float32, int8（CPU动态量化，LoRA合并后量化）")
+    adapter_id: Optional[str] = Field(default=None, description="LoRA适配器id（共享基础模型，__base__表示不使用适配器）")
     prompts: List[str] = Field(..., description="提示词列表")
     max_tokens: int = Field(default=512, description="最大生成token数")
     temperature: float = Field(default=0.7, description="温度参数")
+    seed: Optional[int] = Field(default=None, description="随机种子（指定后采样结果可复现，并可命中响应缓存）")
+    batch_size: int = Field(default=8, ge=1, description="每个micro-batch的提示词数")
+    length_bucketing: bool = Field(default=True, description="是否按提示词长度分桶，减少补齐浪费")
+    stream: bool = Field(default=False, description="是否以NDJSON逐条返回结果（每个micro-batch完成后立即输出，带提示词序号）")
+    n: int = Field(default=1, ge=1, le=16, description="每个提示词采样的候选数（提示词只prefill一次；大于1时需要temperature > 0，每条结果为按累计对数概率排列的候选列表，不使用响应缓存）")
+
+
+class BulkInferenceRequest(BaseModel):
+    """离线批量推理任务请求"""
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_path: Optional[str] = Field(default=None, description="模型路径（为空时使用默认模型）")
+    lora_adapter_path: Optional[str] = Field(default=None, description="LoRA适配器路径（可选，与model_path一起使用）")
+    dtype: str = Field(default="bfloat16", description="权重精度: bfloat16, float16, float32, int8（CPU动态量化，LoRA合并后量化）")
+    adapter_id: Optional[str] = Field(default=None, description="LoRA适配器id（共享基础模型，__base__表示不使用适配器）")
+    input_path: str = Field(..., description="输入JSONL路径，每行一个JSON对象")
+    output_path: str = Field(..., description="输出JSONL路径，每行包含输入行号、id和生成结果")
+    prompt_field: str = Field(default="prompt", description="输入行中提示词的字段名")
+    max_tokens: int = Field(default=512, description="最大生成token数")
+    temperature: float = Field(default=0.7, description="温度参数")
+    seed: Optional[int] = Field(default=None, description="随机种子")
+    batch_size: int = Field(default=8, ge=1, description="每个micro-batch的提示词数")
+    resume: bool = Field(default=True, description="输出路径存在检查点时是否从断点继续（否则从头开始并覆盖输出）")
+
+
+class ModelLoadRequest(BaseModel):
+    """模型加载/卸载请求"""
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_path: str = Field(..., description="模型路径")
+    lora_adapter_path: Optional[str] = Field(default=None, description="LoRA适配器路径")
+    dtype: str = Field(default="bfloat16", description="权重精度: bfloat16, float16, float32, int8（CPU动态量化，LoRA合并后量化）")
+    set_default: bool = Field(default=False, description="是否设为未指定model_path时使用的默认模型")
+
+
+class AdapterLoadRequest(BaseModel):
+    """LoRA适配器注册/加载请求"""
+    model_config = ConfigDict(protected_namespaces=())
+
+    adapter_id: str = Field(..., description="适配器id")
+    adapter_path: Optional[str] = Field(default=None, description="适配器路径（注册新适配器时必填）")
+    model_path: Optional[str] = Field(default=None, description="基础模型路径（为空时使用默认模型）")
+    preload: bool = Field(default=True, description="是否立即加载到内存")
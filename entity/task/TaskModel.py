@@ -29,3 +29,24 @@ class TrainTask(BaseModel):
     current_step: int = Field(default=0, description="当前步数")
     total_steps: int = Field(default=0, description="总步数")
     metrics: Optional[Dict[str, Any]] = Field(default=None, description="训练指标")
+
+
+class BulkInferenceTask(BaseModel):
+    """离线批量推理任务模型"""
+    task_id: str = Field(..., description="任务ID")
+    status: TaskStatus = Field(default=TaskStatus.PENDING, description="任务状态")
+    input_path: str = Field(..., description="输入JSONL路径")
+    output_path: str = Field(..., description="输出JSONL路径")
+    config: Dict[str, Any] = Field(..., description="推理配置")
+    created_at: str = Field(default_factory=lambda: datetime.now().isoformat(), description="创建时间")
+    started_at: Optional[str] = Field(default=None, description="开始时间")
+    completed_at: Optional[str] = Field(default=None, description="完成时间")
+    error_message: Optional[str] = Field(default=None, description="错误信息")
+    progress: float = Field(default=0.0, description="进度 0-100（按输入文件已读取的字节数计算）")
+    processed_lines: int = Field(default=0, description="已处理的输入行数（含从检查点恢复的行数）")
+    failed_lines: int = Field(default=0, description="解析或生成失败的行数")
+    resumed_from_line: int = Field(default=0, description="从检查点恢复时的起始行号")
+    byte_offset: int = Field(default=0, description="输入文件已处理到的字节偏移")
+    total_bytes: int = Field(default=0, description="输入文件大小")
+    lines_per_second: float = Field(default=0.0, description="本次运行的吞吐（行/秒）")
+    eta_seconds: Optional[float] = Field(default=None, description="预计剩余时间（秒）")
@@ -3,7 +3,8 @@ from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import yaml
 from util.WinConstant import Constant
-from controller import DataController, TrainController, InferenceController, EvalController, ExportController
+from controller import DataController, TrainController, InferenceController, EvalController, ExportController, \
+    BulkInferenceController
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -27,6 +28,7 @@ app.include_router(TrainController.router)
 app.include_router(InferenceController.router)
 app.include_router(EvalController.router)
 app.include_router(ExportController.router)
+app.include_router(BulkInferenceController.router)
 
 
 @app.on_event("startup")
@@ -42,6 +44,11 @@ async def startup_event():
             config = yaml.safe_load(f)
             print(f"配置文件加载成功: {Constant.CONFIG_PATH}")
 
+        # 创建模型注册表与推理队列
+        InferenceController.configure(config)
+        BulkInferenceController.configure(config)
+        EvalController.configure(config)
+
         # 初始化推理服务（可选）
         if config.get('inference', {}).get('auto_load', False):
             model_path = config['model']['base_model_path']
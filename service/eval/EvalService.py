@@ -5,6 +5,7 @@ from transformers import AutoTokenizer, AutoModelForCausalLM
 from datasets import load_dataset
 import torch
 import time
+from service.inference.MergedModelCache import MergedModelCache
 from evalscope.run import run_task
 from evalscope.summarizer import Summarizer
 
@@ -12,11 +13,15 @@ from evalscope.summarizer import Summarizer
 class EvalService:
     """评估服务 - 集成evalscope评测"""
 
-    def __init__(self):
-        pass
+    def __init__(self, merged_config: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            merged_config: config.yaml中的inference.merged_lora配置，合并后的LoRA权重与推理服务共用缓存
+        """
+        self.merged_config = merged_config or {}
 
     def evaluate_model(self, model_path: str, dataset_path: str, metrics: List[str], batch_size: int = 8,
-                       lora_adapter_path: Optional[str] = None) -> Dict[str, Any]:
+                       lora_adapter_path: Optional[str] = None, merge_lora: bool = False) -> Dict[str, Any]:
         """
         评估模型性能
         Args:
@@ -24,6 +29,7 @@ class EvalService:
             dataset_path: 数据集路径
             metrics: 评估指标列表
             batch_size: 批次大小
+            merge_lora: 是否将LoRA合并进权重后评估（配置了缓存目录时复用合并权重缓存）
         Returns:
             评估结果
         """
@@ -33,15 +39,20 @@ class EvalService:
         try:
             # 加载模型和tokenizer
             tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
-            model = AutoModelForCausalLM.from_pretrained(
-                model_path,
-                device_map="auto",
-                dtype=torch.bfloat16
-            )
-            # 如果提供了LoRA适配器路径，加载适配器
-            if lora_adapter_path:
-                print(f"加载LoRA适配器: {lora_adapter_path}")
-                model = PeftModel.from_pretrained(model, lora_adapter_path)
+            if lora_adapter_path and merge_lora and self.merged_config.get('cache_dir'):
+                model = MergedModelCache.from_config(self.merged_config).load(model_path, lora_adapter_path, "bfloat16")
+            else:
+                model = AutoModelForCausalLM.from_pretrained(
+                    model_path,
+                    device_map="auto",
+                    dtype=torch.bfloat16
+                )
+                # 如果提供了LoRA适配器路径，加载适配器
+                if lora_adapter_path:
+                    print(f"加载LoRA适配器: {lora_adapter_path}")
+                    model = PeftModel.from_pretrained(model, lora_adapter_path)
+                    if merge_lora:
+                        model = model.merge_and_unload()
 
             # 加载数据集
             dataset = load_dataset("json", data_files=dataset_path, split="train")
@@ -1,7 +1,27 @@
 import torch
 import os
 from typing import Dict, Any
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, DynamicCache
+
+
+class CausalLMWithPast(torch.nn.Module):
+    """导出包装 - 以扁平张量传入/传出每层KV，使ONNX图支持KV缓存复用"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, position_ids, *past):
+        legacy = tuple((past[i], past[i + 1]) for i in range(0, len(past), 2))
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=DynamicCache.from_legacy_cache(legacy),
+            use_cache=True
+        )
+        presents = [tensor for layer in outputs.past_key_values.to_legacy_cache() for tensor in layer]
+        return (outputs.logits, *presents)
 
 
 class ExportService:
@@ -10,13 +30,15 @@ class ExportService:
     def __init__(self):
         pass
 
-    def export_to_onnx(self, model_path: str, output_path: str, opset_version: int = 14) -> Dict[str, Any]:
+    def export_to_onnx(self, model_path: str, output_path: str, opset_version: int = 14,
+                       with_past: bool = False) -> Dict[str, Any]:
         """
         导出模型为ONNX格式
         Args:
             model_path: 模型路径
             output_path: 输出路径
             opset_version: ONNX opset版本
+            with_past: 是否导出KV缓存输入输出（推理服务的ONNX后端可复用KV）
         Returns:
             导出结果
         """
@@ -28,7 +50,9 @@ class ExportService:
             model = AutoModelForCausalLM.from_pretrained(
                 model_path,
                 device_map="cpu",
-                torch_dtype=torch.float32
+                torch_dtype=torch.float32,
+                # 导出KV缓存时使用eager注意力，便于追踪
+                attn_implementation="eager" if with_past else None
             )
 
             model.eval()
@@ -41,19 +65,22 @@ class ExportService:
 
             print("正在导出ONNX模型...")
 
-            # 导出为ONNX
-            torch.onnx.export(
-                model,
-                (dummy_input['input_ids'],),
-                output_path,
-                opset_version=opset_version,
-                input_names=['input_ids'],
-                output_names=['logits'],
-                dynamic_axes={
-                    'input_ids': {0: 'batch_size', 1: 'sequence'},
-                    'logits': {0: 'batch_size', 1: 'sequence'}
-                }
-            )
+            if with_past:
+                self._export_with_past(model, dummy_input['input_ids'], output_path, opset_version)
+            else:
+                # 导出为ONNX
+                torch.onnx.export(
+                    model,
+                    (dummy_input['input_ids'],),
+                    output_path,
+                    opset_version=opset_version,
+                    input_names=['input_ids'],
+                    output_names=['logits'],
+                    dynamic_axes={
+                        'input_ids': {0: 'batch_size', 1: 'sequence'},
+                        'logits': {0: 'batch_size', 1: 'sequence'}
+                    }
+                )
 
             file_size = os.path.getsize(output_path)
             print(f"ONNX模型导出成功: {output_path}, 文件大小: {file_size} 字节")
@@ -74,3 +101,43 @@ class ExportService:
                 "export_path": None,
                 "file_size": None
             }
+
+    @staticmethod
+    def _export_with_past(model, input_ids: torch.Tensor, output_path: str, opset_version: int):
+        """导出带KV缓存的图，输入输出命名为 past_key_values.{i}.key/value 与 present.{i}.key/value"""
+        config = model.config
+        num_layers = config.num_hidden_layers
+        num_kv_heads = getattr(config, 'num_key_value_heads', None) or config.num_attention_heads
+        head_dim = getattr(config, 'head_dim', None) or config.hidden_size // config.num_attention_heads
+
+        # 示例KV长度取1，避免追踪时把空缓存固化进图
+        past_length = 1
+        sequence_length = input_ids.shape[1]
+        past = []
+        input_names = ['input_ids', 'attention_mask', 'position_ids']
+        output_names = ['logits']
+        dynamic_axes = {
+            'input_ids': {0: 'batch_size', 1: 'sequence'},
+            'attention_mask': {0: 'batch_size', 1: 'total_sequence'},
+            'position_ids': {0: 'batch_size', 1: 'sequence'},
+            'logits': {0: 'batch_size', 1: 'sequence'}
+        }
+        for layer_index in range(num_layers):
+            for kind in ('key', 'value'):
+                past.append(torch.zeros((1, num_kv_heads, past_length, head_dim), dtype=torch.float32))
+                input_names.append(f'past_key_values.{layer_index}.{kind}')
+                output_names.append(f'present.{layer_index}.{kind}')
+                dynamic_axes[input_names[-1]] = {0: 'batch_size', 2: 'past_sequence'}
+                dynamic_axes[output_names[-1]] = {0: 'batch_size', 2: 'total_sequence'}
+
+        attention_mask = torch.ones((1, past_length + sequence_length), dtype=torch.long)
+        position_ids = torch.arange(past_length, past_length + sequence_length).unsqueeze(0)
+        torch.onnx.export(
+            CausalLMWithPast(model),
+            (input_ids, attention_mask, position_ids, *past),
+            output_path,
+            opset_version=opset_version,
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=dynamic_axes
+        )
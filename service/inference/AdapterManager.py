@@ -0,0 +1,193 @@
+from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Condition
+from peft import PeftModel
+import os
+
+# 使用基础模型（不叠加任何适配器）时的适配器名称
+BASE_ADAPTER = "__base__"
+
+
+class AdapterManager:
+    """多LoRA适配器管理 - 多个适配器共享同一个基础模型，按需加载、按批切换、LRU淘汰"""
+
+    def __init__(self, service, adapter_paths: Optional[Dict[str, str]] = None, max_loaded: int = 16,
+                 dynamic: bool = True):
+        """
+        初始化适配器管理器
+        Args:
+            service: 推理服务（持有基础模型）
+            adapter_paths: 适配器id到路径的映射
+            max_loaded: 同时驻留内存的最大适配器数
+            dynamic: 是否允许按请求动态加载适配器（int8量化模型不支持）
+        """
+        self.service = service
+        self.dynamic = dynamic
+        self.adapter_paths: Dict[str, str] = dict(adapter_paths or {})
+        self.max_loaded = max_loaded
+        # 已加载的适配器，按最近使用排序
+        self.loaded: "OrderedDict[str, str]" = OrderedDict()
+        # 适配器被运行中的序列引用的次数，大于0时不会被淘汰
+        self.pins: Dict[str, int] = {}
+        # 初始化时加载的适配器常驻内存
+        self.resident: set = set()
+
+        self.condition = Condition()
+        self.active = BASE_ADAPTER
+        self.active_users = 0
+
+        if isinstance(service.model, PeftModel):
+            self.active = service.model.active_adapter
+            self.loaded[self.active] = service.lora_adapter_path
+            self.resident.add(self.active)
+
+    @property
+    def default_adapter(self) -> str:
+        """请求未指定adapter_id时使用的适配器"""
+        return next(iter(self.resident), BASE_ADAPTER)
+
+    def resolve(self, adapter_id: Optional[str]) -> str:
+        """将请求中的adapter_id解析为已注册的适配器名称"""
+        if not adapter_id:
+            return self.default_adapter
+        if not self.dynamic and adapter_id != self.default_adapter:
+            raise ValueError("该模型不支持按请求切换适配器，请使用lora_adapter_path加载合并后的模型")
+        if adapter_id == BASE_ADAPTER or adapter_id in self.adapter_paths or adapter_id in self.loaded:
+            return adapter_id
+        raise ValueError(f"未注册的适配器: {adapter_id}")
+
+    def register(self, adapter_id: str, adapter_path: str):
+        """注册适配器路径，已加载的同名适配器会在下次使用时重新加载"""
+        if not self.dynamic:
+            raise ValueError("该模型不支持动态加载适配器，请使用lora_adapter_path加载合并后的模型")
+        adapter_path = adapter_path.replace('\\', '/')
+        if not os.path.isdir(adapter_path):
+            raise ValueError(f"适配器路径不存在: {adapter_path}")
+        with self.condition:
+            self.adapter_paths[adapter_id] = adapter_path
+            if adapter_id in self.loaded and self.loaded[adapter_id] != adapter_path:
+                self._wait_idle_locked()
+                self._delete_locked(adapter_id)
+
+    def preload(self, adapter: str):
+        """提前将适配器加载到内存（不切换当前生效的适配器）"""
+        with self.condition:
+            if adapter == BASE_ADAPTER or adapter in self.loaded:
+                return
+            # 注入LoRA层会修改模型结构，需等待正在进行的前向计算结束
+            self._wait_idle_locked()
+            self._load_locked(adapter)
+
+    def unload(self, adapter_id: str) -> bool:
+        """从内存中卸载适配器（注册信息保留）"""
+        with self.condition:
+            if adapter_id not in self.loaded or adapter_id in self.resident:
+                return False
+            while self.pins.get(adapter_id, 0) > 0 or (self.active == adapter_id and self.active_users > 0):
+                self.condition.wait()
+            self._delete_locked(adapter_id)
+            return True
+
+    def pin(self, adapter: str):
+        """运行中的序列引用适配器"""
+        with self.condition:
+            self.pins[adapter] = self.pins.get(adapter, 0) + 1
+
+    def unpin(self, adapter: str):
+        """序列结束，释放适配器引用"""
+        with self.condition:
+            self.pins[adapter] = self.pins.get(adapter, 1) - 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def use(self, adapter: str):
+        """
+        在指定适配器下执行前向计算
+        相同适配器的调用可以并发，切换到其他适配器需等待当前使用者全部退出
+        """
+        with self.condition:
+            while self.active_users > 0 and self.active != adapter:
+                self.condition.wait()
+            if self.active != adapter:
+                self._switch_locked(adapter)
+            elif adapter in self.loaded:
+                self.loaded.move_to_end(adapter)
+            self.active_users += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active_users -= 1
+                self.condition.notify_all()
+
+    def list_adapters(self) -> List[Dict[str, Any]]:
+        """列出已注册和已加载的适配器"""
+        names = list(dict.fromkeys(list(self.loaded.keys()) + list(self.adapter_paths.keys())))
+        return [{
+            'adapter_id': name,
+            'adapter_path': self.adapter_paths.get(name, self.loaded.get(name)),
+            'loaded': name in self.loaded,
+            'active': name == self.active,
+            'in_use': self.pins.get(name, 0),
+            'resident': name in self.resident
+        } for name in names]
+
+    def _wait_idle_locked(self):
+        while self.active_users > 0:
+            self.condition.wait()
+
+    def _switch_locked(self, adapter: str):
+        """切换当前生效的适配器，未加载时先加载"""
+        model = self.service.model
+        if adapter == BASE_ADAPTER:
+            if isinstance(model, PeftModel):
+                model.base_model.disable_adapter_layers()
+            self.active = adapter
+            return
+
+        if adapter not in self.loaded:
+            self._load_locked(adapter)
+            model = self.service.model
+        else:
+            self.loaded.move_to_end(adapter)
+
+        if self.active == BASE_ADAPTER:
+            model.base_model.enable_adapter_layers()
+        model.set_adapter(adapter)
+        self.active = adapter
+
+    def _load_locked(self, adapter: str):
+        adapter_path = self.adapter_paths.get(adapter)
+        if not adapter_path:
+            raise ValueError(f"未注册的适配器: {adapter}")
+
+        self._evict_locked()
+        print(f"加载LoRA适配器: {adapter} ({adapter_path})")
+        if isinstance(self.service.model, PeftModel):
+            self.service.model.load_adapter(adapter_path, adapter_name=adapter)
+        else:
+            self.service.model = PeftModel.from_pretrained(self.service.model, adapter_path, adapter_name=adapter)
+            # 包装后基础模型的其他调用方仍需以基础模型方式运行
+            if self.active == BASE_ADAPTER:
+                self.service.model.base_model.disable_adapter_layers()
+        self.loaded[adapter] = adapter_path
+
+    def _evict_locked(self):
+        """适配器数量达到上限时，淘汰最久未使用且未被引用的适配器"""
+        while len(self.loaded) >= self.max_loaded:
+            victim = next((name for name in self.loaded
+                           if name not in self.resident and name != self.active and self.pins.get(name, 0) <= 0), None)
+            if victim is None:
+                print("适配器数量超出上限，但所有适配器都在使用中，暂不淘汰")
+                return
+            self._delete_locked(victim)
+
+    def _delete_locked(self, adapter: str):
+        model = self.service.model
+        if self.active == adapter:
+            model.base_model.disable_adapter_layers()
+            self.active = BASE_ADAPTER
+        model.delete_adapter(adapter)
+        self.loaded.pop(adapter, None)
+        print(f"卸载LoRA适配器: {adapter}")
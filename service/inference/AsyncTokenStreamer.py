@@ -0,0 +1,54 @@
+from typing import Any, Callable, Dict, Optional
+from transformers.generation.streamers import BaseStreamer
+import asyncio
+
+
+class AsyncTokenStreamer(BaseStreamer):
+    """异步token流 - 后台线程中的generate逐个投递token id，事件循环侧异步消费"""
+
+    _END = object()
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, skip_prompt: bool = True):
+        """
+        初始化token流
+        Args:
+            loop: 消费端所在的事件循环
+            skip_prompt: 是否跳过generate首次投递的提示词token
+        """
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.skip_prompt = skip_prompt
+        self.next_tokens_are_prompt = True
+        self.error: Optional[BaseException] = None
+
+    def put(self, value):
+        """generate每生成一步调用一次（首次为提示词）"""
+        if self.skip_prompt and self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+
+        for token_id in value.reshape(-1).tolist():
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, token_id)
+
+    def end(self):
+        """generate结束时调用"""
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, self._END)
+
+    def run(self, generate_fn: Callable[..., Any], generation_kwargs: Dict[str, Any]):
+        """在后台线程中执行generate，异常会转交给消费端"""
+        try:
+            generate_fn(**generation_kwargs, streamer=self)
+        except BaseException as e:
+            self.error = e
+            self.end()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> int:
+        token_id = await self.queue.get()
+        if token_id is self._END:
+            if self.error is not None:
+                raise self.error
+            raise StopAsyncIteration
+        return token_id
@@ -0,0 +1,226 @@
+from typing import Dict, Any, List, Optional, Tuple
+from entity.task.TaskModel import BulkInferenceTask, TaskStatus
+from service.inference.ModelRegistry import ModelRegistry
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import asyncio
+import uuid
+import json
+import time
+import os
+
+
+class BulkInferenceService:
+    """离线批量推理服务 - 流式读取JSONL，分批生成并逐行写出结果，按检查点记录进度，任务中断后可从断点继续"""
+
+    def __init__(self, max_workers: int = 1, checkpoint_every: int = 64):
+        """
+        初始化离线批量推理服务
+        Args:
+            max_workers: 同时运行的任务数
+            checkpoint_every: 每读取多少行生成一次并写入检查点
+        """
+        self.tasks: Dict[str, BulkInferenceTask] = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.checkpoint_every = checkpoint_every
+
+    @staticmethod
+    def checkpoint_path(output_path: str) -> str:
+        """检查点文件与输出文件放在一起"""
+        return output_path + ".checkpoint.json"
+
+    def create_task(self, input_path: str, output_path: str, config: Dict[str, Any]) -> str:
+        """创建离线批量推理任务"""
+        if not os.path.isfile(input_path):
+            raise ValueError(f"输入文件不存在: {input_path}")
+        for task in self.tasks.values():
+            if task.output_path == output_path and task.status in (TaskStatus.PENDING, TaskStatus.RUNNING):
+                raise ValueError(f"已有任务正在写入该输出文件: {task.task_id}")
+
+        task_id = str(uuid.uuid4())
+        task = BulkInferenceTask(
+            task_id=task_id,
+            status=TaskStatus.PENDING,
+            input_path=input_path,
+            output_path=output_path,
+            config=config,
+            total_bytes=os.path.getsize(input_path)
+        )
+
+        self.tasks[task_id] = task
+        print(f"创建离线批量推理任务: {task_id}, 输入: {input_path}")
+        return task_id
+
+    def cancel_task(self, task_id: str) -> bool:
+        """取消任务，已写入的结果与检查点保留，重新提交相同的输入输出即可继续"""
+        task = self.tasks.get(task_id)
+        if not task or task.status not in (TaskStatus.PENDING, TaskStatus.RUNNING):
+            return False
+        task.status = TaskStatus.CANCELLED
+        return True
+
+    def _load_checkpoint(self, task: BulkInferenceTask) -> Dict[str, Any]:
+        """读取检查点；不续跑、检查点属于其他输入文件或输出文件已短于检查点时从头开始"""
+        checkpoint_path = self.checkpoint_path(task.output_path)
+        if task.config.get('resume', True) and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            output_size = os.path.getsize(task.output_path) if os.path.exists(task.output_path) else 0
+            if checkpoint.get('input_path') != task.input_path:
+                print(f"检查点属于其他输入文件，从头开始: {checkpoint.get('input_path')}")
+            elif output_size < checkpoint['output_offset']:
+                # 输出文件在检查点之后被删除或截短，按检查点续跑会在文件中留下空字节
+                print(f"输出文件短于检查点记录的位置（{output_size} < {checkpoint['output_offset']}），从头开始")
+            else:
+                return checkpoint
+        return {'byte_offset': 0, 'line_offset': 0, 'output_offset': 0, 'failed_lines': 0}
+
+    def _save_checkpoint(self, task: BulkInferenceTask, line_offset: int, output_offset: int, completed: bool = False):
+        """原子写入检查点：先写临时文件再替换"""
+        checkpoint_path = self.checkpoint_path(task.output_path)
+        temp_path = checkpoint_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'input_path': task.input_path,
+                'byte_offset': task.byte_offset,
+                'line_offset': line_offset,
+                'output_offset': output_offset,
+                'failed_lines': task.failed_lines,
+                'completed': completed,
+                'updated_at': datetime.now().isoformat()
+            }, f, ensure_ascii=False)
+        os.replace(temp_path, checkpoint_path)
+
+    def _execute_task(self, task_id: str, registry: ModelRegistry):
+        """执行离线批量推理任务"""
+        task = self.tasks[task_id]
+        if task.status == TaskStatus.CANCELLED:
+            return
+
+        handle = None
+        try:
+            task.status = TaskStatus.RUNNING
+            task.started_at = datetime.now().isoformat()
+            print(f"开始执行离线批量推理任务: {task_id}")
+
+            checkpoint = self._load_checkpoint(task)
+            if checkpoint.get('completed'):
+                print(f"检查点显示任务已完成: {task.output_path}")
+                task.byte_offset = task.total_bytes
+                task.processed_lines = checkpoint['line_offset']
+                task.progress = 100.0
+                task.status = TaskStatus.COMPLETED
+                task.completed_at = datetime.now().isoformat()
+                return
+
+            task.byte_offset = checkpoint['byte_offset']
+            task.failed_lines = checkpoint.get('failed_lines', 0)
+            task.resumed_from_line = checkpoint['line_offset']
+            task.processed_lines = checkpoint['line_offset']
+            if task.resumed_from_line:
+                print(f"从检查点恢复: 第 {task.resumed_from_line} 行")
+
+            model_key = tuple(task.config['model_key'])
+            print(f"正在加载模型: {model_key[0]}")
+            handle = registry.acquire(model_key)
+
+            output_dir = os.path.dirname(os.path.abspath(task.output_path))
+            os.makedirs(output_dir, exist_ok=True)
+            with open(task.input_path, 'rb') as input_file, open(task.output_path, 'ab') as output_file:
+                # 丢弃上次检查点之后写出的不完整结果
+                output_file.truncate(checkpoint['output_offset'])
+                output_file.seek(checkpoint['output_offset'])
+                input_file.seek(task.byte_offset)
+                self._process(task, handle, registry, input_file, output_file)
+
+            if task.status == TaskStatus.CANCELLED:
+                print(f"离线批量推理任务已取消: {task_id}, 已处理 {task.processed_lines} 行")
+                return
+
+            task.status = TaskStatus.COMPLETED
+            task.completed_at = datetime.now().isoformat()
+            task.eta_seconds = 0.0
+            print(f"离线批量推理任务完成: {task_id}, 共 {task.processed_lines} 行")
+
+        except Exception as e:
+            task.status = TaskStatus.FAILED
+            task.error_message = str(e)
+            print(f"离线批量推理任务失败: {task_id}, 错误: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            if handle is not None:
+                registry.release(handle)
+
+    def _process(self, task: BulkInferenceTask, handle, registry: ModelRegistry, input_file, output_file):
+        """逐行读取输入，每 checkpoint_every 行生成一次、写出结果并更新检查点"""
+        config = task.config
+        prompt_field = config.get('prompt_field', 'prompt')
+        line_number = task.processed_lines
+        start_time = time.time()
+        start_offset = task.byte_offset
+        start_line = line_number
+
+        while task.status == TaskStatus.RUNNING:
+            chunk: List[Tuple[int, Dict[str, Any]]] = []
+            errors: List[Dict[str, Any]] = []
+            while len(chunk) + len(errors) < self.checkpoint_every:
+                raw = input_file.readline()
+                if not raw:
+                    break
+                line_number += 1
+                if not raw.strip():
+                    continue
+                try:
+                    record = json.loads(raw)
+                    if not isinstance(record, dict) or not isinstance(record.get(prompt_field), str):
+                        raise ValueError(f"缺少字段: {prompt_field}")
+                    chunk.append((line_number, record))
+                except ValueError as e:
+                    errors.append({'line': line_number, 'error': str(e)})
+            if not chunk and not errors and line_number == task.processed_lines:
+                break
+
+            lines = [json.dumps(error, ensure_ascii=False) for error in errors]
+            if chunk:
+                results, _ = handle.service.cached_batch_generate(
+                    [record[prompt_field] for _, record in chunk], config, registry.response_cache
+                )
+                for (number, record), content in zip(chunk, results):
+                    lines.append(json.dumps({'line': number, 'id': record.get('id'), 'result': content},
+                                            ensure_ascii=False))
+
+            if lines:
+                output_file.write(("\n".join(lines) + "\n").encode('utf-8'))
+            output_file.flush()
+            os.fsync(output_file.fileno())
+
+            task.byte_offset = input_file.tell()
+            task.processed_lines = line_number
+            task.failed_lines += len(errors)
+            self._save_checkpoint(task, line_number, output_file.tell())
+
+            # 吞吐与剩余时间按本次运行的字节速度估算
+            elapsed = time.time() - start_time
+            task.progress = task.byte_offset / task.total_bytes * 100 if task.total_bytes else 100.0
+            task.lines_per_second = (line_number - start_line) / elapsed if elapsed > 0 else 0.0
+            bytes_per_second = (task.byte_offset - start_offset) / elapsed if elapsed > 0 else 0.0
+            if bytes_per_second > 0:
+                task.eta_seconds = (task.total_bytes - task.byte_offset) / bytes_per_second
+
+        if task.status == TaskStatus.RUNNING:
+            self._save_checkpoint(task, line_number, output_file.tell(), completed=True)
+            task.progress = 100.0
+
+    async def start_task_async(self, task_id: str, registry: ModelRegistry):
+        """异步启动离线批量推理任务"""
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.executor, self._execute_task, task_id, registry)
+
+    def get_task_status(self, task_id: str) -> Optional[BulkInferenceTask]:
+        """获取任务状态"""
+        return self.tasks.get(task_id)
+
+    def get_all_tasks(self) -> Dict[str, BulkInferenceTask]:
+        """获取所有任务"""
+        return self.tasks
@@ -0,0 +1,180 @@
+from typing import Dict, Any, List, Optional, Tuple
+from service.inference.KVCacheUtil import KVCacheUtil, LegacyCache
+import bisect
+import torch
+import time
+
+
+class CompiledDecoder:
+    """
+    torch.compile解码路径 - 解码步的批大小与KV长度向上取整到配置的分桶，KV复制进预先分配的静态缓冲区，
+    每个分桶的输入形状固定，重新编译次数不超过分桶数；CPU上省去大部分Python与算子分发开销。
+    超出最大分桶或编译失败时返回None，由调用方按eager模式计算
+    """
+
+    def __init__(self, model, config: Optional[Dict[str, Any]] = None):
+        """
+        初始化编译解码器
+        Args:
+            model: 已加载的模型（不含动态加载的LoRA适配器）
+            config: config.yaml中的inference.compile配置
+        """
+        config = config or {}
+        self.model = model
+        self.batch_buckets: List[int] = sorted(config.get('batch_buckets', [1, 2, 4, 8]))
+        self.length_buckets: List[int] = sorted(config.get('length_buckets', [128, 256, 512, 1024]))
+        self.failed = False
+        self.failed_buckets: set = set()
+        self.compiled_buckets: set = set()
+
+        model_config = model.config
+        num_layers = model_config.num_hidden_layers
+        num_kv_heads = getattr(model_config, 'num_key_value_heads', None) or model_config.num_attention_heads
+        head_dim = getattr(model_config, 'head_dim', None) or model_config.hidden_size // model_config.num_attention_heads
+        self.kv_shape = (num_kv_heads, head_dim)
+        # 每层一块按最大分桶分配的连续存储，各分桶从头部取出连续视图，内存只按最大分桶占用一次
+        size = self.batch_buckets[-1] * num_kv_heads * self.length_buckets[-1] * head_dim
+        self.key_buffers = [torch.zeros(size, dtype=model.dtype, device=model.device) for _ in range(num_layers)]
+        self.value_buffers = [torch.zeros(size, dtype=model.dtype, device=model.device) for _ in range(num_layers)]
+
+        # 每个分桶的输入形状固定，放宽dynamo的重新编译上限
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit,
+                                                    len(self.batch_buckets) * len(self.length_buckets) * 2)
+        self.compiled = torch.compile(
+            model.forward,
+            dynamic=False,
+            backend=config.get('backend', 'inductor'),
+            mode=config.get('mode')
+        )
+
+        # 统计信息：分桶 -> 编译耗时、步数、token数、耗时
+        self.bucket_stats: Dict[Tuple[int, int], Dict[str, float]] = {}
+        self.eager_steps = 0
+
+    def bucket(self, batch_size: int, kv_length: int) -> Optional[Tuple[int, int]]:
+        """向上取整到分桶，超出最大分桶时返回None"""
+        batch_index = bisect.bisect_left(self.batch_buckets, batch_size)
+        length_index = bisect.bisect_left(self.length_buckets, kv_length)
+        if batch_index == len(self.batch_buckets) or length_index == len(self.length_buckets):
+            return None
+        return self.batch_buckets[batch_index], self.length_buckets[length_index]
+
+    def warmup(self):
+        """按配置的全部分桶各执行一次解码，模型加载时完成编译"""
+        for batch_bucket in self.batch_buckets:
+            for length_bucket in self.length_buckets:
+                if self.failed:
+                    return
+                input_ids = torch.zeros((batch_bucket, 1), dtype=torch.long, device=self.model.device)
+                attention_mask = torch.ones((batch_bucket, length_bucket + 1), dtype=torch.long, device=self.model.device)
+                position_ids = torch.full((batch_bucket, 1), length_bucket, dtype=torch.long, device=self.model.device)
+                start_time = time.time()
+                with torch.inference_mode():
+                    self._run((batch_bucket, length_bucket), input_ids, attention_mask, position_ids, None, length_bucket)
+                stats = self._stats_for((batch_bucket, length_bucket))
+                stats['compile_seconds'] = time.time() - start_time
+                print(f"编译解码分桶 batch={batch_bucket}, length={length_bucket}: {stats['compile_seconds']:.1f}秒")
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, position_ids: torch.Tensor,
+                past: Optional[LegacyCache]) -> Optional[Tuple[torch.Tensor, LegacyCache]]:
+        """
+        编译后的一步解码，输入输出与eager模式的 model(...) 一致
+        Args:
+            input_ids: [batch, 1]
+            attention_mask: [batch, kv_len + 1]，左侧补齐
+            position_ids: [batch, 1]
+            past: 左侧补齐的KV，每层 [batch, kv_heads, kv_len, head_dim]
+        Returns:
+            (最后一个位置的logits [batch, vocab], 新的KV [batch, kv_heads, kv_len + 1, head_dim])；
+            无法使用编译路径时返回None
+        """
+        batch_size = input_ids.shape[0]
+        kv_length = KVCacheUtil.seq_length(past)
+        bucket = self.bucket(batch_size, kv_length)
+        if self.failed or bucket is None or bucket in self.failed_buckets:
+            self.eager_steps += 1
+            return None
+
+        start_time = time.time()
+        result = self._run(bucket, input_ids, attention_mask, position_ids, past, kv_length)
+        if result is None:
+            self.eager_steps += 1
+            return None
+        stats = self._stats_for(bucket)
+        stats['steps'] += 1
+        stats['tokens'] += batch_size
+        stats['seconds'] += time.time() - start_time
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """各分桶的编译耗时与吞吐"""
+        return {
+            'enabled': not self.failed,
+            'eager_steps': self.eager_steps,
+            'buckets': [{
+                'batch': batch_bucket,
+                'length': length_bucket,
+                'compile_seconds': round(stats['compile_seconds'], 2),
+                'steps': int(stats['steps']),
+                'tokens_per_second': stats['tokens'] / stats['seconds'] if stats['seconds'] > 0 else 0.0,
+                'failed': (batch_bucket, length_bucket) in self.failed_buckets
+            } for (batch_bucket, length_bucket), stats in sorted(self.bucket_stats.items())]
+        }
+
+    def _run(self, bucket: Tuple[int, int], input_ids: torch.Tensor, attention_mask: torch.Tensor,
+             position_ids: torch.Tensor, past: Optional[LegacyCache],
+             kv_length: int) -> Optional[Tuple[torch.Tensor, LegacyCache]]:
+        """补齐到分桶形状后执行编译的前向计算，只取回真实的行与位置"""
+        batch_bucket, length_bucket = bucket
+        batch_size = input_ids.shape[0]
+        offset = length_bucket - kv_length
+        device = input_ids.device
+
+        buffers = []
+        for layer_index in range(len(self.key_buffers)):
+            key = self._view(self.key_buffers[layer_index], batch_bucket, length_bucket)
+            value = self._view(self.value_buffers[layer_index], batch_bucket, length_bucket)
+            if past is not None:
+                key[:batch_size, :, offset:].copy_(past[layer_index][0])
+                value[:batch_size, :, offset:].copy_(past[layer_index][1])
+            buffers.append((key, value))
+
+        # 补齐的行只关注自身位置，避免整行被遮蔽
+        padded_mask = torch.zeros((batch_bucket, length_bucket + 1), dtype=attention_mask.dtype, device=device)
+        padded_mask[:batch_size, offset:] = attention_mask
+        padded_mask[batch_size:, -1] = 1
+        padded_ids = torch.zeros((batch_bucket, 1), dtype=input_ids.dtype, device=device)
+        padded_ids[:batch_size] = input_ids
+        padded_positions = torch.zeros((batch_bucket, 1), dtype=position_ids.dtype, device=device)
+        padded_positions[:batch_size] = position_ids
+
+        try:
+            outputs = self.compiled(
+                input_ids=padded_ids,
+                attention_mask=padded_mask,
+                position_ids=padded_positions,
+                past_key_values=KVCacheUtil.to_cache(tuple(buffers)),
+                use_cache=True
+            )
+        except Exception as e:
+            print(f"编译解码失败（batch={batch_bucket}, length={length_bucket}），该分桶改用eager模式: {e}")
+            self.failed_buckets.add(bucket)
+            # 还没有任何分桶编译成功时视为当前环境不支持编译（如缺少C++编译器），整体回退eager
+            if not self.compiled_buckets:
+                self.failed = True
+            return None
+        self.compiled_buckets.add(bucket)
+
+        new_past = tuple(
+            (key[:batch_size, :, offset:], value[:batch_size, :, offset:])
+            for key, value in KVCacheUtil.to_legacy(outputs.past_key_values)
+        )
+        return outputs.logits[:batch_size, -1, :], new_past
+
+    def _view(self, buffer: torch.Tensor, batch_bucket: int, length_bucket: int) -> torch.Tensor:
+        num_kv_heads, head_dim = self.kv_shape
+        return buffer[:batch_bucket * num_kv_heads * length_bucket * head_dim].view(
+            batch_bucket, num_kv_heads, length_bucket, head_dim)
+
+    def _stats_for(self, bucket: Tuple[int, int]) -> Dict[str, float]:
+        return self.bucket_stats.setdefault(bucket, {'compile_seconds': 0.0, 'steps': 0, 'tokens': 0, 'seconds': 0.0})
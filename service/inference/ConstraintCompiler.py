@@ -0,0 +1,163 @@
+from typing import Dict, Any, List, Optional, Set
+from collections import OrderedDict
+from threading import Lock, get_ident
+from concurrent.futures import Future
+from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
+from service.inference.RegexFSM import RegexFSM
+from service.inference.JsonSchemaRegex import JsonSchemaRegex, WHITESPACE
+from service.inference.TokenMaskIndex import TokenMaskIndex
+import hashlib
+import torch
+import time
+import os
+
+
+class ConstraintCompiler:
+    """
+    约束解码编译器 - 请求中的json_schema或regex转为正则，编译为DFA并预计算token掩码索引；
+    索引按 (tokenizer词表指纹, 正则指纹) 缓存在磁盘上，内存中按LRU保留最近使用的索引
+    """
+
+    def __init__(self, tokenizer, eos_token_ids: Set[int], config: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            tokenizer: 模型的tokenizer
+            eos_token_ids: 结束token（约束完整匹配后才允许生成）
+            config: config.yaml中的inference.constrained配置
+        """
+        config = config or {}
+        self.tokenizer = tokenizer
+        self.eos_token_ids = set(eos_token_ids)
+        self.cache_dir: Optional[str] = config.get('cache_dir')
+        self.max_cached = config.get('max_cached', 32)
+        self.max_states = config.get('max_states', 4096)
+        self.whitespace = config.get('whitespace', WHITESPACE)
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.lock = Lock()
+        self.indexes: "OrderedDict[str, TokenMaskIndex]" = OrderedDict()
+        # 正在编译的约束，其他请求等待同一次编译
+        self.pending: Dict[str, Future] = {}
+        self._token_bytes: Optional[List[bytes]] = None
+        self._vocab_fingerprint: Optional[str] = None
+
+        # 统计信息
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.builds = 0
+        self.total_build_time = 0.0
+
+    @staticmethod
+    def has_constraint(config: Dict[str, Any]) -> bool:
+        return bool(config.get('json_schema') or config.get('regex'))
+
+    def pattern_for(self, config: Dict[str, Any]) -> Optional[str]:
+        """请求的约束对应的正则，没有约束时返回None"""
+        if config.get('json_schema') and config.get('regex'):
+            raise ValueError("json_schema与regex不能同时指定")
+        if config.get('json_schema'):
+            return JsonSchemaRegex.to_regex(config['json_schema'], self.whitespace)
+        return config.get('regex') or None
+
+    def compile(self, config: Dict[str, Any]) -> Optional[TokenMaskIndex]:
+        """
+        获取请求约束的token掩码索引（首次使用某个约束时编译，耗时与DFA状态数成正比）；
+        编译在锁外进行，同一约束的并发请求等待同一次编译，已缓存的约束不受其他约束编译的影响
+        Raises:
+            ValueError: 约束无法解析、过于复杂或与thinking模式同时使用
+        """
+        pattern = self.pattern_for(config)
+        if pattern is None:
+            return None
+        if config.get('enable_thinking'):
+            raise ValueError("约束解码不支持thinking模式")
+
+        token_bytes = self.token_bytes()
+        key = f"{self._vocab_fingerprint[:16]}-{RegexFSM.fingerprint(pattern)[:16]}"
+        with self.lock:
+            index = self.indexes.get(key)
+            if index is not None:
+                self.indexes.move_to_end(key)
+                self.memory_hits += 1
+                return index
+            pending = self.pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = Future()
+                self.pending[key] = pending
+        if not owner:
+            return pending.result()
+
+        try:
+            index = self._load_or_build(key, pattern, token_bytes)
+        except BaseException as e:
+            with self.lock:
+                del self.pending[key]
+            pending.set_exception(e)
+            raise
+
+        with self.lock:
+            self.indexes[key] = index
+            while len(self.indexes) > self.max_cached:
+                self.indexes.popitem(last=False)
+            del self.pending[key]
+        pending.set_result(index)
+        return index
+
+    def _load_or_build(self, key: str, pattern: str, token_bytes: List[bytes]) -> TokenMaskIndex:
+        """从磁盘缓存加载索引，不存在时编译并保存"""
+        path = os.path.join(self.cache_dir, f"{key}.pt") if self.cache_dir else None
+        if path and os.path.exists(path):
+            index = TokenMaskIndex.from_state_dict(torch.load(path, weights_only=True), token_bytes, self.eos_token_ids)
+            with self.lock:
+                self.disk_hits += 1
+            return index
+
+        start_time = time.time()
+        fsm = RegexFSM.from_regex(pattern, max_states=self.max_states)
+        index = TokenMaskIndex.build(fsm, token_bytes, self.eos_token_ids)
+        elapsed = time.time() - start_time
+        with self.lock:
+            self.builds += 1
+            self.total_build_time += elapsed
+        print(f"约束解码索引已编译: {fsm.num_states} 个状态, {index.num_rows} 种掩码, 耗时 {elapsed:.1f}秒")
+        if path:
+            temp_path = f"{path}.tmp-{os.getpid()}-{get_ident()}"
+            torch.save(index.state_dict(), temp_path)
+            os.replace(temp_path, path)
+        return index
+
+    def token_bytes(self) -> List[bytes]:
+        """词表中每个token的字节（字节级BPE按GPT-2的字节映射还原；特殊token为空）"""
+        if self._token_bytes is not None:
+            return self._token_bytes
+        byte_decoder = {char: byte for byte, char in bytes_to_unicode().items()}
+        special_ids = set(self.tokenizer.all_special_ids)
+        tokens = self.tokenizer.convert_ids_to_tokens(list(range(len(self.tokenizer))))
+        token_bytes = []
+        for token_id, token in enumerate(tokens):
+            if token is None or token_id in special_ids:
+                token_bytes.append(b'')
+            elif all(char in byte_decoder for char in token):
+                token_bytes.append(bytes(byte_decoder[char] for char in token))
+            else:
+                token_bytes.append(self.tokenizer.convert_tokens_to_string([token]).encode('utf-8'))
+
+        digest = hashlib.sha256()
+        for data in token_bytes:
+            digest.update(len(data).to_bytes(4, 'little'))
+            digest.update(data)
+        self._vocab_fingerprint = digest.hexdigest()
+        self._token_bytes = token_bytes
+        return token_bytes
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'cached_indexes': len(self.indexes),
+            'compiling': len(self.pending),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'builds': self.builds,
+            'avg_build_seconds': self.total_build_time / self.builds if self.builds else 0.0
+        }
@@ -0,0 +1,64 @@
+from typing import Any, Callable, Dict, Optional
+from transformers import StoppingCriteria
+from service.inference.IncrementalDetokenizer import IncrementalDetokenizer
+import torch
+import time
+
+
+class GenerationBudget:
+    """
+    单个请求的服务端预算 - 客户端取消、墙钟时间上限与停止序列，在解码循环中每生成一个token检查一次
+    """
+
+    def __init__(self, tokenizer, config: Dict[str, Any], cancelled: Optional[Callable[[], bool]] = None):
+        """
+        初始化请求预算
+        Args:
+            tokenizer: 模型的tokenizer（匹配停止序列时增量解码）
+            config: 推理配置（timeout_seconds: 墙钟时间上限，从创建预算时开始计时；stop: 停止序列）
+            cancelled: 返回请求是否已被取消（客户端断开）
+        """
+        timeout = config.get('timeout_seconds')
+        self.deadline = time.time() + timeout if timeout else None
+        self.cancelled = cancelled or (lambda: False)
+        self.detokenizer: Optional[IncrementalDetokenizer] = None
+        if config.get('stop'):
+            self.detokenizer = IncrementalDetokenizer(tokenizer, config.get('enable_thinking', False), config['stop'])
+
+    def push(self, token_id: int):
+        """记录新生成的token"""
+        if self.detokenizer is not None:
+            self.detokenizer.push(token_id)
+
+    def finish_reason(self) -> Optional[str]:
+        """
+        检查预算
+        Returns:
+            cancelled（客户端已断开）/ stop（出现停止序列）/ timeout（超出墙钟时间），未触发时返回None
+        """
+        if self.cancelled():
+            return "cancelled"
+        if self.detokenizer is not None and self.detokenizer.stopped:
+            return "stop"
+        if self.deadline is not None and time.time() > self.deadline:
+            return "timeout"
+        return None
+
+    def truncate(self, content: str) -> str:
+        """按命中的停止序列截断生成内容"""
+        if self.detokenizer is None or self.detokenizer.stop_reason is None:
+            return content
+        index = content.find(self.detokenizer.stop_reason)
+        return content[:index] if index >= 0 else content
+
+
+class BudgetStoppingCriteria(StoppingCriteria):
+    """将请求预算接入transformers的generate：预算触发时停止生成（仅用于batch=1）"""
+
+    def __init__(self, budget: GenerationBudget):
+        self.budget = budget
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        self.budget.push(int(input_ids[0, -1]))
+        done = self.budget.finish_reason() is not None
+        return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
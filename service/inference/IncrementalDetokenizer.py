@@ -0,0 +1,127 @@
+from typing import Any, AsyncGenerator, AsyncIterable, Dict, List, Optional, Tuple
+import json
+
+# Qwen3 thinking段的起止token（<think>、</think>），不作为文本输出
+THINK_START_TOKEN = 151667
+THINK_END_TOKEN = 151668
+
+
+class IncrementalDetokenizer:
+    """
+    增量解码 - 流式输出时每个token只解码 [prefix_offset, 末尾) 这一小段，
+    与 [prefix_offset, read_offset) 的解码结果比较得到新增文本；末尾为不完整的UTF-8字符（\\ufffd）时暂不输出，
+    等后续token补全。thinking模式下 </think> 之前的文本作为thinking输出，之后作为content输出；
+    content中出现停止序列时截断并结束。所有流式后端（推理引擎、副本池、响应缓存回放）共用
+    """
+
+    def __init__(self, tokenizer, enable_thinking: bool = False, stop: Optional[List[str]] = None):
+        """
+        初始化增量解码器
+        Args:
+            tokenizer: 模型的tokenizer
+            enable_thinking: 是否启用thinking模式（输出以thinking段开始）
+            stop: 停止序列
+        """
+        self.tokenizer = tokenizer
+        self.stop = [text for text in stop or [] if text]
+        # 可能是停止序列前缀的文本暂不输出
+        self.hold_back = max((len(text) for text in self.stop), default=1) - 1
+        self.token_ids: List[int] = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+        self.channel = "thinking" if enable_thinking else "content"
+        # 当前段已输出的文本为空时去掉开头的换行（与非流式的strip保持一致）
+        self.channel_started = False
+        self.pending = ""
+        self.stopped = False
+        self.stop_reason: Optional[str] = None
+
+    def push(self, token_id: int) -> List[Tuple[str, str]]:
+        """
+        追加一个token
+        Returns:
+            新增的 (段名, 文本) 列表，段名为 thinking 或 content
+        """
+        if self.stopped:
+            return []
+        if token_id in (THINK_START_TOKEN, THINK_END_TOKEN):
+            deltas = self._flush_text()
+            # 跳过边界token本身，之后的文本从下一个token开始解码
+            self.token_ids.append(token_id)
+            self.prefix_offset = self.read_offset = len(self.token_ids)
+            if token_id == THINK_END_TOKEN and self.channel == "thinking":
+                self.channel = "content"
+                self.channel_started = False
+            return deltas
+
+        self.token_ids.append(token_id)
+        prefix_text = self._decode(self.prefix_offset, self.read_offset)
+        new_text = self._decode(self.prefix_offset, len(self.token_ids))
+        if len(new_text) <= len(prefix_text) or new_text.endswith("�"):
+            return []
+
+        self.prefix_offset = self.read_offset
+        self.read_offset = len(self.token_ids)
+        return self._emit(new_text[len(prefix_text):])
+
+    def flush(self) -> List[Tuple[str, str]]:
+        """生成结束时输出剩余文本（包括暂不输出的部分）"""
+        if self.stopped:
+            return []
+        return self._flush_text()
+
+    async def iter_sse(self, token_ids: AsyncIterable[int]) -> AsyncGenerator[str, None]:
+        """
+        将token流转换为SSE：content为 {"token": 文本}，thinking为 {"thinking": 文本}；遇到停止序列后结束
+        """
+        async for token_id in token_ids:
+            for channel, text in self.push(token_id):
+                yield self.format_sse(channel, text)
+            if self.stopped:
+                return
+        for channel, text in self.flush():
+            yield self.format_sse(channel, text)
+
+    @staticmethod
+    def format_sse(channel: str, text: str) -> str:
+        payload: Dict[str, Any] = {'token': text} if channel == "content" else {'thinking': text}
+        return f"data: {json.dumps(payload)}\n\n"
+
+    def _flush_text(self) -> List[Tuple[str, str]]:
+        """输出当前段中尚未输出的全部文本"""
+        tail = ""
+        if self.read_offset < len(self.token_ids):
+            prefix_text = self._decode(self.prefix_offset, self.read_offset)
+            tail = self._decode(self.prefix_offset, len(self.token_ids))[len(prefix_text):]
+            self.prefix_offset = self.read_offset = len(self.token_ids)
+        deltas = self._emit(tail, final=True)
+        return deltas
+
+    def _emit(self, text: str, final: bool = False) -> List[Tuple[str, str]]:
+        """处理段首换行与停止序列，返回可以输出的文本"""
+        if self.channel != "content":
+            return self._channel_text("thinking", text)
+
+        text = self.pending + text
+        self.pending = ""
+        for stop_text in self.stop:
+            index = text.find(stop_text)
+            if index >= 0:
+                self.stopped = True
+                self.stop_reason = stop_text
+                return self._channel_text("content", text[:index])
+        if not final and self.hold_back:
+            self.pending = text[-self.hold_back:]
+            text = text[:-self.hold_back]
+        return self._channel_text("content", text)
+
+    def _channel_text(self, channel: str, text: str) -> List[Tuple[str, str]]:
+        if not self.channel_started:
+            text = text.lstrip("\n")
+        if not text:
+            return []
+        self.channel_started = True
+        return [(channel, text)]
+
+    def _decode(self, start: int, end: int) -> str:
+        return self.tokenizer.decode(self.token_ids[start:end], skip_special_tokens=True)
@@ -0,0 +1,735 @@
+from typing import List, Dict, Any, Optional, AsyncGenerator, Callable
+from concurrent.futures import Future
+from collections import deque
+from threading import Thread, Condition, Lock
+from service.inference.InferenceService import InferenceService
+from service.inference.AsyncTokenStreamer import AsyncTokenStreamer
+from service.inference.IncrementalDetokenizer import IncrementalDetokenizer
+from service.inference.GenerationBudget import GenerationBudget
+from service.inference.KVCacheUtil import KVCacheUtil
+from service.inference.PagedKVCache import PagedKVCache, BlockTable
+from service.inference.Sampler import Sampler
+from service.inference.TokenMaskIndex import TokenMaskIndex, TokenConstraint
+from service.inference.InferenceWorkerPool import QueueFullError
+import asyncio
+import math
+import itertools
+import torch
+import time
+
+
+class GenerationSequence:
+    """引擎内的一条生成序列"""
+
+    def __init__(self, seq_id: int, prompt_ids: List[int], config: Dict[str, Any], adapter: str,
+                 streamer: Optional[AsyncTokenStreamer] = None):
+        self.seq_id = seq_id
+        self.prompt_ids = prompt_ids
+        # 生成该序列使用的LoRA适配器，同一适配器的序列合并为一个批次
+        self.adapter = adapter
+        self.output_ids: List[int] = []
+        self.config = config
+        # 多轮对话的会话id，结束时保存KV供下一轮复用
+        self.session_id: Optional[str] = config.get('session_id')
+        self.max_new_tokens = config.get('max_new_tokens', 512)
+        self.future: Future = Future()
+        self.streamer = streamer
+        # 取消（客户端断开）、墙钟时间与停止序列预算，每生成一个token检查一次
+        self.budget: Optional[GenerationBudget] = None
+        # KV缓存覆盖 prompt_ids + output_ids[:-1]，最后一个输出token作为下一步的输入
+        self.past = None
+        # 分页KV缓存模式下序列的block表（此时past不使用）
+        self.blocks: Optional[BlockTable] = None
+        self.finish_reason: Optional[str] = None
+        # 已写入KV的token数，等于 len(context_ids) 时prefill完成（分块prefill分多个调度步推进）
+        self.num_computed = 0
+        # prefill最后一个位置的logits，prefill完成后用于采样第一个token
+        self.prefill_logits: Optional[torch.Tensor] = None
+        # 已加入运行队列（持有适配器引用）
+        self.admitted = False
+        self.generator: Optional[torch.Generator] = None
+        # n-best采样：同组的其他分支，由本序列完成prefill后复制其KV并各自采样
+        self.forks: List["GenerationSequence"] = []
+        # 是否累计所选token的对数概率（n-best采样时用于对候选排序）
+        self.track_logprobs = False
+        self.cumulative_logprob = 0.0
+        # 约束解码（json_schema / regex）的DFA状态，采样前屏蔽不允许的token
+        self.constraint: Optional[TokenConstraint] = None
+        self.enqueue_time = time.time()
+        self.first_token_time: Optional[float] = None
+
+    @property
+    def kv_length(self) -> int:
+        if self.blocks is not None:
+            return self.blocks.num_tokens
+        return KVCacheUtil.seq_length(self.past)
+
+    @property
+    def context_ids(self) -> List[int]:
+        """需要写入KV的token：被抢占后重新prefill时包含已生成的token（最后一个除外）"""
+        return self.prompt_ids + self.output_ids[:-1]
+
+
+class InferenceEngine:
+    """连续批处理推理引擎 - 请求排队，调度线程在token边界上加入/移出序列并合并为一次批量解码"""
+
+    # 队首请求与运行中序列的适配器不同时，最多为凑批等待的秒数
+    ADAPTER_GROUP_WAIT = 0.5
+
+    def __init__(self, service: InferenceService, max_batch_size: int = 8, max_queue_size: int = 100,
+                 paged_kv: Optional[Dict[str, Any]] = None, prefill_chunk_size: int = 0):
+        """
+        初始化推理引擎
+        Args:
+            service: 已加载模型的推理服务
+            max_batch_size: 同时解码的最大序列数
+            max_queue_size: 等待队列上限，超出时submit抛出QueueFullError
+            paged_kv: config.yaml中的inference.engine.paged_kv配置，启用后并发序列数由空闲KV block决定
+            prefill_chunk_size: 每个调度步最多prefill的提示词token数，长提示词分多步完成并与解码步交替；0表示一次完成
+        """
+        self.service = service
+        self.tokenizer = service.tokenizer
+        self.eos_token_ids = service.eos_token_ids
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.prefill_chunk_size = max(0, prefill_chunk_size or 0)
+
+        paged_kv = paged_kv or {}
+        self.kv_cache: Optional[PagedKVCache] = None
+        if paged_kv.get('enabled', False) and service.backend == 'torch':
+            self.kv_cache = PagedKVCache.for_model(
+                service.model,
+                block_size=paged_kv.get('block_size', 16),
+                max_memory_mb=paged_kv.get('max_memory_mb', 2048)
+            )
+            # 不再按最坏情况限制并发，max_num_seqs只是防止单步批次过大的上限
+            self.max_batch_size = paged_kv.get('max_num_seqs', 64)
+
+        self.waiting: deque = deque()
+        self.running: List[GenerationSequence] = []
+        # 已加入但prefill尚未完成的序列（按加入顺序推进）
+        self.prefilling: List[GenerationSequence] = []
+        self.condition = Condition()
+        self._seq_counter = itertools.count()
+        self._stopped = False
+
+        # 统计信息
+        self.total_requests = 0
+        self.total_rejected = 0
+        self.total_admitted = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self.total_finished = 0
+        self.total_request_time = 0.0
+        self.total_generated_tokens = 0
+        self.total_decode_steps = 0
+        self.total_decode_batch = 0
+        self.total_preempted = 0
+        self.total_prefill_chunks = 0
+        self.total_forks = 0
+        self.total_prefill_tokens = 0
+        self.total_cancelled = 0
+        self.total_timeouts = 0
+        self.total_stop_strings = 0
+        # 被取消的序列已生成但无人接收的token
+        self.total_wasted_tokens = 0
+        self.busy_time = 0.0
+
+        self.thread = Thread(target=self._loop, name="inference-engine", daemon=True)
+        self.thread.start()
+        print(f"推理引擎已启动，最大批大小: {self.max_batch_size}")
+
+    @property
+    def model(self):
+        # 加载适配器后 service.model 会被包装为PeftModel，每次都从服务上取
+        return self.service.model
+
+    def submit(self, messages: List[Dict[str, str]], config: Dict[str, Any],
+               streamer: Optional[AsyncTokenStreamer] = None, constraint: Optional[TokenMaskIndex] = None) -> Future:
+        """
+        提交生成请求
+        Args:
+            messages: 对话消息列表
+            config: 推理配置
+            streamer: 流式输出时接收token的队列
+            constraint: 调用方在工作线程中预先编译的约束索引；为空且请求带约束时在此编译（可能耗时较长）
+        Returns:
+            完成时返回推理结果的Future；config['n'] > 1 时结果中的choices为按累计对数概率从高到低排列的n个候选
+        Raises:
+            QueueFullError: 等待队列已满
+            ValueError: n > 1 时请求流式输出或使用贪心解码，或约束（json_schema / regex）无效
+        """
+        n = max(1, config.get('n') or 1)
+        if n > 1 and streamer is not None:
+            raise ValueError("n > 1 不支持流式输出")
+        if n > 1 and Sampler.is_greedy(config):
+            raise ValueError("n > 1 需要采样（temperature > 0）")
+        if len(self.waiting) >= self.max_queue_size:
+            self.total_rejected += 1
+            raise QueueFullError(f"推理队列已满（{self.max_queue_size}），请稍后重试", self.estimate_retry_after())
+
+        text = self.service.build_prompt(messages, config.get('enable_thinking', False))
+        prompt_ids = self.tokenizer(text)['input_ids']
+        constraint_index = constraint if constraint is not None else self.service.compile_constraint(config)
+
+        adapter = self.service.adapters.resolve(config.get('adapter_id'))
+        seq = GenerationSequence(next(self._seq_counter), prompt_ids, config, adapter, streamer)
+        future = seq.future
+        group = [seq]
+        if n > 1:
+            # 只有第一条分支排队和prefill，其余分支在prefill完成后复制其KV
+            group += [GenerationSequence(next(self._seq_counter), prompt_ids, config, adapter) for _ in range(n - 1)]
+            seq.forks = group[1:]
+            future = Future()
+            self._gather_choices(future, group)
+        for index, member in enumerate(group):
+            member.budget = GenerationBudget(self.tokenizer, config, future.cancelled)
+            member.track_logprobs = n > 1
+            if constraint_index is not None:
+                member.constraint = TokenConstraint(constraint_index)
+            if index > 0:
+                # 会话KV只保存第一条分支的
+                member.session_id = None
+            if config.get('seed') is not None:
+                member.generator = torch.Generator(device=self.model.device).manual_seed(config['seed'] + index)
+
+        with self.condition:
+            self.waiting.append(seq)
+            self.total_requests += 1
+            self.condition.notify()
+        return future
+
+    @staticmethod
+    def _gather_choices(future: Future, group: List[GenerationSequence]):
+        """全部分支结束后合并为一个结果：choices按累计对数概率从高到低排列，顶层字段取最优候选"""
+        lock = Lock()
+        remaining = [len(group)]
+
+        def on_done(done: Future):
+            with lock:
+                if future.done():
+                    return
+                if done.cancelled():
+                    return
+                if done.exception() is not None:
+                    future.set_exception(done.exception())
+                    return
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            choices = []
+            for index, member in enumerate(group):
+                result = member.future.result()
+                choices.append({
+                    'index': index,
+                    'content': result['content'],
+                    'thinking_content': result.get('thinking_content'),
+                    'finish_reason': result['finish_reason'],
+                    'cumulative_logprob': result['cumulative_logprob'],
+                    'completion_tokens': result['completion_tokens']
+                })
+            choices.sort(key=lambda choice: choice['cumulative_logprob'], reverse=True)
+            best = dict(group[choices[0]['index']].future.result())
+            best['completion_tokens'] = sum(choice['completion_tokens'] for choice in choices)
+            best['choices'] = choices
+            future.set_result(best)
+
+        for member in group:
+            member.future.add_done_callback(on_done)
+
+    async def generate(self, messages: List[Dict[str, str]], config: Dict[str, Any],
+                       constraint: Optional[TokenMaskIndex] = None) -> Dict[str, Any]:
+        """普通推理（非流式），等待结果期间不阻塞事件循环；等待被取消时序列在下一个token边界结束"""
+        return await asyncio.wrap_future(self.submit(messages, config, constraint=constraint))
+
+    def generate_stream(self, messages: List[Dict[str, str]], config: Dict[str, Any],
+                        on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                        constraint: Optional[TokenMaskIndex] = None) -> AsyncGenerator[str, None]:
+        """
+        流式推理（SSE）
+        请求在调用时立即入队（队列已满时直接抛出QueueFullError），返回逐token输出的异步生成器
+        on_result: 生成成功结束后以完整结果调用（在调度线程中执行）
+        生成器被关闭（客户端断开）时取消请求，序列在下一个token边界结束
+        """
+        streamer = AsyncTokenStreamer(asyncio.get_running_loop(), skip_prompt=False)
+        future = self.submit(messages, config, streamer, constraint)
+        if on_result is not None:
+            future.add_done_callback(
+                lambda done: on_result(done.result()) if not done.cancelled() and done.exception() is None else None
+            )
+        detokenizer = IncrementalDetokenizer(self.tokenizer, config.get('enable_thinking', False), config.get('stop'))
+        return self.cancel_on_close(detokenizer.iter_sse(streamer), future)
+
+    @staticmethod
+    async def cancel_on_close(stream: AsyncGenerator[str, None], future: Future) -> AsyncGenerator[str, None]:
+        """消费端提前关闭流式输出时取消对应的请求"""
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            if not future.done():
+                future.cancel()
+            await stream.aclose()
+
+    def shutdown(self):
+        """停止调度线程，未完成的请求以异常结束"""
+        with self.condition:
+            self._stopped = True
+            self.condition.notify_all()
+        self.thread.join(timeout=5)
+        self._fail_all(list(self.waiting) + self.prefilling + self.running, RuntimeError("推理引擎已停止"))
+        self.waiting.clear()
+        self.prefilling = []
+        self.running = []
+
+    def estimate_retry_after(self) -> int:
+        """按平均请求耗时与批大小估算排队请求清空所需的秒数"""
+        average_request_time = self.total_request_time / self.total_finished if self.total_finished else 1.0
+        return max(1, math.ceil(average_request_time * len(self.waiting) / self.max_batch_size))
+
+    def stats(self) -> Dict[str, Any]:
+        """引擎运行统计"""
+        return {
+            'waiting': len(self.waiting),
+            'max_queue_size': self.max_queue_size,
+            'total_rejected': self.total_rejected,
+            'avg_queue_wait_seconds': self.total_queue_wait / self.total_admitted if self.total_admitted else 0.0,
+            'max_queue_wait_seconds': self.max_queue_wait,
+            'running': len(self.running),
+            'prefilling': len(self.prefilling),
+            'prefill_chunk_size': self.prefill_chunk_size,
+            'prefill_chunks': self.total_prefill_chunks,
+            'forked_sequences': self.total_forks,
+            'avg_prefill_chunk_tokens': self.total_prefill_tokens / self.total_prefill_chunks if self.total_prefill_chunks else 0.0,
+            'running_adapters': sorted({seq.adapter for seq in self.running}),
+            'max_batch_size': self.max_batch_size,
+            'total_requests': self.total_requests,
+            'total_generated_tokens': self.total_generated_tokens,
+            'decode_steps': self.total_decode_steps,
+            'avg_decode_batch_size': self.total_decode_batch / self.total_decode_steps if self.total_decode_steps else 0.0,
+            'tokens_per_second': self.total_generated_tokens / self.busy_time if self.busy_time > 0 else 0.0,
+            'prefix_cache': self.service.prefix_cache.stats() if self.service.prefix_cache is not None else None,
+            'constrained': self.service.constraints.stats(),
+            'session_cache': self.service.session_cache.stats() if self.service.session_cache is not None else None,
+            'preempted': self.total_preempted,
+            'cancelled': self.total_cancelled,
+            'timeouts': self.total_timeouts,
+            'stop_string_stops': self.total_stop_strings,
+            'wasted_tokens': self.total_wasted_tokens,
+            'paged_kv': self.kv_cache.stats() if self.kv_cache is not None else None,
+            'compiled_decode': self.service.compiled_decoder.stats() if self.service.compiled_decoder is not None else None
+        }
+
+    def _loop(self):
+        """调度循环：加入新序列 -> 批量解码一步 -> 移出已完成序列"""
+        while True:
+            with self.condition:
+                while not self._stopped and not self.waiting and not self.running and not self.prefilling:
+                    self.condition.wait()
+                if self._stopped:
+                    return
+
+            step_start = time.time()
+            try:
+                with torch.inference_mode():
+                    self._admit()
+                    self._prefill_pending()
+                    self._decode_running()
+            except Exception as e:
+                print(f"推理引擎调度失败: {e}")
+                import traceback
+                traceback.print_exc()
+                self._fail_all(self.prefilling + self.running, e)
+                self.prefilling = []
+                self.running = []
+            self.busy_time += time.time() - step_start
+
+    def _admit(self):
+        """在token边界加入等待中的序列：分配KV并匹配可复用的前缀，prefill由 _prefill_pending 推进"""
+        while True:
+            active = len(self.running) + sum(1 + len(seq.forks) for seq in self.prefilling)
+            if active >= self.max_batch_size:
+                return
+            seq = self._next_waiting()
+            if seq is None:
+                return
+            # n-best采样的各分支在prefill后同时加入解码，批次放不下整组时等待（没有其他序列时直接加入）
+            if active and active + 1 + len(seq.forks) > self.max_batch_size:
+                with self.condition:
+                    self.waiting.appendleft(seq)
+                return
+            # 排队期间已取消或超时的请求不再prefill
+            reason = seq.budget.finish_reason()
+            if reason is not None:
+                self._finish(seq, reason)
+                continue
+
+            cached_tokens = 0
+            if self.kv_cache is not None:
+                # 只为实际要写入的token分配block，并为每条运行中的序列留出一个追加token的block
+                allocation = self.kv_cache.allocate(seq.adapter, seq.context_ids,
+                                                    reserve=active + len(seq.forks))
+                if allocation is None:
+                    if not self.running and not self.prefilling:
+                        self._fail_all([seq], ValueError(f"提示词长度 {len(seq.context_ids)} 超出KV缓存容量"))
+                        continue
+                    with self.condition:
+                        self.waiting.appendleft(seq)
+                    return
+                seq.blocks, cached_tokens = allocation
+
+            if not seq.output_ids:
+                queue_wait = time.time() - seq.enqueue_time
+                self.total_admitted += 1
+                self.total_queue_wait += queue_wait
+                self.max_queue_wait = max(self.max_queue_wait, queue_wait)
+
+            self.service.adapters.pin(seq.adapter)
+            seq.admitted = True
+            self._start_prefill(seq, cached_tokens)
+            self.prefilling.append(seq)
+
+    def _next_waiting(self) -> Optional[GenerationSequence]:
+        """
+        取出下一条等待中的序列
+        优先选择与运行中序列使用相同适配器的请求，减少每步的适配器切换；
+        队首等待超过 ADAPTER_GROUP_WAIT 秒时按先来先服务，避免饿死
+        """
+        with self.condition:
+            if not self.waiting:
+                return None
+            head = self.waiting[0]
+            running_adapters = {seq.adapter for seq in self.running}
+            if running_adapters and head.adapter not in running_adapters \
+                    and time.time() - head.enqueue_time < self.ADAPTER_GROUP_WAIT:
+                for index, seq in enumerate(self.waiting):
+                    if seq.adapter in running_adapters:
+                        del self.waiting[index]
+                        return seq
+            return self.waiting.popleft()
+
+    def _start_prefill(self, seq: GenerationSequence, cached_tokens: int):
+        """
+        确定prefill的起点：命中前缀缓存或会话KV的部分不再计算
+        分页KV模式下共享的前缀block已在分配时复用，会话KV中超出共享block的部分写入序列自己的block
+        """
+        context_ids = seq.context_ids
+        session_length, session_kv = self._match_session(seq, context_ids)
+        if self.kv_cache is not None:
+            if session_length > cached_tokens:
+                self.kv_cache.write(seq.blocks, cached_tokens, KVCacheUtil.select(session_kv, 0, cached_tokens))
+                cached_tokens = session_length
+            seq.num_computed = cached_tokens
+            return
+
+        prefix_length, prefix_kv = 0, None
+        if self.service.prefix_cache is not None:
+            prefix_length, prefix_kv = self.service.prefix_cache.match(seq.adapter, context_ids)
+        if session_length > prefix_length:
+            prefix_length, prefix_kv = session_length, session_kv
+        seq.past = prefix_kv
+        seq.num_computed = prefix_length
+
+    def _prefill_pending(self):
+        """
+        推进prefill：每个调度步最多计算 prefill_chunk_size 个提示词token（按加入顺序分配），
+        长提示词分多步完成，期间运行中的序列照常解码，激活内存按分块大小而不是提示词长度增长；
+        未启用分块时本步内完成全部prefill
+        """
+        budget = self.prefill_chunk_size or math.inf
+        pending = []
+        for seq in self.prefilling:
+            reason = seq.budget.finish_reason()
+            if reason is not None:
+                self._finish(seq, reason)
+                continue
+            if budget > 0:
+                try:
+                    with self.service.adapters.use(seq.adapter):
+                        budget -= self._prefill_chunk(seq, budget)
+                except Exception as e:
+                    self._fail_all([seq], e)
+                    continue
+            if seq.num_computed < len(seq.context_ids):
+                pending.append(seq)
+            else:
+                self._finish_prefill(seq)
+        self.prefilling = pending
+
+    def _prefill_chunk(self, seq: GenerationSequence, max_tokens: float) -> int:
+        """
+        计算序列接下来最多max_tokens个提示词token的KV
+        Returns:
+            本次计算的token数
+        """
+        device = self.model.device
+        context_ids = seq.context_ids
+        start = seq.num_computed
+        end = int(min(len(context_ids), start + max_tokens))
+        if self.kv_cache is not None:
+            past = self.kv_cache.gather([seq.blocks]) if start else None
+        else:
+            past = seq.past
+
+        outputs = self.model(
+            input_ids=torch.tensor([context_ids[start:end]], device=device),
+            attention_mask=torch.ones((1, end), dtype=torch.long, device=device),
+            position_ids=torch.arange(start, end, device=device).unsqueeze(0),
+            past_key_values=KVCacheUtil.to_cache(past),
+            use_cache=True,
+            # 只需要最后一个位置的logits，避免为整段提示词计算 [长度, 词表] 的logits
+            logits_to_keep=1
+        )
+        legacy = KVCacheUtil.to_legacy(outputs.past_key_values)
+        if self.kv_cache is not None:
+            self.kv_cache.write(seq.blocks, start, KVCacheUtil.select(legacy, 0, start))
+        else:
+            seq.past = legacy
+        seq.num_computed = end
+        if end == len(context_ids):
+            seq.prefill_logits = outputs.logits[0, -1]
+        self.total_prefill_chunks += 1
+        self.total_prefill_tokens += end - start
+        return end - start
+
+    def _finish_prefill(self, seq: GenerationSequence):
+        """prefill完成：登记可共享的前缀，采样第一个token后加入解码"""
+        if self.kv_cache is not None:
+            self.kv_cache.commit(seq.adapter, seq.blocks, seq.context_ids)
+        elif self.service.prefix_cache is not None:
+            self.service.prefix_cache.insert(seq.adapter, seq.prompt_ids, seq.past)
+        # 被抢占后重新计算的序列已有待输入的token，不再采样
+        if not seq.output_ids:
+            forks, seq.forks = seq.forks, []
+            # 先完成分叉再采样，第一条分支采样后即结束时也不会提前释放共享的KV
+            for fork in forks:
+                self._fork(seq, fork)
+            for member in [seq] + forks:
+                self._append_token(member, seq.prefill_logits)
+                if not self._finish_if_done(member):
+                    self.running.append(member)
+        elif not self._finish_if_done(seq):
+            self.running.append(seq)
+        seq.prefill_logits = None
+
+    def _fork(self, parent: GenerationSequence, child: GenerationSequence):
+        """n-best分支共享父序列prefill得到的KV（分页模式下共享block，写入时复制）"""
+        if parent.blocks is not None:
+            child.blocks = self.kv_cache.fork(parent.blocks)
+        else:
+            # KV张量在解码时不会被原地修改，分支之间可以直接共享
+            child.past = parent.past
+        child.num_computed = parent.num_computed
+        self.service.adapters.pin(child.adapter)
+        child.admitted = True
+        self.total_forks += 1
+
+    def _match_session(self, seq: GenerationSequence, token_ids: List[int]):
+        """会话上一轮KV与本轮提示词的公共前缀"""
+        session_cache = self.service.session_cache
+        if session_cache is None or not seq.session_id:
+            return 0, None
+        return session_cache.match(seq.session_id, seq.adapter, token_ids)
+
+    def _save_session(self, seq: GenerationSequence):
+        """序列正常结束时保存其KV（覆盖提示词与除最后一个token外的输出），下一轮对话复用"""
+        session_cache = self.service.session_cache
+        if session_cache is None or not seq.session_id:
+            return
+        # prefill未完成就结束（超时）的序列KV不完整
+        if seq.kv_length < len(seq.context_ids):
+            return
+        if seq.blocks is not None:
+            kv = self.kv_cache.gather([seq.blocks])
+        elif seq.past is not None:
+            kv = seq.past
+        else:
+            return
+        session_cache.put(seq.session_id, seq.adapter, seq.context_ids, kv)
+
+    def _reserve_slots(self):
+        """每条运行中的序列在解码前需要一个写入新token的空位，block不足时抢占最晚加入的序列，之后重新prefill"""
+        index = 0
+        while index < len(self.running):
+            if self.kv_cache.append_slot(self.running[index].blocks):
+                index += 1
+                continue
+            self._preempt(self.running.pop())
+
+    def _preempt(self, seq: GenerationSequence):
+        """释放序列的block并放回等待队列队首，已生成的token保留"""
+        self._release(seq)
+        self.total_preempted += 1
+        with self.condition:
+            self.waiting.appendleft(seq)
+
+    def _decode_running(self):
+        """运行中的序列按适配器分组，每组切换一次适配器并批量解码一步"""
+        if self.kv_cache is not None:
+            self._reserve_slots()
+        groups: Dict[str, List[GenerationSequence]] = {}
+        for seq in self.running:
+            groups.setdefault(seq.adapter, []).append(seq)
+
+        still_running = []
+        for adapter, seqs in groups.items():
+            with self.service.adapters.use(adapter):
+                still_running.extend(self._decode_step(seqs))
+        self.running = still_running
+
+    def _decode_step(self, seqs: List[GenerationSequence]) -> List[GenerationSequence]:
+        """将同一适配器的序列左侧对齐后合并为一次前向计算，返回仍未结束的序列"""
+        device = self.model.device
+        kv_lengths = [seq.kv_length for seq in seqs]
+        max_len = max(kv_lengths)
+        batch_size = len(seqs)
+
+        input_ids = torch.tensor([[seq.output_ids[-1]] for seq in seqs], device=device)
+        position_ids = torch.tensor([[length] for length in kv_lengths], device=device)
+        attention_mask = torch.zeros((batch_size, max_len + 1), dtype=torch.long, device=device)
+        for row, length in enumerate(kv_lengths):
+            attention_mask[row, max_len - length:] = 1
+
+        if self.kv_cache is not None:
+            past = self.kv_cache.gather([seq.blocks for seq in seqs])
+        elif batch_size == 1:
+            past = seqs[0].past
+        else:
+            past = KVCacheUtil.stack_left_padded([seq.past for seq in seqs], max_len)
+
+        compiled = self._compiled_forward(seqs[0].adapter, input_ids, attention_mask, position_ids, past)
+        if compiled is not None:
+            logits, new_past = compiled
+        else:
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=KVCacheUtil.to_cache(past),
+                use_cache=True
+            )
+            new_past = KVCacheUtil.to_legacy(outputs.past_key_values)
+            logits = outputs.logits[:, -1, :]
+
+        self.total_decode_steps += 1
+        self.total_decode_batch += batch_size
+
+        if self.kv_cache is not None:
+            # 只有新token的KV需要写回block池
+            self.kv_cache.append([seq.blocks for seq in seqs], [(key[:, :, -1], value[:, :, -1]) for key, value in new_past])
+
+        still_running = []
+        for row, seq in enumerate(seqs):
+            if self.kv_cache is None:
+                seq.past = KVCacheUtil.select(new_past, row, max_len - kv_lengths[row])
+            self._append_token(seq, logits[row])
+            if not self._finish_if_done(seq):
+                still_running.append(seq)
+        return still_running
+
+    def _compiled_forward(self, adapter: str, input_ids: torch.Tensor, attention_mask: torch.Tensor,
+                          position_ids: torch.Tensor, past):
+        """
+        使用编译解码路径（inference.compile）计算一步；只用于加载时的模型与默认适配器，
+        动态加载适配器后模型结构变化，其他适配器的批次按eager模式计算
+        """
+        decoder = self.service.compiled_decoder
+        if decoder is None or past is None or self.model is not decoder.model \
+                or adapter != self.service.adapters.default_adapter:
+            return None
+        return decoder.forward(input_ids, attention_mask, position_ids, past)
+
+    def _append_token(self, seq: GenerationSequence, logits: torch.Tensor):
+        """采样并追加一个token，推送给流式消费端"""
+        if seq.constraint is not None:
+            logits = seq.constraint.apply(logits)
+        token_id = Sampler.sample(logits, seq.config, seq.generator)
+        if seq.constraint is not None:
+            seq.constraint.advance(token_id)
+        if seq.track_logprobs:
+            seq.cumulative_logprob += torch.log_softmax(logits.float(), dim=-1)[token_id].item()
+        seq.output_ids.append(token_id)
+        seq.budget.push(token_id)
+        self.total_generated_tokens += 1
+        if seq.first_token_time is None:
+            seq.first_token_time = time.time()
+        if seq.streamer is not None:
+            seq.streamer.put(torch.tensor([token_id]))
+
+    def _finish_if_done(self, seq: GenerationSequence) -> bool:
+        """检查结束条件（预算、EOS、最大长度），完成时结束序列"""
+        reason = seq.budget.finish_reason()
+        if reason is None:
+            if seq.output_ids and seq.output_ids[-1] in self.eos_token_ids:
+                reason = "stop"
+            elif len(seq.output_ids) >= seq.max_new_tokens:
+                reason = "length"
+            else:
+                return False
+        self._finish(seq, reason)
+        return True
+
+    def _finish(self, seq: GenerationSequence, reason: str):
+        """
+        结束序列：释放KV缓存并返回结果
+        已取消的序列没有接收方，只记录浪费的token；超时的序列返回已生成的部分
+        """
+        seq.finish_reason = reason
+        # prefill完成前结束的序列，尚未分叉的n-best分支随之结束
+        forks, seq.forks = seq.forks, []
+        for fork in forks:
+            self._finish(fork, reason)
+        if reason == "cancelled":
+            self.total_cancelled += 1
+            self.total_wasted_tokens += len(seq.output_ids)
+            self._release(seq)
+            if seq.streamer is not None:
+                seq.streamer.end()
+            return
+        if reason == "timeout":
+            self.total_timeouts += 1
+        elif seq.budget.detokenizer is not None and seq.budget.detokenizer.stopped:
+            self.total_stop_strings += 1
+
+        self._save_session(seq)
+        self._release(seq)
+        output_ids = [token_id for token_id in seq.output_ids if token_id not in self.eos_token_ids]
+        result = self.service.decode_output(output_ids, seq.config.get('enable_thinking', False))
+        result['content'] = seq.budget.truncate(result['content'])
+        result['finish_reason'] = seq.finish_reason
+        result['prompt_tokens'] = len(seq.prompt_ids)
+        result['completion_tokens'] = len(seq.output_ids)
+        result['output_ids'] = list(seq.output_ids)
+        if seq.track_logprobs:
+            result['cumulative_logprob'] = seq.cumulative_logprob
+        self.total_finished += 1
+        self.total_request_time += time.time() - seq.enqueue_time
+        if seq.streamer is not None:
+            seq.streamer.end()
+        if not seq.future.done():
+            seq.future.set_result(result)
+
+    def _release(self, seq: GenerationSequence):
+        """释放序列占用的KV缓存和适配器引用"""
+        seq.past = None
+        if seq.blocks is not None:
+            self.kv_cache.free_table(seq.blocks)
+            seq.blocks = None
+        if seq.admitted:
+            seq.admitted = False
+            self.service.adapters.unpin(seq.adapter)
+
+    def _fail_all(self, seqs: List[GenerationSequence], error: BaseException):
+        """以异常结束一组序列（已正常结束的序列跳过）"""
+        for seq in seqs:
+            if seq.finish_reason is not None:
+                continue
+            seq.finish_reason = "error"
+            self._release(seq)
+            if seq.streamer is not None:
+                seq.streamer.error = error
+                seq.streamer.end()
+            if not seq.future.done():
+                seq.future.set_exception(error)
+            forks, seq.forks = seq.forks, []
+            self._fail_all(forks, error)
@@ -1,67 +1,319 @@
-from typing import List, Dict, Any, Optional, AsyncGenerator
-from transformers import AutoTokenizer, AutoModelForCausalLM, TextStreamer
+from typing import List, Dict, Any, Optional, AsyncGenerator, Iterator, Set, Tuple
+from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteriaList, LogitsProcessorList
 from peft import PeftModel
+from threading import Thread, Lock, Event
+from service.inference.AsyncTokenStreamer import AsyncTokenStreamer
+from service.inference.IncrementalDetokenizer import IncrementalDetokenizer
+from service.inference.GenerationBudget import GenerationBudget, BudgetStoppingCriteria
+from service.inference.AdapterManager import AdapterManager
+from service.inference.PrefixCache import PrefixCache
+from service.inference.SessionKVStore import SessionKVStore
+from service.inference.KVCacheUtil import KVCacheUtil
+from service.inference.SpeculativeDecoder import SpeculativeDecoder
+from service.inference.QuantizedModelLoader import QuantizedModelLoader
+from service.inference.WeightsFingerprint import WeightsFingerprint
+from service.inference.MergedModelCache import MergedModelCache
+from service.inference.CompiledDecoder import CompiledDecoder
+from service.inference.ConstraintCompiler import ConstraintCompiler
+from service.inference.TokenMaskIndex import TokenMaskIndex, ConstraintLogitsProcessor
+from service.inference.OnnxCausalLM import OnnxCausalLM
+from service.inference.ResponseCache import ResponseCache
+from service.inference.SemanticCache import SemanticCache
+from service.inference.Sampler import Sampler
+import asyncio
+import functools
 import torch
-import json
 
 
 class InferenceService:
     """推理服务 - 支持流式输出和批量推理"""
 
-    def __init__(self, model_path: str, lora_adapter_path: Optional[str] = None):
+    def __init__(self, model_path: str, lora_adapter_path: Optional[str] = None, dtype: str = "bfloat16",
+                 config: Optional[Dict[str, Any]] = None):
         """
         初始化推理服务
         Args:
             model_path: 基础模型路径
             lora_adapter_path: LoRA适配器路径（可选）
+            dtype: 权重精度（bfloat16 / float16 / float32 / int8）
+            config: config.yaml中的inference配置（adapters、prefix_cache、backends、merged_lora等）
         """
+        config = config or {}
         print(f"加载模型: {model_path}")
+        self.model_path = model_path
+        self.lora_adapter_path = lora_adapter_path
+        # 响应缓存使用的模型标识与权重文件指纹
+        self.model_id = f"{model_path}|{lora_adapter_path or ''}|{dtype}"
+        self.model_version = WeightsFingerprint.of(model_path, lora_adapter_path)
 
-        self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            device_map="auto",
-            dtype=torch.bfloat16,
-            use_cache=True
+        self.tokenizer = self.load_tokenizer(model_path)
+        # 推理后端按模型路径在 inference.backends 中配置，默认torch
+        backends = {path.replace('\\', '/'): value for path, value in (config.get('backends', {}) or {}).items()}
+        backend_config = backends.get(model_path.replace('\\', '/'), {}) or {}
+        self.backend = backend_config.get('backend', 'torch')
+        self.quantized = dtype == "int8"
+        # LoRA已合并进权重（merged_lora模式），前向计算不经过PEFT
+        merged_config = config.get('merged_lora', {}) or {}
+        self.merged = bool(lora_adapter_path) and merged_config.get('enabled', False) \
+            and self.backend == 'torch' and not self.quantized
+        if self.backend == 'onnx':
+            if lora_adapter_path:
+                raise ValueError("ONNX后端不支持加载LoRA适配器，请先合并LoRA后再导出ONNX")
+            self.model = OnnxCausalLM(backend_config['onnx_path'], model_path, config.get('onnx', {}) or {})
+        elif self.quantized:
+            # int8动态量化（CPU），LoRA在量化前合并
+            self.model = QuantizedModelLoader.load(
+                model_path,
+                lora_adapter_path,
+                cache_dir=(config.get('quantization', {}) or {}).get('cache_dir')
+            )
+        elif self.merged:
+            self.model = MergedModelCache.from_config(merged_config).load(model_path, lora_adapter_path, dtype)
+        else:
+            self.model = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                device_map="auto",
+                dtype=getattr(torch, dtype),
+                use_cache=True
+            )
+
+            # 如果提供了LoRA适配器路径，加载适配器
+            if lora_adapter_path:
+                print(f"加载LoRA适配器: {lora_adapter_path}")
+                self.model = PeftModel.from_pretrained(self.model, lora_adapter_path)
+
+        # 其他适配器按请求的adapter_id加载到同一个基础模型上
+        adapter_config = config.get('adapters', {}) or {}
+        self.adapters = AdapterManager(
+            self,
+            adapter_paths=adapter_config.get('paths'),
+            max_loaded=adapter_config.get('max_loaded', 16),
+            # 合并后的权重已包含LoRA，不能再叠加其他适配器
+            dynamic=self.backend == 'torch' and not self.quantized and not self.merged
         )
 
-        # 如果提供了LoRA适配器路径，加载适配器
-        if lora_adapter_path:
-            print(f"加载LoRA适配器: {lora_adapter_path}")
-            self.model = PeftModel.from_pretrained(self.model, lora_adapter_path)
+        # 公共前缀（系统提示词、对话模板）的KV缓存
+        prefix_config = config.get('prefix_cache', {}) or {}
+        self.prefix_cache: Optional[PrefixCache] = None
+        if prefix_config.get('enabled', True):
+            self.prefix_cache = PrefixCache(
+                max_memory_mb=prefix_config.get('max_memory_mb', 1024),
+                min_prefix_tokens=prefix_config.get('min_prefix_tokens', 16)
+            )
+
+        # 多轮对话按session_id保存上一轮结束时的KV，下一轮只prefill新增的消息
+        session_config = config.get('session_cache', {}) or {}
+        self.session_cache: Optional[SessionKVStore] = None
+        if session_config.get('enabled', True) and self.backend == 'torch':
+            self.session_cache = SessionKVStore(
+                namespace=f"{self.model_id}|{self.model_version}",
+                max_memory_mb=session_config.get('max_memory_mb', 1024),
+                spill_dir=session_config.get('spill_dir'),
+                max_disk_mb=session_config.get('max_disk_mb', 8192),
+                ttl_seconds=session_config.get('ttl_seconds', 3600),
+                min_reuse_tokens=session_config.get('min_reuse_tokens', 16)
+            )
+
+        # torch.compile解码路径：按配置的批大小与长度分桶在加载时完成编译，失败时回退eager
+        compile_config = config.get('compile', {}) or {}
+        self.compiled_decoder: Optional[CompiledDecoder] = None
+        if compile_config.get('enabled', False) and self.backend == 'torch' and not self.quantized:
+            try:
+                self.compiled_decoder = CompiledDecoder(self.model, compile_config)
+                if compile_config.get('warmup', True):
+                    self.compiled_decoder.warmup()
+            except Exception as e:
+                print(f"编译解码路径初始化失败，使用eager模式: {e}")
+                self.compiled_decoder = None
+
+        # 约束解码（json_schema / regex）的token掩码索引，按约束缓存在磁盘上
+        self.constraints = ConstraintCompiler(self.tokenizer, self.eos_token_ids, config.get('constrained', {}) or {})
+
+        # 投机解码的草稿模型在首次使用时加载
+        self.speculative_config = config.get('speculative', {}) or {}
+        self.draft_model = None
+        self.draft_lock = Lock()
 
         print("模型加载完成")
 
-    def generate(self, messages: List[Dict[str, str]], config: Dict[str, Any]) -> Dict[str, Any]:
+    @staticmethod
+    def load_tokenizer(model_path: str):
+        """加载tokenizer，批量生成时左侧补齐，保证每条提示词的最后一个token对齐"""
+        tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        return tokenizer
+
+    def memory_footprint(self) -> int:
+        """模型权重占用的字节数（包含int8量化层的打包权重，共享权重只计一次）"""
+        if isinstance(self.model, OnnxCausalLM):
+            return self.model.memory_footprint()
+        seen = set()
+
+        def tensor_bytes(value) -> int:
+            if isinstance(value, torch.Tensor):
+                if id(value) in seen:
+                    return 0
+                seen.add(id(value))
+                return value.numel() * value.element_size()
+            if isinstance(value, (tuple, list)):
+                return sum(tensor_bytes(item) for item in value)
+            return 0
+
+        return sum(tensor_bytes(value) for value in self.model.state_dict(keep_vars=True).values())
+
+    @property
+    def eos_token_ids(self) -> Set[int]:
+        """结束token集合（tokenizer与generation_config中的eos合并）"""
+        eos_ids = set()
+        if self.tokenizer.eos_token_id is not None:
+            eos_ids.add(self.tokenizer.eos_token_id)
+        generation_eos = getattr(getattr(self.model, 'generation_config', None), 'eos_token_id', None)
+        if isinstance(generation_eos, int):
+            eos_ids.add(generation_eos)
+        elif generation_eos:
+            eos_ids.update(generation_eos)
+        return eos_ids
+
+    def drop_session(self, session_id: str) -> bool:
+        """删除会话保存的KV"""
+        if self.session_cache is None:
+            return False
+        return self.session_cache.drop(session_id)
+
+    def _generate_with_adapter(self, adapter_id: Optional[str], **generation_kwargs):
+        """在请求指定的LoRA适配器下执行generate"""
+        with self.adapters.use(self.adapters.resolve(adapter_id)):
+            return self.model.generate(**generation_kwargs)
+
+    def compile_constraint(self, config: Dict[str, Any]) -> Optional[TokenMaskIndex]:
         """
-        普通推理（非流式）
+        请求的约束解码索引（json_schema或regex），没有约束时返回None；首次使用某个约束时需要编译，应在工作线程中调用
+        Raises:
+            ValueError: 约束无效
+        """
+        return self.constraints.compile(config)
+
+    def _logits_processor(self, config: Dict[str, Any]) -> Optional[LogitsProcessorList]:
+        """generate使用的约束解码处理器"""
+        index = self.compile_constraint(config)
+        if index is None:
+            return None
+        return LogitsProcessorList([ConstraintLogitsProcessor(index)])
+
+    def response_cache_key(self, prompt: str, config: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        生成响应缓存键
         Args:
-            messages: 对话消息列表
+            prompt: 渲染后的提示词
             config: 推理配置
         Returns:
-            推理结果
+            (缓存键, 适配器名称)
         """
-        enable_thinking = config.get('enable_thinking', False)
+        adapter = self.adapters.resolve(config.get('adapter_id'))
+        key = ResponseCache.make_key(self.model_id, self.model_version, adapter,
+                                     self.adapters.adapter_paths.get(adapter), prompt, config)
+        return key, adapter
+
+    def semantic_cache_key(self, config: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        语义缓存的分区键（与响应缓存键相同但不含提示词）
+        Returns:
+            (分区键, 适配器名称)
+        """
+        adapter = self.adapters.resolve(config.get('adapter_id'))
+        key = SemanticCache.namespace_key(self.model_id, self.model_version, adapter,
+                                          self.adapters.adapter_paths.get(adapter), config)
+        return key, adapter
+
+    @property
+    def supports_embedding(self) -> bool:
+        """是否可以在当前进程中计算提示词向量（ONNX后端与副本池模式不支持）"""
+        return self.backend == 'torch' and self.model is not None
+
+    def embed(self, conversations: List[List[Dict[str, str]]], enable_thinking: bool = False,
+              adapter_id: Optional[str] = None, batch_size: int = 16, max_length: int = 512) -> torch.Tensor:
+        """
+        计算对话向量：按长度分桶后批量前向计算渲染后的提示词，最后一层隐藏状态只在消息内容的token上取平均并归一化；
+        对话模板与特殊token（<|im_start|>、角色名、空的think块等）对所有请求都相同，计入平均会让短问题之间的相似度虚高
+        Args:
+            conversations: 对话消息列表
+            enable_thinking: 渲染提示词时是否启用thinking模式
+            adapter_id: 使用的适配器
+            batch_size: 每次前向计算的对话数
+            max_length: 每条提示词保留的最后token数
+        Returns:
+            [len(conversations), hidden_size] 的float32向量（CPU）
+        """
+        texts = [self.build_prompt(messages, enable_thinking) for messages in conversations]
+        encoded = self.tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+        prompt_ids = []
+        content_masks = []
+        for text, messages, ids, offsets in zip(texts, conversations, encoded['input_ids'], encoded['offset_mapping']):
+            spans = self._content_spans(text, messages)
+            mask = [int(any(start < span_end and end > span_start for span_start, span_end in spans))
+                    for start, end in offsets]
+            if not any(mask):
+                mask = [1] * len(ids)
+            prompt_ids.append(ids[-max_length:])
+            content_masks.append(mask[-max_length:])
+
+        order = sorted(range(len(texts)), key=lambda index: len(prompt_ids[index]))
+        embeddings: List[Optional[torch.Tensor]] = [None] * len(texts)
+        with self.adapters.use(self.adapters.resolve(adapter_id)), torch.no_grad():
+            for start in range(0, len(order), max(1, batch_size)):
+                indices = order[start:start + batch_size]
+                model_inputs = self.tokenizer.pad(
+                    {'input_ids': [prompt_ids[index] for index in indices]},
+                    padding=True,
+                    return_tensors="pt"
+                ).to(self.model.device)
+                # 只需要隐藏状态，logits只保留最后一个位置
+                outputs = self.model(**model_inputs, output_hidden_states=True, use_cache=False, logits_to_keep=1)
+                hidden = outputs.hidden_states[-1].float()
+                # 左侧补齐，内容掩码右对齐
+                mask = torch.zeros(hidden.shape[:2], dtype=torch.float32)
+                for row, index in enumerate(indices):
+                    mask[row, hidden.shape[1] - len(content_masks[index]):] = torch.tensor(content_masks[index])
+                mask = mask.to(hidden.device).unsqueeze(-1)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+                pooled = torch.nn.functional.normalize(pooled, dim=-1).cpu()
+                for position, index in enumerate(indices):
+                    embeddings[index] = pooled[position]
+        return torch.stack(embeddings)
 
-        text = self.tokenizer.apply_chat_template(
+    @staticmethod
+    def _content_spans(text: str, messages: List[Dict[str, str]]) -> List[Tuple[int, int]]:
+        """各条消息内容在渲染后提示词中的字符区间（按消息顺序依次查找）"""
+        spans = []
+        position = 0
+        for message in messages:
+            content = message.get('content') or ''
+            start = text.find(content, position) if content else -1
+            if start >= 0:
+                spans.append((start, start + len(content)))
+                position = start + len(content)
+        return spans
+
+    def build_prompt(self, messages: List[Dict[str, str]], enable_thinking: bool = False) -> str:
+        """应用chat_template生成提示词文本"""
+        return self.tokenizer.apply_chat_template(
             messages,
             tokenize=False,
             add_generation_prompt=True,
             enable_thinking=enable_thinking
         )
 
-        model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
-
-        generated_ids = self.model.generate(
-            **model_inputs,
-            max_new_tokens=config.get('max_new_tokens', 512),
-            temperature=config.get('temperature', 0.7),
-            top_p=config.get('top_p', 0.8),
-            top_k=config.get('top_k', 20)
-        )
-
-        output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist()
-
+    def decode_output(self, output_ids: List[int], enable_thinking: bool = False) -> Dict[str, Any]:
+        """
+        解码生成的token
+        Args:
+            output_ids: 生成的token id（不含提示词）
+            enable_thinking: 是否解析thinking内容
+        Returns:
+            content与thinking_content
+        """
         # 如果启用thinking模式，解析思考内容
         thinking_content = None
         if enable_thinking:
@@ -79,51 +331,145 @@ class InferenceService:
             'thinking_content': thinking_content
         }
 
-    async def generate_stream(self, messages: List[Dict[str, str]], config: Dict[str, Any]) -> AsyncGenerator[str, None]:
+    def generate(self, messages: List[Dict[str, str]], config: Dict[str, Any]) -> Dict[str, Any]:
         """
-        流式推理（SSE）
+        普通推理（非流式）
         Args:
             messages: 对话消息列表
             config: 推理配置
-        Yields:
-            生成的文本片段
+        Returns:
+            推理结果
         """
         enable_thinking = config.get('enable_thinking', False)
 
-        text = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True,
-            enable_thinking=enable_thinking
-        )
+        text = self.build_prompt(messages, enable_thinking)
 
         model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
+        prompt_ids = model_inputs.input_ids[0].tolist()
 
-        # 使用生成器逐token生成
-        max_new_tokens = config.get('max_new_tokens', 512)
-
-        for i in range(max_new_tokens):
-            outputs = self.model.generate(
-                **model_inputs,
-                max_new_tokens=1,
+        adapter = self.adapters.resolve(config.get('adapter_id'))
+        budget = GenerationBudget(self.tokenizer, config)
+        with self.adapters.use(adapter):
+            generation_kwargs = dict(
+                max_new_tokens=config.get('max_new_tokens', 512),
                 temperature=config.get('temperature', 0.7),
                 top_p=config.get('top_p', 0.8),
                 top_k=config.get('top_k', 20),
-                do_sample=True
+                stopping_criteria=StoppingCriteriaList([BudgetStoppingCriteria(budget)]),
+                logits_processor=self._logits_processor(config),
+                return_dict_in_generate=True
+            )
+
+            # 命中前缀缓存时只prefill未缓存的后缀
+            if self.prefix_cache is not None:
+                _, prefix_kv = self.prefix_cache.match(adapter, prompt_ids)
+                if prefix_kv is not None:
+                    generation_kwargs['past_key_values'] = KVCacheUtil.to_cache(prefix_kv)
+
+            outputs = self.model.generate(**model_inputs, **generation_kwargs)
+
+            if self.prefix_cache is not None and outputs.past_key_values is not None:
+                prompt_kv = KVCacheUtil.select(KVCacheUtil.to_legacy(outputs.past_key_values), 0, 0, len(prompt_ids))
+                self.prefix_cache.insert(adapter, prompt_ids, prompt_kv)
+
+        output_ids = outputs.sequences[0][len(prompt_ids):].tolist()
+
+        result = self.decode_output(output_ids, enable_thinking)
+        result['content'] = budget.truncate(result['content'])
+        return result
+
+    def _get_draft_model(self):
+        """加载投机解码的草稿模型（与目标模型共用tokenizer）"""
+        with self.draft_lock:
+            if self.draft_model is None:
+                draft_model_path = self.speculative_config.get('draft_model_path')
+                if not draft_model_path:
+                    raise ValueError("未配置投机解码草稿模型: inference.speculative.draft_model_path")
+                print(f"加载草稿模型: {draft_model_path}")
+                self.draft_model = AutoModelForCausalLM.from_pretrained(
+                    draft_model_path,
+                    device_map="auto",
+                    dtype=self.model.dtype,
+                    use_cache=True
+                )
+                self.draft_model.eval()
+            return self.draft_model
+
+    def generate_speculative(self, messages: List[Dict[str, str]], config: Dict[str, Any],
+                             cancel_event: Optional[Event] = None) -> Dict[str, Any]:
+        """
+        投机解码推理（非流式），输出分布与普通推理一致
+        Args:
+            messages: 对话消息列表
+            config: 推理配置（num_speculative_tokens: 每轮草稿token数）
+            cancel_event: 客户端断开时被设置，解码在下一轮验证后结束
+        Returns:
+            推理结果，附带本次请求的接受率与加速比
+        """
+        enable_thinking = config.get('enable_thinking', False)
+        text = self.build_prompt(messages, enable_thinking)
+        prompt_ids = self.tokenizer(text)['input_ids']
+
+        adapter = self.adapters.resolve(config.get('adapter_id'))
+        with self.adapters.use(adapter):
+            decoder = SpeculativeDecoder(
+                self.model,
+                self._get_draft_model(),
+                self.eos_token_ids,
+                num_speculative_tokens=self.speculative_config.get('num_speculative_tokens', 4)
             )
+            budget = GenerationBudget(self.tokenizer, config, cancel_event.is_set if cancel_event is not None else None)
+            outputs = decoder.generate(prompt_ids, config, budget)
 
-            new_token_id = outputs[0, -1].item()
-            new_token = self.tokenizer.decode([new_token_id], skip_special_tokens=True)
+        output_ids = [token_id for token_id in outputs['output_ids'] if token_id not in self.eos_token_ids]
+        result = self.decode_output(output_ids, enable_thinking)
+        result['content'] = budget.truncate(result['content'])
+        result['finish_reason'] = outputs['finish_reason']
+        result['output_ids'] = outputs['output_ids']
+        result['speculative'] = outputs['speculative']
+        return result
 
-            # 流式返回token
-            yield f"data: {json.dumps({'token': new_token})}\n\n"
+    async def generate_stream(self, messages: List[Dict[str, str]], config: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        """
+        流式推理（SSE）
+        Args:
+            messages: 对话消息列表
+            config: 推理配置
+        Yields:
+            生成的文本片段
+        """
+        enable_thinking = config.get('enable_thinking', False)
 
-            # 检查是否结束
-            if new_token_id == self.tokenizer.eos_token_id:
-                break
+        text = self.build_prompt(messages, enable_thinking)
 
-            # 更新输入
-            model_inputs = {"input_ids": outputs, "attention_mask": torch.ones_like(outputs)}
+        model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
+
+        # 单次generate在后台线程中执行，KV缓存在解码步之间复用，token经异步队列逐个返回
+        streamer = AsyncTokenStreamer(asyncio.get_running_loop())
+        # 消费端关闭生成器（客户端断开）时通过stopping_criteria结束后台的generate
+        cancel_event = Event()
+        budget = GenerationBudget(self.tokenizer, config, cancel_event.is_set)
+        generation_kwargs = dict(
+            **model_inputs,
+            max_new_tokens=config.get('max_new_tokens', 512),
+            temperature=config.get('temperature', 0.7),
+            top_p=config.get('top_p', 0.8),
+            top_k=config.get('top_k', 20),
+            do_sample=True,
+            use_cache=True,
+            stopping_criteria=StoppingCriteriaList([BudgetStoppingCriteria(budget)]),
+            logits_processor=self._logits_processor(config)
+        )
+        generate_fn = functools.partial(self._generate_with_adapter, config.get('adapter_id'))
+        thread = Thread(target=streamer.run, args=(generate_fn, generation_kwargs), daemon=True)
+        thread.start()
+
+        detokenizer = IncrementalDetokenizer(self.tokenizer, enable_thinking, config.get('stop'))
+        try:
+            async for chunk in detokenizer.iter_sse(streamer):
+                yield chunk
+        finally:
+            cancel_event.set()
 
     def batch_generate(self, prompts: List[str], config: Dict[str, Any]) -> List[str]:
         """
@@ -134,13 +480,251 @@ class InferenceService:
         Returns:
             生成结果列表
         """
+        results: List[Optional[str]] = [None] * len(prompts)
+        for index, content in self.iter_batch_generate(prompts, config):
+            results[index] = content
+        return results
+
+    def iter_batch_generate(self, prompts: List[str], config: Dict[str, Any]) -> Iterator[Tuple[int, Any]]:
+        """
+        批量推理，每个micro-batch完成后立即产出其结果（按长度分桶时顺序与输入不同）
+        Args:
+            prompts: 提示词列表
+            config: 推理配置
+        Yields:
+            (提示词序号, 生成结果)；config['n'] > 1 时生成结果为按累计对数概率从高到低排列的n个候选
+        """
+        if (config.get('n') or 1) > 1 and Sampler.is_greedy(config):
+            raise ValueError("n > 1 需要采样（temperature > 0）")
         print(f"批量推理，共 {len(prompts)} 条数据")
 
-        results = []
-        for prompt in prompts:
-            messages = [{"role": "user", "content": prompt}]
-            result = self.generate(messages, config)
-            results.append(result['content'])
+        enable_thinking = config.get('enable_thinking', False)
+        batch_size = max(1, config.get('batch_size', 8))
+
+        # 批量渲染chat_template并分词
+        texts = [self.build_prompt([{"role": "user", "content": prompt}], enable_thinking) for prompt in prompts]
+        prompt_ids = self.tokenizer(texts)['input_ids']
+
+        # 按长度分桶：长度相近的提示词进入同一个micro-batch，减少补齐浪费
+        order = list(range(len(prompts)))
+        if config.get('length_bucketing', True):
+            order.sort(key=lambda index: len(prompt_ids[index]))
+
+        batches = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+        micro_batches = [[prompt_ids[index] for index in indices] for indices in batches]
+        for position, outputs in self._map_micro_batches(micro_batches, config):
+            for index, output in zip(batches[position], outputs):
+                if (config.get('n') or 1) > 1:
+                    yield index, [{'content': self.decode_output(output_ids, enable_thinking)['content'],
+                                   'cumulative_logprob': logprob} for output_ids, logprob in output]
+                else:
+                    yield index, self.decode_output(output, enable_thinking)['content']
 
         print("批量推理完成")
+
+    def cached_batch_generate(self, prompts: List[str], config: Dict[str, Any],
+                              response_cache: Optional[ResponseCache],
+                              semantic_cache: Optional[SemanticCache] = None) -> Tuple[List[str], int]:
+        """
+        批量推理，确定性请求先查响应缓存（及语义缓存），只对未命中的提示词执行推理
+        Args:
+            prompts: 提示词列表
+            config: 推理配置
+            response_cache: 响应缓存，为空时直接推理
+            semantic_cache: 语义缓存，为空时只做精确匹配
+        Returns:
+            (生成结果列表, 缓存命中数)
+        """
+        results: List[Optional[str]] = [None] * len(prompts)
+        cache_hits = 0
+        for index, content, cached in self.iter_cached_batch_generate(prompts, config, response_cache, semantic_cache):
+            results[index] = content
+            cache_hits += cached
+        return results, cache_hits
+
+    def iter_cached_batch_generate(self, prompts: List[str], config: Dict[str, Any],
+                                   response_cache: Optional[ResponseCache],
+                                   semantic_cache: Optional[SemanticCache] = None) -> Iterator[Tuple[int, str, bool]]:
+        """
+        批量推理（逐个产出），缓存命中的结果最先产出，其余结果在所属micro-batch完成后产出；
+        精确匹配未命中的提示词批量计算向量后查找语义缓存
+        Yields:
+            (提示词序号, 生成结果, 是否命中缓存)
+        """
+        if response_cache is None or not ResponseCache.is_cacheable(config):
+            for index, content in self.iter_batch_generate(prompts, config):
+                yield index, content, False
+            return
+
+        enable_thinking = config.get('enable_thinking', False)
+        texts = [self.build_prompt([{"role": "user", "content": prompt}], enable_thinking) for prompt in prompts]
+        entries = [self.response_cache_key(text, config) for text in texts]
+
+        pending = []
+        for index, (key, _) in enumerate(entries):
+            cached = response_cache.get(key)
+            if cached is not None:
+                yield index, cached['content'], True
+            else:
+                pending.append(index)
+
+        # 未命中的提示词 -> 其向量在embeddings中的行
+        embedding_rows: Dict[int, int] = {}
+        embeddings = None
+        if pending and semantic_cache is not None and self.supports_embedding:
+            conversations = [[{"role": "user", "content": prompts[index]}] for index in pending]
+            embeddings, hits = self.semantic_lookup(semantic_cache, conversations, config)
+            embedding_rows = {index: row for row, index in enumerate(pending)}
+            remaining = []
+            for index, hit in zip(pending, hits):
+                if hit is not None:
+                    yield index, hit[0]['content'], True
+                else:
+                    remaining.append(index)
+            pending = remaining
+
+        if pending:
+            for position, content in self.iter_batch_generate([prompts[index] for index in pending], config):
+                index = pending[position]
+                key, adapter = entries[index]
+                response_cache.put(key, {'content': content}, self.model_id, self.model_version, adapter)
+                if embeddings is not None:
+                    row = embedding_rows[index]
+                    self.semantic_store(semantic_cache, embeddings[row:row + 1], [{'content': content}], config)
+                yield index, content, False
+
+    def semantic_lookup(self, semantic_cache: SemanticCache, conversations: List[List[Dict[str, str]]],
+                        config: Dict[str, Any]) -> Tuple[torch.Tensor, List[Optional[Tuple[Dict[str, Any], float]]]]:
+        """
+        计算对话向量并查找语义缓存
+        Args:
+            semantic_cache: 语义缓存
+            conversations: 对话消息列表
+            config: 推理配置
+        Returns:
+            (对话向量, 每条对话的 (缓存结果, 相似度) 或None)
+        """
+        embeddings = self.embed(conversations, config.get('enable_thinking', False), config.get('adapter_id'),
+                                semantic_cache.batch_size, semantic_cache.max_prompt_tokens)
+        namespace, _ = self.semantic_cache_key(config)
+        return embeddings, semantic_cache.get(namespace, embeddings)
+
+    def semantic_store(self, semantic_cache: SemanticCache, embeddings: torch.Tensor, values: List[Dict[str, Any]],
+                       config: Dict[str, Any]):
+        """将生成结果与提示词向量写入语义缓存"""
+        namespace, adapter = self.semantic_cache_key(config)
+        semantic_cache.put(namespace, embeddings, values, self.model_id, self.model_version, adapter)
+
+    def _map_micro_batches(self, micro_batches: List[List[List[int]]],
+                           config: Dict[str, Any]) -> Iterator[Tuple[int, List[List[int]]]]:
+        """
+        依次生成各micro-batch
+        Yields:
+            (micro-batch序号, 各提示词生成的token id)
+        """
+        for position, batch_prompt_ids in enumerate(micro_batches):
+            yield position, self._generate_micro_batch(batch_prompt_ids, config)
+
+    def _generate_micro_batch(self, batch_prompt_ids: List[List[int]], config: Dict[str, Any]) -> List[List[int]]:
+        """
+        对一个micro-batch执行一次generate
+        Args:
+            batch_prompt_ids: 各提示词的token id
+            config: 推理配置
+        Returns:
+            各提示词生成的token id（已去除提示词、补齐和结束token）；
+            config['n'] > 1 时每个提示词为n个 (token id, 累计对数概率)，按累计对数概率从高到低排列
+        """
+        model_inputs = self.tokenizer.pad(
+            {'input_ids': batch_prompt_ids},
+            padding=True,
+            return_tensors="pt"
+        ).to(self.model.device)
+
+        sampling_kwargs = dict(do_sample=False)
+        if not Sampler.is_greedy(config):
+            sampling_kwargs = dict(
+                do_sample=True,
+                temperature=config.get('temperature', 0.7),
+                top_p=config.get('top_p', 0.8),
+                top_k=config.get('top_k', 20)
+            )
+            if config.get('seed') is not None:
+                torch.manual_seed(config['seed'])
+
+        n = config.get('n') or 1
+        if n > 1:
+            return self._sample_micro_batch(model_inputs, config, n, sampling_kwargs)
+
+        generated_ids = self._generate_with_adapter(
+            config.get('adapter_id'),
+            **model_inputs,
+            max_new_tokens=config.get('max_new_tokens', 512),
+            pad_token_id=self.tokenizer.pad_token_id,
+            **sampling_kwargs
+        )
+
+        # 左侧补齐后所有提示词长度一致，统一截掉提示词部分
+        prompt_length = model_inputs['input_ids'].shape[1]
+        eos_token_ids = self.eos_token_ids
+        outputs = []
+        for row in generated_ids[:, prompt_length:].tolist():
+            end = next((i for i, token_id in enumerate(row) if token_id in eos_token_ids), len(row))
+            outputs.append(row[:end])
+        return outputs
+
+    def _sample_micro_batch(self, model_inputs, config: Dict[str, Any], n: int,
+                            sampling_kwargs: Dict[str, Any]) -> List[List[Tuple[List[int], float]]]:
+        """
+        n-best采样：提示词（最后一个token除外）只prefill一次，KV按行复制n份后在一次generate中批量解码，
+        generate只需计算最后一个提示词token；每个候选累计所选token在模型原始分布下的对数概率
+        """
+        input_ids = model_inputs['input_ids']
+        attention_mask = model_inputs['attention_mask']
+        prompt_length = input_ids.shape[1]
+        adapter = self.adapters.resolve(config.get('adapter_id'))
+        generation_kwargs = dict(
+            input_ids=input_ids.repeat_interleave(n, dim=0),
+            attention_mask=attention_mask.repeat_interleave(n, dim=0),
+            max_new_tokens=config.get('max_new_tokens', 512),
+            pad_token_id=self.tokenizer.pad_token_id,
+            return_dict_in_generate=True,
+            output_logits=True,
+            **sampling_kwargs
+        )
+        with self.adapters.use(adapter):
+            if prompt_length > 1:
+                # 与generate相同的方式由attention_mask推出左侧补齐后的位置
+                position_ids = (attention_mask.long().cumsum(-1) - 1).clamp(min=0)
+                with torch.no_grad():
+                    prefill = self.model(
+                        input_ids=input_ids[:, :-1],
+                        attention_mask=attention_mask[:, :-1],
+                        position_ids=position_ids[:, :-1],
+                        use_cache=True,
+                        logits_to_keep=1
+                    )
+                past = KVCacheUtil.repeat_rows(KVCacheUtil.to_legacy(prefill.past_key_values), n)
+                generation_kwargs['past_key_values'] = KVCacheUtil.to_cache(past)
+            outputs = self.model.generate(**generation_kwargs)
+
+        sequences = outputs.sequences[:, prompt_length:]
+        # 每一步所选token的对数概率 [batch * n, 生成长度]
+        token_logprobs = torch.stack([
+            torch.log_softmax(step_logits.float(), dim=-1).gather(-1, sequences[:, step:step + 1]).squeeze(-1)
+            for step, step_logits in enumerate(outputs.logits)
+        ], dim=1)
+
+        eos_token_ids = self.eos_token_ids
+        results = []
+        for start in range(0, sequences.shape[0], n):
+            candidates = []
+            for row in range(start, start + n):
+                token_ids = sequences[row].tolist()
+                end = next((i for i, token_id in enumerate(token_ids) if token_id in eos_token_ids), None)
+                # 累计对数概率包含结束token
+                logprob = token_logprobs[row, :len(token_ids) if end is None else end + 1].sum().item()
+                candidates.append((token_ids[:end], logprob))
+            candidates.sort(key=lambda candidate: candidate[1], reverse=True)
+            results.append(candidates)
         return results
@@ -0,0 +1,108 @@
+from typing import Any, Callable, Dict, List
+from concurrent.futures import Future
+from threading import Thread, Lock
+import queue
+import math
+import time
+
+
+class QueueFullError(Exception):
+    """推理队列已满，请求被拒绝"""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        # 建议客户端重试的等待秒数
+        self.retry_after = retry_after
+
+
+class InferenceWorkerPool:
+    """推理工作线程池 - 阻塞的推理任务在专用线程上执行，队列有界，满时立即拒绝"""
+
+    def __init__(self, num_workers: int = 1, max_queue_size: int = 100, name: str = "inference-worker"):
+        """
+        初始化工作线程池
+        Args:
+            num_workers: 工作线程数
+            max_queue_size: 排队任务上限，超出时submit抛出QueueFullError
+            name: 线程名前缀
+        """
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self.tasks: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self.lock = Lock()
+
+        # 统计信息
+        self.active = 0
+        self.total_submitted = 0
+        self.total_completed = 0
+        self.total_rejected = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.total_run_time = 0.0
+
+        self.threads: List[Thread] = []
+        for index in range(num_workers):
+            thread = Thread(target=self._worker, name=f"{name}-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """
+        提交任务
+        Returns:
+            任务完成时返回结果的Future
+        Raises:
+            QueueFullError: 队列已满
+        """
+        future: Future = Future()
+        try:
+            self.tasks.put_nowait((future, fn, args, kwargs, time.time()))
+        except queue.Full:
+            with self.lock:
+                self.total_rejected += 1
+            raise QueueFullError(f"推理队列已满（{self.max_queue_size}），请稍后重试", self.estimate_retry_after())
+        with self.lock:
+            self.total_submitted += 1
+        return future
+
+    def estimate_retry_after(self) -> int:
+        """按平均执行时间估算排队任务清空所需的秒数"""
+        average_run_time = self.total_run_time / self.total_completed if self.total_completed else 1.0
+        return max(1, math.ceil(average_run_time * self.tasks.qsize() / max(self.num_workers, 1)))
+
+    def stats(self) -> Dict[str, Any]:
+        """队列深度与等待时间统计"""
+        return {
+            'workers': self.num_workers,
+            'active': self.active,
+            'queue_depth': self.tasks.qsize(),
+            'max_queue_size': self.max_queue_size,
+            'total_submitted': self.total_submitted,
+            'total_completed': self.total_completed,
+            'total_rejected': self.total_rejected,
+            'avg_wait_seconds': self.total_wait_time / self.total_completed if self.total_completed else 0.0,
+            'max_wait_seconds': self.max_wait_time,
+            'avg_run_seconds': self.total_run_time / self.total_completed if self.total_completed else 0.0
+        }
+
+    def _worker(self):
+        while True:
+            future, fn, args, kwargs, enqueue_time = self.tasks.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            start_time = time.time()
+            with self.lock:
+                self.active += 1
+                wait_time = start_time - enqueue_time
+                self.total_wait_time += wait_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.active -= 1
+                    self.total_completed += 1
+                    self.total_run_time += time.time() - start_time
@@ -0,0 +1,171 @@
+from typing import Dict, Any, Optional
+import json
+
+# JSON字符串中的一个字符：非控制字符、非引号和反斜杠，或合法的转义
+STRING_CHAR = r'([^"\\\x00-\x1f]|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})'
+STRING = rf'"{STRING_CHAR}*"'
+INTEGER = r'-?(0|[1-9][0-9]*)'
+NUMBER = rf'{INTEGER}(\.[0-9]+)?([eE][+-]?[0-9]+)?'
+BOOLEAN = r'(true|false)'
+NULL = r'null'
+# 冒号与逗号后允许一个空格（与模型常见的输出格式一致，又不会无限输出空白）
+WHITESPACE = r'[ ]?'
+
+_REGEX_SPECIAL = set('\\.^$|?*+()[]{}')
+
+
+class JsonSchemaRegex:
+    """
+    JSON Schema转正则表达式 - 支持 object/array/string/integer/number/boolean/null、enum、const、
+    anyOf/oneOf、type列表和本地 $ref；对象属性按schema中声明的顺序输出，未声明的属性不允许出现
+    """
+
+    # 字符串minLength/maxLength逐字符展开，DFA每个字符约13个状态；超过该长度的maxLength不在约束中限制
+    # （长度由max_tokens限制），超过该长度的minLength无法编译
+    MAX_COUNTED_LENGTH = 64
+
+    def __init__(self, schema: Dict[str, Any], whitespace: str = WHITESPACE, max_depth: int = 2):
+        """
+        Args:
+            schema: JSON Schema
+            whitespace: 冒号与逗号后允许的空白
+            max_depth: 未声明结构的对象/数组（任意JSON值）展开的嵌套层数
+        """
+        self.schema = schema
+        self.whitespace = whitespace
+        self.max_depth = max_depth
+
+    @classmethod
+    def to_regex(cls, schema: Dict[str, Any], whitespace: str = WHITESPACE) -> str:
+        return cls(schema, whitespace).convert(schema)
+
+    @staticmethod
+    def escape(text: str) -> str:
+        """转义正则元字符"""
+        return ''.join('\\' + char if char in _REGEX_SPECIAL else char for char in text)
+
+    def convert(self, schema: Dict[str, Any], refs: tuple = ()) -> str:
+        """转换一个子schema；refs为正在展开的 $ref，用于发现递归定义"""
+        if schema is True or schema == {}:
+            return self._any_value(self.max_depth)
+        if '$ref' in schema:
+            ref = schema['$ref']
+            if ref in refs:
+                raise ValueError(f"不支持递归的JSON Schema定义: {ref}")
+            return self.convert(self._resolve(ref), refs + (ref,))
+        if 'const' in schema:
+            return self.escape(json.dumps(schema['const'], ensure_ascii=False))
+        if 'enum' in schema:
+            return '(' + '|'.join(self.escape(json.dumps(value, ensure_ascii=False)) for value in schema['enum']) + ')'
+        for key in ('anyOf', 'oneOf'):
+            if key in schema:
+                return '(' + '|'.join(self.convert(option, refs) for option in schema[key]) + ')'
+        if 'allOf' in schema and len(schema['allOf']) == 1:
+            return self.convert(schema['allOf'][0], refs)
+
+        schema_type = schema.get('type')
+        if isinstance(schema_type, list):
+            return '(' + '|'.join(self.convert(dict(schema, type=item), refs) for item in schema_type) + ')'
+        if schema_type == 'object' or (schema_type is None and 'properties' in schema):
+            return self._object(schema, refs)
+        if schema_type == 'array':
+            return self._array(schema, refs)
+        if schema_type == 'string':
+            return self._string(schema)
+        if schema_type == 'integer':
+            return INTEGER
+        if schema_type == 'number':
+            return NUMBER
+        if schema_type == 'boolean':
+            return BOOLEAN
+        if schema_type == 'null':
+            return NULL
+        if schema_type is None:
+            return self._any_value(self.max_depth)
+        raise ValueError(f"不支持的JSON Schema类型: {schema_type}")
+
+    def _resolve(self, ref: str) -> Dict[str, Any]:
+        if not ref.startswith('#/'):
+            raise ValueError(f"只支持本地 $ref: {ref}")
+        node: Any = self.schema
+        for part in ref[2:].split('/'):
+            node = node[part.replace('~1', '/').replace('~0', '~')]
+        return node
+
+    def _object(self, schema: Dict[str, Any], refs: tuple) -> str:
+        properties: Dict[str, Any] = schema.get('properties') or {}
+        if not properties:
+            return self._any_object(self.max_depth)
+        required = set(schema.get('required') or [])
+        names = list(properties)
+        items = [rf'"{self.escape(name)}":{self.whitespace}{self.convert(properties[name], refs)}' for name in names]
+        separator = ',' + self.whitespace
+
+        # 按第一个出现的属性分支，保证逗号只出现在属性之间；第一个属性之前的属性都必须是可选的
+        branches = []
+        for first, name in enumerate(names):
+            branch = items[first]
+            for index in range(first + 1, len(names)):
+                if names[index] in required:
+                    branch += separator + items[index]
+                else:
+                    branch += f'({separator}{items[index]})?'
+            branches.append(branch)
+            if name in required:
+                break
+        body = '(' + '|'.join(branches) + ')'
+        if not required:
+            body += '?'
+        return r'\{' + body + r'\}'
+
+    def _array(self, schema: Dict[str, Any], refs: tuple) -> str:
+        items = schema.get('items')
+        item = self.convert(items, refs) if isinstance(items, dict) else self._any_value(self.max_depth - 1)
+        separator = ',' + self.whitespace
+        minimum = schema.get('minItems', 0)
+        maximum: Optional[int] = schema.get('maxItems')
+        if maximum == 0:
+            return r'\[\]'
+        # 第一个元素之后的元素带逗号
+        rest_min = max(minimum - 1, 0)
+        rest_max = '' if maximum is None else str(maximum - 1)
+        body = f'{item}({separator}{item}){{{rest_min},{rest_max}}}'
+        if minimum == 0:
+            body = f'({body})?'
+        return r'\[' + body + r'\]'
+
+    def _string(self, schema: Dict[str, Any]) -> str:
+        if 'pattern' in schema:
+            pattern = schema['pattern']
+            body = pattern[1 if pattern.startswith('^') else 0:-1 if pattern.endswith('$') else None]
+            # 分组后再加引号，否则顶层的 | 会把引号拆到不同分支中
+            return '"(' + body + ')"'
+        if schema.get('format') == 'date':
+            return r'"[0-9]{4}-[0-9]{2}-[0-9]{2}"'
+        if schema.get('format') == 'date-time':
+            return r'"[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]+)?(Z|[+-][0-9]{2}:[0-9]{2})?"'
+        minimum = schema.get('minLength', 0)
+        maximum = schema.get('maxLength')
+        if minimum > self.MAX_COUNTED_LENGTH:
+            raise ValueError(f"字符串minLength不能超过 {self.MAX_COUNTED_LENGTH}: {minimum}")
+        if maximum is not None and maximum > self.MAX_COUNTED_LENGTH:
+            maximum = None
+        if minimum or maximum is not None:
+            return f'"{STRING_CHAR}{{{minimum},{"" if maximum is None else maximum}}}"'
+        return STRING
+
+    def _any_value(self, depth: int) -> str:
+        """任意JSON值，对象和数组最多嵌套depth层"""
+        options = [STRING, NUMBER, BOOLEAN, NULL]
+        if depth > 0:
+            options += [self._any_object(depth), self._any_array(depth)]
+        return '(' + '|'.join(options) + ')'
+
+    def _any_object(self, depth: int) -> str:
+        value = self._any_value(depth - 1)
+        item = f'{STRING}:{self.whitespace}{value}'
+        return rf'\{{({item}(,{self.whitespace}{item})*)?\}}'
+
+    def _any_array(self, depth: int) -> str:
+        value = self._any_value(depth - 1)
+        return rf'\[({value}(,{self.whitespace}{value})*)?\]'
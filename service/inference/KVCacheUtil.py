@@ -0,0 +1,89 @@
+from typing import List, Optional, Sequence, Tuple
+from transformers import DynamicCache
+import torch
+
+# 旧式KV缓存格式：每层一个(key, value)，形状均为 [batch, kv_heads, seq_len, head_dim]
+LegacyCache = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+
+class KVCacheUtil:
+    """KV缓存工具 - 在旧式元组格式与transformers Cache对象之间转换、拼接和切分"""
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def to_cache(legacy: Optional[LegacyCache]) -> DynamicCache:
+        """旧式元组转为DynamicCache"""
+        if legacy is None:
+            return DynamicCache()
+        return DynamicCache.from_legacy_cache(legacy)
+
+    @staticmethod
+    def to_legacy(cache) -> LegacyCache:
+        """Cache对象转为旧式元组"""
+        if isinstance(cache, (tuple, list)):
+            return tuple((k, v) for k, v in cache)
+        return cache.to_legacy_cache()
+
+    @staticmethod
+    def seq_length(legacy: Optional[LegacyCache]) -> int:
+        """缓存覆盖的token数"""
+        if not legacy:
+            return 0
+        return legacy[0][0].shape[-2]
+
+    @staticmethod
+    def stack_left_padded(pasts: Sequence[LegacyCache], max_len: int) -> LegacyCache:
+        """
+        将多条batch=1的缓存左侧补零后在batch维拼接
+        Args:
+            pasts: 各序列的缓存
+            max_len: 对齐后的长度
+        Returns:
+            batch=len(pasts)的缓存
+        """
+        layers = []
+        for layer_index in range(len(pasts[0])):
+            keys, values = [], []
+            for past in pasts:
+                key, value = past[layer_index]
+                pad = max_len - key.shape[-2]
+                if pad > 0:
+                    key = torch.nn.functional.pad(key, (0, 0, pad, 0))
+                    value = torch.nn.functional.pad(value, (0, 0, pad, 0))
+                keys.append(key)
+                values.append(value)
+            layers.append((torch.cat(keys, dim=0), torch.cat(values, dim=0)))
+        return tuple(layers)
+
+    @staticmethod
+    def select(legacy: LegacyCache, row: int, start: int = 0, end: Optional[int] = None) -> LegacyCache:
+        """取出batch中的一行，并截取 [start, end) 位置"""
+        return tuple(
+            (key[row:row + 1, :, start:end], value[row:row + 1, :, start:end])
+            for key, value in legacy
+        )
+
+    @staticmethod
+    def repeat_rows(legacy: LegacyCache, n: int) -> LegacyCache:
+        """batch中的每一行连续复制n份（与 repeat_interleave 展开的输入对齐）"""
+        return tuple(
+            (key.repeat_interleave(n, dim=0), value.repeat_interleave(n, dim=0))
+            for key, value in legacy
+        )
+
+    @staticmethod
+    def concat(pasts: List[LegacyCache]) -> LegacyCache:
+        """在序列维拼接多段batch=1的缓存"""
+        return tuple(
+            (torch.cat([past[i][0] for past in pasts], dim=-2), torch.cat([past[i][1] for past in pasts], dim=-2))
+            for i in range(len(pasts[0]))
+        )
+
+    @staticmethod
+    def nbytes(legacy: Optional[LegacyCache]) -> int:
+        """缓存占用的字节数"""
+        if not legacy:
+            return 0
+        return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in legacy)
@@ -0,0 +1,248 @@
+from typing import Dict, Any, Callable, Optional
+from transformers import AutoModelForCausalLM
+from peft import PeftModel
+from threading import Lock, Thread
+import threading
+import hashlib
+import shutil
+import json
+import torch
+import time
+import os
+
+
+class MergedModelCache:
+    """
+    合并LoRA权重缓存 - LoRA经merge_and_unload合并进基础权重后以safetensors写入磁盘，
+    目录按 (基础模型内容哈希, 适配器内容哈希, dtype) 寻址，之后直接从缓存目录加载（safetensors按mmap读取），
+    推理时没有PEFT逐层叠加LoRA的开销；适配器重新训练后内容哈希变化，旧条目失效并被删除
+    """
+
+    # 参与内容哈希的文件（权重与配置）
+    HASHED_SUFFIXES = ('.safetensors', '.bin', '.json')
+    # 文件内容哈希的记录（按路径、大小、修改时间），避免每次启动重新读取全部权重
+    HASHES_FILE = "hashes.json"
+    # 来源 (模型路径, 适配器路径, dtype) -> 当前有效的缓存条目
+    INDEX_FILE = "index.json"
+
+    _instances: Dict[str, "MergedModelCache"] = {}
+    _instances_lock = Lock()
+
+    def __init__(self, cache_dir: str, max_entries: int = 4):
+        """
+        初始化合并权重缓存
+        Args:
+            cache_dir: 缓存目录
+            max_entries: 最多保留的合并模型数，超出后删除最久未使用的条目
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = Lock()
+        self.hashes: Dict[str, str] = self._read_json(self.HASHES_FILE)
+        self.index: Dict[str, Dict[str, Any]] = self._read_json(self.INDEX_FILE)
+        # 正在后台重建的来源
+        self.rebuilding: set = set()
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.total_build_time = 0.0
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "MergedModelCache":
+        """按config.yaml中的inference.merged_lora配置获取缓存（同一目录共用一个实例）"""
+        cache_dir = config['cache_dir']
+        with cls._instances_lock:
+            cache = cls._instances.get(cache_dir)
+            if cache is None:
+                cache = cls(cache_dir, max_entries=config.get('max_entries', 4))
+                cls._instances[cache_dir] = cache
+            return cache
+
+    def content_hash(self, path: str) -> str:
+        """目录中权重与配置文件的内容哈希"""
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(path)):
+            file_path = os.path.join(path, name)
+            if os.path.isfile(file_path) and name.endswith(self.HASHED_SUFFIXES):
+                digest.update(f"{name}:{self._file_digest(file_path)}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def entry_path(self, model_path: str, lora_adapter_path: str, dtype: str) -> str:
+        """合并模型的缓存目录"""
+        name = f"merged-{self.content_hash(model_path)[:16]}-{self.content_hash(lora_adapter_path)[:16]}-{dtype}"
+        return os.path.join(self.cache_dir, name)
+
+    def load(self, model_path: str, lora_adapter_path: str, dtype: str = "bfloat16", device_map: str = "auto"):
+        """
+        加载合并后的模型，缓存未命中时先合并并写入缓存
+        Args:
+            model_path: 基础模型路径
+            lora_adapter_path: LoRA适配器路径
+            dtype: 权重精度
+        Returns:
+            合并后的模型（不含PEFT层）
+        """
+        path = self.entry_path(model_path, lora_adapter_path, dtype)
+        if os.path.isdir(path):
+            self.hits += 1
+            self._touch(model_path, lora_adapter_path, dtype, path)
+            print(f"加载合并LoRA缓存: {path}")
+        else:
+            self.misses += 1
+            path = self.build(model_path, lora_adapter_path, dtype)
+        return AutoModelForCausalLM.from_pretrained(path, device_map=device_map, dtype=getattr(torch, dtype), use_cache=True)
+
+    def build(self, model_path: str, lora_adapter_path: str, dtype: str = "bfloat16") -> str:
+        """
+        合并LoRA并写入缓存（已存在时直接返回），同一来源的旧条目随之删除
+        Returns:
+            缓存目录
+        """
+        path = self.entry_path(model_path, lora_adapter_path, dtype)
+        if os.path.isdir(path):
+            self._touch(model_path, lora_adapter_path, dtype, path)
+            return path
+
+        start_time = time.time()
+        print(f"合并LoRA适配器: {model_path} + {lora_adapter_path}")
+        # 以float32合并，避免低精度下 W + BA 的舍入误差，写入时再转换为目标精度
+        model = AutoModelForCausalLM.from_pretrained(model_path, device_map="cpu", dtype=torch.float32)
+        model = PeftModel.from_pretrained(model, lora_adapter_path).merge_and_unload()
+        model = model.to(getattr(torch, dtype))
+
+        temp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        model.save_pretrained(temp_path, safe_serialization=True)
+        with open(os.path.join(temp_path, "merged_from.json"), 'w', encoding='utf-8') as f:
+            json.dump({'model_path': model_path, 'lora_adapter_path': lora_adapter_path, 'dtype': dtype,
+                       'created_at': time.time()}, f, ensure_ascii=False, indent=2)
+        del model
+        try:
+            os.replace(temp_path, path)
+        except OSError:
+            # 其他进程已写入相同条目
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+        elapsed = time.time() - start_time
+        with self.lock:
+            self.builds += 1
+            self.total_build_time += elapsed
+        print(f"合并LoRA已缓存: {path}，耗时 {elapsed:.1f}秒")
+        self._touch(model_path, lora_adapter_path, dtype, path)
+        return path
+
+    def rebuild_async(self, model_path: str, lora_adapter_path: str, dtype: str,
+                      on_ready: Optional[Callable[[str], None]] = None) -> Optional[Thread]:
+        """
+        适配器热更新：后台重建合并权重，完成后以新的缓存目录调用on_ready
+        Returns:
+            重建线程；同一来源已在重建时返回None
+        """
+        source = self._source(model_path, lora_adapter_path, dtype)
+        with self.lock:
+            if source in self.rebuilding:
+                return None
+            self.rebuilding.add(source)
+
+        def run():
+            try:
+                path = self.build(model_path, lora_adapter_path, dtype)
+                if on_ready is not None:
+                    on_ready(path)
+            except Exception as e:
+                print(f"重建合并LoRA失败: {lora_adapter_path}, 错误: {e}")
+            finally:
+                with self.lock:
+                    self.rebuilding.discard(source)
+
+        thread = Thread(target=run, name="merged-lora-rebuild", daemon=True)
+        thread.start()
+        return thread
+
+    def invalidate(self, model_path: str, lora_adapter_path: str) -> int:
+        """删除某个适配器的全部合并条目（所有dtype）"""
+        prefix = self._source(model_path, lora_adapter_path, "")
+        with self.lock:
+            sources = [source for source in self.index if source.startswith(prefix)]
+            for source in sources:
+                self._remove_locked(source)
+            self._write_json(self.INDEX_FILE, self.index)
+        return len(sources)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.index),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'builds': self.builds,
+            'avg_build_seconds': self.total_build_time / self.builds if self.builds else 0.0,
+            'rebuilding': sorted(self.rebuilding)
+        }
+
+    def _file_digest(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        memo_key = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        with self.lock:
+            digest = self.hashes.get(memo_key)
+        if digest is not None:
+            return digest
+
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(8 * 1024 * 1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with self.lock:
+            self.hashes[memo_key] = digest
+            self._write_json(self.HASHES_FILE, self.hashes)
+        return digest
+
+    def _touch(self, model_path: str, lora_adapter_path: str, dtype: str, path: str):
+        """登记来源当前的缓存条目，旧条目（适配器已重新训练）删除，超出条目数时淘汰最久未使用的条目"""
+        source = self._source(model_path, lora_adapter_path, dtype)
+        name = os.path.basename(path)
+        with self.lock:
+            previous = self.index.get(source)
+            if previous is not None and previous['entry'] != name:
+                self._remove_locked(source)
+            self.index[source] = {'entry': name, 'last_used': time.time()}
+            while len(self.index) > self.max_entries:
+                oldest = min(self.index, key=lambda item: self.index[item]['last_used'])
+                self._remove_locked(oldest)
+            self._write_json(self.INDEX_FILE, self.index)
+
+    def _remove_locked(self, source: str):
+        entry = self.index.pop(source, None)
+        if entry is None:
+            return
+        # 不同来源可能指向同一内容的条目
+        if any(other['entry'] == entry['entry'] for other in self.index.values()):
+            return
+        shutil.rmtree(os.path.join(self.cache_dir, entry['entry']), ignore_errors=True)
+
+    @staticmethod
+    def _source(model_path: str, lora_adapter_path: str, dtype: str) -> str:
+        return f"{os.path.abspath(model_path)}|{os.path.abspath(lora_adapter_path)}|{dtype}"
+
+    def _read_json(self, name: str) -> Dict[str, Any]:
+        path = os.path.join(self.cache_dir, name)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_json(self, name: str, value: Dict[str, Any]):
+        path = os.path.join(self.cache_dir, name)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
@@ -0,0 +1,290 @@
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
+from threading import Lock, Thread
+from service.inference.InferenceService import InferenceService
+from service.inference.InferenceEngine import InferenceEngine
+from service.inference.ReplicaPool import ReplicaInferenceService
+from service.inference.ResponseCache import ResponseCache
+from service.inference.SemanticCache import SemanticCache
+from service.inference.MergedModelCache import MergedModelCache
+import time
+import gc
+
+# 模型键：(model_path, lora_adapter_path, dtype)
+ModelKey = Tuple[str, Optional[str], str]
+
+
+class ModelHandle:
+    """已加载模型的句柄"""
+
+    def __init__(self, key: ModelKey, service: InferenceService, engine):
+        self.key = key
+        self.service = service
+        self.engine = engine
+        # 正在使用该模型的请求数，大于0时不会被淘汰
+        self.ref_count = 0
+        self.size_bytes = service.memory_footprint()
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        # 卸载请求到达时仍有请求在用，待引用归零后卸载
+        self.unload_pending = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'model_path': self.key[0],
+            'lora_adapter_path': self.key[1],
+            'dtype': self.key[2],
+            'backend': self.service.backend,
+            'merged_lora': self.service.merged,
+            'ref_count': self.ref_count,
+            'size_mb': round(self.size_bytes / 1024 / 1024, 2),
+            'loaded_at': self.loaded_at,
+            'last_used': self.last_used,
+            'unload_pending': self.unload_pending,
+            'engine': self.engine.stats(),
+            'adapters': self.service.adapters.list_adapters()
+        }
+
+
+class ModelRegistry:
+    """模型注册表 - 按 (模型路径, LoRA路径, dtype) 缓存已加载模型，按内存预算LRU淘汰"""
+
+    def __init__(self, max_models: int = 2, max_memory_mb: Optional[float] = None,
+                 service_config: Optional[Dict[str, Any]] = None):
+        """
+        初始化模型注册表
+        Args:
+            max_models: 最多同时加载的模型数
+            max_memory_mb: 所有模型权重的内存预算（MB），为空时不限制
+            service_config: config.yaml中的inference配置，用于创建每个模型的服务与引擎
+        """
+        self.max_models = max_models
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024 if max_memory_mb else None
+        self.service_config = service_config or {}
+        self.engine_config = self.service_config.get('engine', {}) or {}
+        self.replica_config = self.service_config.get('replicas', {}) or {}
+        self.merged_config = self.service_config.get('merged_lora', {}) or {}
+        self.handles: "OrderedDict[ModelKey, ModelHandle]" = OrderedDict()
+        self.default_key: Optional[ModelKey] = None
+        # lock保护handles，load_lock串行化磁盘加载
+        self.lock = Lock()
+        self.load_lock = Lock()
+
+        # 确定性请求的响应缓存，所有模型共用
+        cache_config = self.service_config.get('response_cache', {}) or {}
+        self.response_cache: Optional[ResponseCache] = None
+        if cache_config.get('enabled', True):
+            self.response_cache = ResponseCache(
+                max_entries=cache_config.get('max_entries', 1024),
+                ttl_seconds=cache_config.get('ttl_seconds', 3600),
+                db_path=cache_config.get('db_path')
+            )
+
+        # 语义响应缓存：与已缓存提示词的向量相似度超过阈值时复用结果，默认关闭
+        semantic_config = self.service_config.get('semantic_cache', {}) or {}
+        self.semantic_cache: Optional[SemanticCache] = None
+        if semantic_config.get('enabled', False):
+            self.semantic_cache = SemanticCache(
+                save_path=semantic_config.get('save_path'),
+                threshold=semantic_config.get('threshold', 0.97),
+                max_entries=semantic_config.get('max_entries', 10000),
+                ttl_seconds=semantic_config.get('ttl_seconds', 86400),
+                min_train_size=semantic_config.get('min_train_size', 1024),
+                nprobe=semantic_config.get('nprobe', 8),
+                save_every=semantic_config.get('save_every', 32),
+                batch_size=semantic_config.get('batch_size', 16),
+                max_prompt_tokens=semantic_config.get('max_prompt_tokens', 512)
+            )
+
+    @staticmethod
+    def make_key(model_path: str, lora_adapter_path: Optional[str] = None, dtype: Optional[str] = None) -> ModelKey:
+        """生成模型键，路径统一使用正斜杠"""
+        model_path = model_path.replace('\\', '/')
+        if lora_adapter_path:
+            lora_adapter_path = lora_adapter_path.replace('\\', '/')
+        return model_path, lora_adapter_path or None, dtype or "bfloat16"
+
+    def acquire(self, key: ModelKey) -> ModelHandle:
+        """
+        获取模型并增加引用计数，未加载时从磁盘加载
+        Args:
+            key: 模型键
+        Returns:
+            模型句柄，使用完毕后需调用release
+        """
+        handle = self._get_loaded(key, acquire=True)
+        if handle:
+            return handle
+
+        with self.load_lock:
+            # 等待加载锁期间可能已被其他请求加载
+            handle = self._get_loaded(key, acquire=True)
+            if handle:
+                return handle
+
+            handle = self._create(key)
+            with self.lock:
+                handle.ref_count += 1
+                self.handles[key] = handle
+                victims = self._evict_locked()
+            self._shutdown(victims)
+            return handle
+
+    def _create(self, key: ModelKey) -> ModelHandle:
+        """从磁盘加载模型并创建推理引擎"""
+        if self.replica_config.get('enabled', False):
+            # 副本池模式：主进程只加载tokenizer，生成由多个绑定CPU核心的副本进程完成
+            service = ReplicaInferenceService(key[0], key[1], dtype=key[2], config=self.service_config)
+            engine = service.pool
+        else:
+            service = InferenceService(key[0], key[1], dtype=key[2], config=self.service_config)
+            engine = InferenceEngine(
+                service,
+                max_batch_size=self.engine_config.get('max_batch_size', 8),
+                max_queue_size=self.engine_config.get('max_queue_size', 100),
+                paged_kv=self.engine_config.get('paged_kv'),
+                prefill_chunk_size=self.engine_config.get('prefill_chunk_size', 0)
+            )
+        if self.response_cache is not None:
+            # 模型重新加载后，权重已变化的旧条目失效
+            self.response_cache.invalidate(service.model_id, keep_version=service.model_version)
+        if self.semantic_cache is not None:
+            self.semantic_cache.invalidate(service.model_id, keep_version=service.model_version)
+        return ModelHandle(key, service, engine)
+
+    def reload(self, key: ModelKey) -> bool:
+        """
+        热更新：LoRA适配器重新训练后在后台重建（merged_lora模式下先重建合并权重缓存）并加载新模型，
+        完成后替换注册表中的旧模型；替换前请求继续使用旧模型，旧模型在其请求结束后卸载
+        Returns:
+            模型是否已加载
+        """
+        with self.lock:
+            if key not in self.handles:
+                return False
+
+        if key[1] and self.merged_config.get('enabled', False) and key[2] != "int8":
+            cache = MergedModelCache.from_config(self.merged_config)
+            # 旧的合并权重与已重新训练的适配器不再对应
+            cache.invalidate(key[0], key[1])
+            cache.rebuild_async(key[0], key[1], key[2], on_ready=lambda _: self._swap(key))
+        else:
+            Thread(target=self._swap, args=(key,), name="model-reload", daemon=True).start()
+        return True
+
+    def _swap(self, key: ModelKey):
+        """加载新模型并替换旧句柄"""
+        try:
+            with self.load_lock:
+                handle = self._create(key)
+        except Exception as e:
+            print(f"重新加载模型失败: {key}, 错误: {e}")
+            return
+        victims = []
+        with self.lock:
+            previous = self.handles.get(key)
+            self.handles[key] = handle
+            if previous is not None:
+                if previous.ref_count > 0:
+                    previous.unload_pending = True
+                else:
+                    victims.append(previous)
+        self._shutdown(victims)
+        print(f"模型已重新加载: {key}")
+
+    def release(self, handle: ModelHandle):
+        """请求结束，减少引用计数；卸载模型耗时较长，异步调用方应放到线程池中执行"""
+        with self.lock:
+            handle.ref_count -= 1
+            handle.last_used = time.time()
+            if handle.unload_pending and handle.ref_count <= 0:
+                victims = [self._detach_locked(handle)]
+            else:
+                victims = self._evict_locked()
+        self._shutdown(victims)
+
+    def load(self, key: ModelKey) -> ModelHandle:
+        """预加载模型（不持有引用）"""
+        handle = self.acquire(key)
+        self.release(handle)
+        return handle
+
+    def unload(self, key: ModelKey) -> bool:
+        """
+        卸载模型
+        Returns:
+            是否存在该模型；仍在使用时延迟到引用归零后卸载
+        """
+        with self.lock:
+            handle = self.handles.get(key)
+            if not handle:
+                return False
+            if key == self.default_key:
+                self.default_key = None
+            if handle.ref_count > 0:
+                handle.unload_pending = True
+                return True
+            self._detach_locked(handle)
+        self._shutdown([handle])
+        return True
+
+    def list_models(self) -> List[Dict[str, Any]]:
+        """列出已加载的模型（按最近使用排序）"""
+        with self.lock:
+            models = []
+            for key, handle in reversed(self.handles.items()):
+                info = handle.to_dict()
+                info['is_default'] = key == self.default_key
+                models.append(info)
+            return models
+
+    def total_bytes(self) -> int:
+        return sum(handle.size_bytes for handle in self.handles.values())
+
+    def _get_loaded(self, key: ModelKey, acquire: bool) -> Optional[ModelHandle]:
+        with self.lock:
+            handle = self.handles.get(key)
+            if handle is None or handle.unload_pending:
+                return None
+            self.handles.move_to_end(key)
+            handle.last_used = time.time()
+            if acquire:
+                handle.ref_count += 1
+            return handle
+
+    def _evict_locked(self) -> List[ModelHandle]:
+        """超出数量或内存预算时，移出最久未使用且无引用的模型，返回待卸载的句柄"""
+        victims = []
+        while self._over_budget_locked():
+            victim = next((handle for handle in self.handles.values() if handle.ref_count <= 0), None)
+            if victim is None:
+                print("模型注册表超出预算，但所有模型都在使用中，暂不淘汰")
+                break
+            print(f"淘汰模型: {victim.key}")
+            victims.append(self._detach_locked(victim))
+        return victims
+
+    def _over_budget_locked(self) -> bool:
+        if len(self.handles) > self.max_models:
+            return True
+        return self.max_memory_bytes is not None and len(self.handles) > 1 and self.total_bytes() > self.max_memory_bytes
+
+    def _detach_locked(self, handle: ModelHandle) -> ModelHandle:
+        # 延迟卸载期间同一个键可能已重新加载，只移除当前句柄
+        if self.handles.get(handle.key) is handle:
+            del self.handles[handle.key]
+        return handle
+
+    def _shutdown(self, victims: List[ModelHandle]):
+        """停止已移出注册表的模型并释放内存（在锁外执行：停止引擎要等待当前调度步结束）"""
+        if not victims:
+            return
+        for handle in victims:
+            handle.engine.shutdown()
+            handle.service = None
+            handle.engine = None
+            print(f"模型已卸载: {handle.key}")
+        if self.semantic_cache is not None:
+            # 未达到save_every的写入在模型卸载时保存
+            self.semantic_cache.flush()
+        gc.collect()
@@ -0,0 +1,271 @@
+from typing import Dict, Any, List, Optional
+from transformers import AutoConfig, DynamicCache, GenerationConfig
+from transformers.generation.utils import GenerateDecoderOnlyOutput
+from transformers.modeling_outputs import CausalLMOutputWithPast
+from service.inference.KVCacheUtil import KVCacheUtil
+from service.inference.Sampler import Sampler
+import onnxruntime as ort
+import numpy as np
+import torch
+import os
+
+# ONNX元素类型到numpy/torch类型的映射
+_ONNX_TYPES = {
+    'tensor(float)': (np.float32, torch.float32),
+    'tensor(float16)': (np.float16, torch.float16),
+    'tensor(int64)': (np.int64, torch.int64),
+    'tensor(int32)': (np.int32, torch.int32)
+}
+
+_OPTIMIZATION_LEVELS = {
+    'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+}
+
+
+class OnnxCausalLM:
+    """
+    ONNX Runtime推理后端 - 以transformers模型的调用方式运行ExportService导出的ONNX模型
+    图中带 past_key_values.{i}.key/value 输入和 present.{i}.key/value 输出时复用KV缓存；
+    只有 input_ids -> logits 的图无法复用KV，缓存中保存已处理的token id，每步对完整序列重新计算
+    """
+
+    def __init__(self, onnx_path: str, model_path: str, session_config: Optional[Dict[str, Any]] = None):
+        """
+        初始化ONNX推理会话
+        Args:
+            onnx_path: ONNX模型文件路径
+            model_path: 原始模型路径（读取模型结构与generation_config）
+            session_config: config.yaml中的inference.onnx会话配置
+        """
+        session_config = session_config or {}
+        if not os.path.exists(onnx_path):
+            raise ValueError(f"ONNX模型不存在: {onnx_path}")
+        self.onnx_path = onnx_path
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = session_config.get('intra_op_num_threads', 0)
+        options.inter_op_num_threads = session_config.get('inter_op_num_threads', 0)
+        options.graph_optimization_level = _OPTIMIZATION_LEVELS[session_config.get('graph_optimization_level', 'all')]
+        if session_config.get('execution_mode', 'sequential') == 'parallel':
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        else:
+            options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if session_config.get('optimized_model_path'):
+            # 保存优化后的图，下次可直接加载
+            options.optimized_model_filepath = session_config['optimized_model_path']
+
+        print(f"创建ONNX Runtime会话: {onnx_path}")
+        self.session = ort.InferenceSession(
+            onnx_path,
+            sess_options=options,
+            providers=session_config.get('providers') or ['CPUExecutionProvider']
+        )
+        self.input_types = {node.name: node.type for node in self.session.get_inputs()}
+        self.output_names = [node.name for node in self.session.get_outputs()]
+
+        self.config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
+        try:
+            self.generation_config = GenerationConfig.from_pretrained(model_path)
+        except OSError:
+            self.generation_config = GenerationConfig.from_model_config(self.config)
+
+        self.num_layers = sum(1 for name in self.input_types if name.startswith('past_key_values.') and name.endswith('.key'))
+        self.use_past = self.num_layers > 0
+        self.num_kv_heads = getattr(self.config, 'num_key_value_heads', None) or self.config.num_attention_heads
+        self.head_dim = getattr(self.config, 'head_dim', None) or self.config.hidden_size // self.config.num_attention_heads
+        logits_type = next(node.type for node in self.session.get_outputs() if node.name == 'logits')
+        self.dtype = _ONNX_TYPES.get(logits_type, (np.float32, torch.float32))[1]
+        if not self.use_past:
+            print("ONNX模型不含KV缓存输入，每步将对完整序列重新计算（可用ExportService的with_past导出）")
+
+    @property
+    def device(self) -> torch.device:
+        return torch.device("cpu")
+
+    def memory_footprint(self) -> int:
+        """ONNX模型文件（含外部权重文件）的字节数"""
+        directory = os.path.dirname(os.path.abspath(self.onnx_path))
+        stem = os.path.basename(self.onnx_path)
+        total = os.path.getsize(self.onnx_path)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name != stem and name.startswith(stem) and os.path.isfile(path):
+                total += os.path.getsize(path)
+        return total
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids: torch.Tensor, attention_mask: Optional[torch.Tensor] = None,
+                 position_ids: Optional[torch.Tensor] = None, past_key_values=None, use_cache: bool = True,
+                 **kwargs) -> CausalLMOutputWithPast:
+        """
+        与transformers模型一致的前向计算：传入的DynamicCache会被原地追加
+        Args:
+            input_ids: [batch, seq_len]
+            attention_mask: [batch, past_len + seq_len]，左侧补齐位置为0
+            position_ids: [batch, seq_len]
+            past_key_values: DynamicCache或旧式元组
+        Returns:
+            logits与更新后的缓存
+        """
+        cache = past_key_values if isinstance(past_key_values, DynamicCache) else KVCacheUtil.to_cache(past_key_values)
+        past_length = cache.get_seq_length()
+        batch_size, seq_length = input_ids.shape
+        if attention_mask is None:
+            attention_mask = torch.ones((batch_size, past_length + seq_length), dtype=torch.long)
+        if position_ids is None:
+            position_ids = (attention_mask.long().cumsum(-1) - 1).clamp_min(0)[:, past_length:]
+
+        if self.use_past:
+            logits = self._forward_with_past(input_ids, attention_mask, position_ids, cache, past_length)
+        else:
+            logits = self._forward_full(input_ids, attention_mask, cache, past_length)
+        return CausalLMOutputWithPast(logits=logits, past_key_values=cache)
+
+    def _forward_with_past(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, position_ids: torch.Tensor,
+                           cache: DynamicCache, past_length: int) -> torch.Tensor:
+        """带KV缓存的图：只计算新增token，present中新增的部分追加到缓存"""
+        feeds = {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'position_ids': position_ids
+        }
+        if past_length:
+            legacy = cache.to_legacy_cache()
+        else:
+            empty = torch.zeros((input_ids.shape[0], self.num_kv_heads, 0, self.head_dim), dtype=self.dtype)
+            legacy = tuple((empty, empty) for _ in range(self.num_layers))
+        for layer_index, (key, value) in enumerate(legacy):
+            feeds[f'past_key_values.{layer_index}.key'] = key
+            feeds[f'past_key_values.{layer_index}.value'] = value
+
+        outputs = self._run(feeds)
+        for layer_index in range(self.num_layers):
+            key = outputs[f'present.{layer_index}.key'][:, :, past_length:]
+            value = outputs[f'present.{layer_index}.value'][:, :, past_length:]
+            cache.update(key, value, layer_index)
+        return outputs['logits']
+
+    def _forward_full(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, cache: DynamicCache,
+                      past_length: int) -> torch.Tensor:
+        """不含KV的图：缓存中保存token id（形状 [batch, 1, seq_len, 1]），逐行去掉补齐后对完整序列计算"""
+        history = cache.to_legacy_cache()[0][0][:, 0, :, 0] if past_length else input_ids[:, :0]
+        full_ids = torch.cat([history.to(input_ids.dtype), input_ids], dim=-1)
+        seq_length = input_ids.shape[1]
+
+        rows = []
+        for row in range(input_ids.shape[0]):
+            ids = full_ids[row][attention_mask[row].bool()].unsqueeze(0)
+            feeds = {'input_ids': ids}
+            if 'attention_mask' in self.input_types:
+                feeds['attention_mask'] = torch.ones_like(ids)
+            rows.append(self._run(feeds)['logits'][:, -seq_length:])
+
+        token_cache = input_ids.view(input_ids.shape[0], 1, seq_length, 1)
+        cache.update(token_cache, token_cache, 0)
+        return torch.cat(rows, dim=0)
+
+    def _run(self, feeds: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """通过IO binding执行一次推理：输入直接绑定torch张量的内存，避免额外拷贝"""
+        binding = self.session.io_binding()
+        # 绑定期间需要保持张量存活
+        inputs = {}
+        for name, tensor in feeds.items():
+            if name not in self.input_types:
+                continue
+            np_type, torch_type = _ONNX_TYPES[self.input_types[name]]
+            tensor = tensor.to(device="cpu", dtype=torch_type).contiguous()
+            inputs[name] = tensor
+            binding.bind_input(name, 'cpu', 0, np_type, tuple(tensor.shape), tensor.data_ptr())
+        for name in self.output_names:
+            binding.bind_output(name, 'cpu')
+
+        self.session.run_with_iobinding(binding)
+        return {name: torch.from_numpy(array) for name, array in zip(self.output_names, binding.copy_outputs_to_cpu())}
+
+    @torch.inference_mode()
+    def generate(self, input_ids: torch.Tensor, attention_mask: Optional[torch.Tensor] = None,
+                 max_new_tokens: int = 512, do_sample: Optional[bool] = None, temperature: Optional[float] = None,
+                 top_p: Optional[float] = None, top_k: Optional[int] = None, streamer=None,
+                 past_key_values=None, pad_token_id: Optional[int] = None, return_dict_in_generate: bool = False,
+                 output_logits: bool = False, stopping_criteria=None, logits_processor=None,
+                 use_cache: bool = True, **kwargs):
+        """
+        自回归生成，参数与返回值与transformers的generate保持一致；logits_processor在采样前作用于logits
+        （约束解码），stopping_criteria在每一步之后调用，返回True的行结束生成（请求预算、客户端断开与停止序列由此生效）
+        Raises:
+            ValueError: 传入了不支持的生成参数（不静默忽略）
+        Returns:
+            return_dict_in_generate为True时返回sequences与past_key_values（output_logits为True时另含每一步的logits），
+            否则返回sequences
+        """
+        unsupported = sorted(name for name, value in kwargs.items() if value is not None)
+        if unsupported:
+            raise ValueError(f"ONNX后端不支持的生成参数: {', '.join(unsupported)}")
+
+        generation_config = self.generation_config
+        sample_config = {
+            'do_sample': generation_config.do_sample if do_sample is None else do_sample,
+            'temperature': generation_config.temperature if temperature is None else temperature,
+            'top_p': generation_config.top_p if top_p is None else top_p,
+            'top_k': generation_config.top_k if top_k is None else top_k
+        }
+        eos_token_ids = generation_config.eos_token_id
+        eos_token_ids = set([eos_token_ids] if isinstance(eos_token_ids, int) else eos_token_ids or [])
+        if pad_token_id is None:
+            pad_token_id = generation_config.pad_token_id if generation_config.pad_token_id is not None \
+                else next(iter(eos_token_ids), 0)
+
+        input_ids = input_ids.cpu()
+        batch_size = input_ids.shape[0]
+        attention_mask = torch.ones_like(input_ids) if attention_mask is None else attention_mask.cpu()
+        cache = past_key_values if isinstance(past_key_values, DynamicCache) else KVCacheUtil.to_cache(past_key_values)
+        past_length = cache.get_seq_length()
+
+        if streamer is not None:
+            streamer.put(input_ids)
+
+        sequences = input_ids
+        next_input = input_ids[:, past_length:]
+        finished = [False] * batch_size
+        step_logits = []
+        for _ in range(max_new_tokens):
+            position_ids = (attention_mask.cumsum(-1) - 1).clamp_min(0)[:, -next_input.shape[1]:]
+            outputs = self(next_input, attention_mask=attention_mask, position_ids=position_ids, past_key_values=cache)
+            logits = outputs.logits[:, -1, :]
+            if output_logits:
+                step_logits.append(logits)
+            if logits_processor is not None:
+                logits = logits_processor(sequences, logits)
+
+            next_tokens: List[int] = []
+            for row in range(batch_size):
+                if finished[row]:
+                    next_tokens.append(pad_token_id)
+                    continue
+                token_id = Sampler.sample(logits[row], sample_config)
+                next_tokens.append(token_id)
+                finished[row] = token_id in eos_token_ids
+
+            next_input = torch.tensor([next_tokens], dtype=input_ids.dtype).view(batch_size, 1)
+            sequences = torch.cat([sequences, next_input], dim=-1)
+            attention_mask = torch.cat([attention_mask, torch.ones_like(next_input)], dim=-1)
+            if streamer is not None:
+                streamer.put(next_input.view(-1))
+            if stopping_criteria is not None:
+                stopped = stopping_criteria(sequences, logits)
+                stopped = [bool(stopped)] * batch_size if isinstance(stopped, bool) else stopped.view(-1).tolist()
+                finished = [done or stop for done, stop in zip(finished, stopped)]
+            if all(finished):
+                break
+
+        if streamer is not None:
+            streamer.end()
+        if return_dict_in_generate:
+            return GenerateDecoderOnlyOutput(sequences=sequences, past_key_values=cache,
+                                             logits=tuple(step_logits) if output_logits else None)
+        return sequences
@@ -0,0 +1,272 @@
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
+from service.inference.KVCacheUtil import LegacyCache
+import math
+import torch
+
+
+class BlockTable:
+    """一条序列的block表：逻辑位置 i 的KV保存在 block_ids[i // block_size] 的第 i % block_size 个槽位"""
+
+    __slots__ = ('block_ids', 'num_tokens')
+
+    def __init__(self, block_ids: List[int], num_tokens: int = 0):
+        self.block_ids = block_ids
+        # 已写入KV的token数
+        self.num_tokens = num_tokens
+
+
+class PagedKVCache:
+    """
+    分页KV缓存 - 所有序列的KV保存在预先分配的固定大小block池中，按block表寻址，
+    空闲block按最近释放顺序排列；提示词中完整的block按 (适配器, 前缀token) 哈希链共享，写入共享block前先复制（copy-on-write），
+    已释放但未被复用的block仍可被后续相同前缀命中。
+    transformers的注意力实现需要连续的KV，每步解码时按block表把各序列的KV聚合为左侧补齐的批次。
+    """
+
+    # 0号block保留为补齐位置使用的全零block，不参与分配
+    NULL_BLOCK = 0
+
+    def __init__(self, num_layers: int, num_kv_heads: int, head_dim: int, num_blocks: int, block_size: int = 16,
+                 dtype: torch.dtype = torch.float32, device: Optional[torch.device] = None):
+        """
+        初始化block池
+        Args:
+            num_layers: 模型层数
+            num_kv_heads: KV头数
+            head_dim: 每个头的维度
+            num_blocks: block总数（含保留的0号block）
+            block_size: 每个block保存的token数
+        """
+        self.num_layers = num_layers
+        self.num_kv_heads = num_kv_heads
+        self.head_dim = head_dim
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self.dtype = dtype
+        # 每层 [num_blocks, block_size, kv_heads, head_dim]，展平前两维后按槽位号读写
+        shape = (num_blocks, block_size, num_kv_heads, head_dim)
+        self.key_pool = [torch.zeros(shape, dtype=dtype, device=device) for _ in range(num_layers)]
+        self.value_pool = [torch.zeros(shape, dtype=dtype, device=device) for _ in range(num_layers)]
+
+        self.ref_counts = [0] * num_blocks
+        self.free: "OrderedDict[int, None]" = OrderedDict((block_id, None) for block_id in range(1, num_blocks))
+        # 前缀哈希 -> block，以及反向映射（block被重新分配时移除）
+        self.cached_blocks: Dict[int, int] = {}
+        self.block_hashes: Dict[int, int] = {}
+
+        # 统计信息
+        self.lookup_tokens = 0
+        self.hit_tokens = 0
+        self.cow_copies = 0
+        self.peak_used_blocks = 0
+
+    @classmethod
+    def for_model(cls, model, block_size: int = 16, max_memory_mb: float = 2048) -> "PagedKVCache":
+        """按模型结构和内存预算创建block池"""
+        config = model.config
+        num_layers = config.num_hidden_layers
+        num_kv_heads = getattr(config, 'num_key_value_heads', None) or config.num_attention_heads
+        head_dim = getattr(config, 'head_dim', None) or config.hidden_size // config.num_attention_heads
+        element_size = torch.empty((), dtype=model.dtype).element_size()
+        block_bytes = 2 * num_layers * block_size * num_kv_heads * head_dim * element_size
+        num_blocks = max(2, int(max_memory_mb * 1024 * 1024 // block_bytes))
+        print(f"分页KV缓存: {num_blocks} 个block，每个 {block_size} token，共 {max_memory_mb} MB")
+        return cls(num_layers, num_kv_heads, head_dim, num_blocks, block_size, dtype=model.dtype, device=model.device)
+
+    @property
+    def num_free_blocks(self) -> int:
+        return len(self.free)
+
+    def blocks_for(self, num_tokens: int) -> int:
+        """容纳num_tokens个token所需的block数"""
+        return math.ceil(num_tokens / self.block_size)
+
+    def allocate(self, namespace: str, token_ids: List[int], reserve: int = 0) -> Optional[Tuple[BlockTable, int]]:
+        """
+        为提示词分配block，前缀中完整的block命中时直接共享
+        Args:
+            namespace: 命名空间（适配器名称），不同适配器的KV不共享
+            token_ids: 需要写入KV的token
+            reserve: 分配后至少保留的空闲block数（留给运行中序列追加token）
+        Returns:
+            (block表, 已有KV的token数)；空闲block不足时返回None
+        """
+        matched: List[int] = []
+        for block_hash in self._block_hashes(namespace, token_ids):
+            block_id = self.cached_blocks.get(block_hash)
+            if block_id is None:
+                break
+            matched.append(block_id)
+
+        # 至少保留最后一个token由调用方计算，以得到下一个token的logits
+        cached_tokens = min(len(matched) * self.block_size, len(token_ids) - 1)
+        total_blocks = self.blocks_for(len(token_ids))
+        # 最后一个命中的block需要重新写入时先复制一份
+        needed = total_blocks - len(matched) + (1 if cached_tokens < len(matched) * self.block_size else 0)
+        revived = sum(1 for block_id in matched if self.ref_counts[block_id] == 0)
+        if len(self.free) - revived < needed + reserve:
+            return None
+
+        for block_id in matched:
+            if self.ref_counts[block_id] == 0:
+                del self.free[block_id]
+            self.ref_counts[block_id] += 1
+        block_ids = matched + [self._pop_free() for _ in range(total_blocks - len(matched))]
+        self.lookup_tokens += len(token_ids)
+        self.hit_tokens += cached_tokens
+        self._track_usage()
+        return BlockTable(block_ids, cached_tokens), cached_tokens
+
+    def commit(self, namespace: str, table: BlockTable, token_ids: List[int]):
+        """登记已写满的block的前缀哈希，供后续相同前缀的请求共享"""
+        for index, block_hash in enumerate(self._block_hashes(namespace, token_ids[:table.num_tokens])):
+            block_id = table.block_ids[index]
+            if block_id in self.block_hashes or block_hash in self.cached_blocks:
+                continue
+            self.cached_blocks[block_hash] = block_id
+            self.block_hashes[block_id] = block_hash
+
+    def append_slot(self, table: BlockTable) -> bool:
+        """
+        确保序列有写入下一个token的空位
+        Returns:
+            需要新的block（最后一个block已满或与其他序列共享）且没有空闲block时返回False
+        """
+        if table.num_tokens < len(table.block_ids) * self.block_size:
+            block_index = table.num_tokens // self.block_size
+            if self.ref_counts[table.block_ids[block_index]] > 1:
+                # 与其他分支共享的未写满block（n-best采样分叉后）在写入前复制一份
+                if not self.free:
+                    return False
+                self._make_writable(table, block_index)
+            return True
+        if not self.free:
+            return False
+        table.block_ids.append(self._pop_free())
+        self._track_usage()
+        return True
+
+    def fork(self, table: BlockTable) -> BlockTable:
+        """复制block表，全部block共享（写入时复制），用于同一提示词的多个采样分支"""
+        for block_id in table.block_ids:
+            self.ref_counts[block_id] += 1
+        return BlockTable(list(table.block_ids), table.num_tokens)
+
+    def free_table(self, table: BlockTable):
+        """释放序列的block，引用归零的block回到空闲列表末尾（保留前缀哈希，直到被重新分配）"""
+        for block_id in table.block_ids:
+            self.ref_counts[block_id] -= 1
+            if self.ref_counts[block_id] == 0:
+                self.free[block_id] = None
+        table.block_ids = []
+        table.num_tokens = 0
+
+    def write(self, table: BlockTable, start: int, kv: LegacyCache):
+        """
+        写入一条序列从start开始的KV
+        Args:
+            kv: 每层 (key, value)，形状 [1, kv_heads, n, head_dim]
+        """
+        length = kv[0][0].shape[-2]
+        for block_index in range(start // self.block_size, self.blocks_for(start + length)):
+            self._make_writable(table, block_index)
+        slots = torch.tensor([self._slot(table, position) for position in range(start, start + length)],
+                             device=self.key_pool[0].device)
+        for layer_index, (key, value) in enumerate(kv):
+            self._flat(self.key_pool[layer_index])[slots] = key[0].transpose(0, 1).to(self.dtype)
+            self._flat(self.value_pool[layer_index])[slots] = value[0].transpose(0, 1).to(self.dtype)
+        table.num_tokens = max(table.num_tokens, start + length)
+
+    def append(self, tables: List[BlockTable], kv: List[Tuple[torch.Tensor, torch.Tensor]]):
+        """
+        批量追加每条序列的下一个token的KV（调用前需append_slot）
+        Args:
+            kv: 每层 (key, value)，形状 [batch, kv_heads, head_dim]
+        """
+        for table in tables:
+            self._make_writable(table, table.num_tokens // self.block_size)
+        slots = torch.tensor([self._slot(table, table.num_tokens) for table in tables], device=self.key_pool[0].device)
+        for layer_index, (key, value) in enumerate(kv):
+            self._flat(self.key_pool[layer_index])[slots] = key.to(self.dtype)
+            self._flat(self.value_pool[layer_index])[slots] = value.to(self.dtype)
+        for table in tables:
+            table.num_tokens += 1
+
+    def gather(self, tables: List[BlockTable]) -> LegacyCache:
+        """
+        按block表聚合各序列的KV，左侧补齐到最长序列后在batch维拼接
+        Returns:
+            每层 (key, value)，形状 [batch, kv_heads, max_len, head_dim]
+        """
+        max_len = max(table.num_tokens for table in tables)
+        slots = []
+        for table in tables:
+            pad = max_len - table.num_tokens
+            slots.append([self.NULL_BLOCK * self.block_size] * pad +
+                         [self._slot(table, position) for position in range(table.num_tokens)])
+        index = torch.tensor(slots, device=self.key_pool[0].device)
+        return tuple(
+            (self._flat(key_pool)[index].permute(0, 2, 1, 3), self._flat(value_pool)[index].permute(0, 2, 1, 3))
+            for key_pool, value_pool in zip(self.key_pool, self.value_pool)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """block使用统计"""
+        usable = self.num_blocks - 1
+        used = usable - len(self.free)
+        return {
+            'num_blocks': usable,
+            'block_size': self.block_size,
+            'free_blocks': len(self.free),
+            'used_blocks': used,
+            'peak_used_blocks': self.peak_used_blocks,
+            'utilization': used / usable if usable else 0.0,
+            'shared_blocks': sum(1 for count in self.ref_counts if count > 1),
+            'cached_prefix_blocks': len(self.cached_blocks),
+            'prefix_hit_rate': self.hit_tokens / self.lookup_tokens if self.lookup_tokens else 0.0,
+            'cow_copies': self.cow_copies
+        }
+
+    def _block_hashes(self, namespace: str, token_ids: List[int]) -> List[int]:
+        """完整block的前缀哈希链：每个block的哈希包含之前所有token"""
+        hashes = []
+        parent = hash(namespace)
+        for start in range(0, len(token_ids) - self.block_size + 1, self.block_size):
+            parent = hash((parent, tuple(token_ids[start:start + self.block_size])))
+            hashes.append(parent)
+        return hashes
+
+    def _pop_free(self) -> int:
+        """取出最久之前释放的空闲block，清除其旧的前缀哈希"""
+        block_id, _ = self.free.popitem(last=False)
+        block_hash = self.block_hashes.pop(block_id, None)
+        if block_hash is not None and self.cached_blocks.get(block_hash) == block_id:
+            del self.cached_blocks[block_hash]
+        self.ref_counts[block_id] = 1
+        return block_id
+
+    def _make_writable(self, table: BlockTable, block_index: int):
+        """写入共享的block前复制一份（copy-on-write）"""
+        block_id = table.block_ids[block_index]
+        if self.ref_counts[block_id] <= 1:
+            return
+        if not self.free:
+            raise RuntimeError("KV缓存block不足，无法复制共享block")
+        new_block_id = self._pop_free()
+        for key_pool, value_pool in zip(self.key_pool, self.value_pool):
+            key_pool[new_block_id].copy_(key_pool[block_id])
+            value_pool[new_block_id].copy_(value_pool[block_id])
+        self.ref_counts[block_id] -= 1
+        table.block_ids[block_index] = new_block_id
+        self.cow_copies += 1
+        self._track_usage()
+
+    def _slot(self, table: BlockTable, position: int) -> int:
+        return table.block_ids[position // self.block_size] * self.block_size + position % self.block_size
+
+    def _flat(self, pool: torch.Tensor) -> torch.Tensor:
+        return pool.view(-1, self.num_kv_heads, self.head_dim)
+
+    def _track_usage(self):
+        self.peak_used_blocks = max(self.peak_used_blocks, self.num_blocks - 1 - len(self.free))
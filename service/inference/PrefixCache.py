@@ -0,0 +1,190 @@
+from typing import Dict, Any, List, Optional, Tuple
+from threading import Lock
+from service.inference.KVCacheUtil import KVCacheUtil, LegacyCache
+import time
+
+
+class RadixNode:
+    """基数树节点，边上保存一段token id及其对应的KV缓存"""
+
+    __slots__ = ('key', 'kv', 'children', 'parent', 'last_access', 'nbytes')
+
+    def __init__(self, key: Tuple[int, ...] = (), kv: Optional[LegacyCache] = None, parent: Optional["RadixNode"] = None):
+        self.key = key
+        self.kv = kv
+        self.children: Dict[int, RadixNode] = {}
+        self.parent = parent
+        self.last_access = time.time()
+        self.nbytes = KVCacheUtil.nbytes(kv)
+
+
+class PrefixCache:
+    """前缀KV缓存 - 以token id基数树保存公共前缀（系统提示词、对话模板）的KV，命中时只需prefill新增后缀"""
+
+    def __init__(self, max_memory_mb: float = 1024, min_prefix_tokens: int = 16):
+        """
+        初始化前缀缓存
+        Args:
+            max_memory_mb: KV缓存的内存预算（MB），超出后淘汰最久未使用的叶子节点
+            min_prefix_tokens: 命中长度低于该值时不复用
+        """
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+        self.min_prefix_tokens = min_prefix_tokens
+        # 不同LoRA适配器的KV不同，按命名空间分别建树
+        self.roots: Dict[str, RadixNode] = {}
+        self.total_bytes = 0
+        self.lock = Lock()
+
+        # 统计信息
+        self.lookups = 0
+        self.hits = 0
+        self.lookup_tokens = 0
+        self.saved_tokens = 0
+        self.inserted_tokens = 0
+        self.evicted_tokens = 0
+
+    def match(self, namespace: str, token_ids: List[int]) -> Tuple[int, Optional[LegacyCache]]:
+        """
+        查找最长公共前缀
+        Args:
+            namespace: 命名空间（适配器名称）
+            token_ids: 提示词token id
+        Returns:
+            (命中的token数, 对应的KV缓存)；至少保留最后一个token由调用方prefill
+        """
+        limit = len(token_ids) - 1
+        with self.lock:
+            self.lookups += 1
+            self.lookup_tokens += len(token_ids)
+
+            node = self.roots.get(namespace)
+            matched = 0
+            segments: List[LegacyCache] = []
+            now = time.time()
+            while node is not None and matched < limit:
+                child = node.children.get(token_ids[matched])
+                if child is None:
+                    break
+                length = self._common_length(child.key, token_ids, matched, limit)
+                child.last_access = now
+                if length == len(child.key):
+                    segments.append(child.kv)
+                else:
+                    segments.append(KVCacheUtil.select(child.kv, 0, 0, length))
+                matched += length
+                if length < len(child.key):
+                    break
+                node = child
+
+            if matched < max(self.min_prefix_tokens, 1):
+                return 0, None
+
+            self.hits += 1
+            self.saved_tokens += matched
+            return matched, segments[0] if len(segments) == 1 else KVCacheUtil.concat(segments)
+
+    def insert(self, namespace: str, token_ids: List[int], kv: LegacyCache):
+        """
+        写入前缀及其KV缓存（kv需覆盖全部token_ids）
+        Args:
+            namespace: 命名空间（适配器名称）
+            token_ids: token id
+            kv: batch=1的KV缓存
+        """
+        if len(token_ids) < self.min_prefix_tokens:
+            return
+
+        with self.lock:
+            node = self.roots.setdefault(namespace, RadixNode())
+            position = 0
+            now = time.time()
+            while position < len(token_ids):
+                child = node.children.get(token_ids[position])
+                if child is None:
+                    # 新的分支，只复制尚未缓存的部分，避免持有整批张量的视图
+                    segment = tuple((k[:, :, position:].clone(), v[:, :, position:].clone()) for k, v in kv)
+                    leaf = RadixNode(tuple(token_ids[position:]), segment, node)
+                    node.children[token_ids[position]] = leaf
+                    self.total_bytes += leaf.nbytes
+                    self.inserted_tokens += len(leaf.key)
+                    break
+
+                length = self._common_length(child.key, token_ids, position, len(token_ids))
+                if length < len(child.key):
+                    child = self._split(child, length)
+                child.last_access = now
+                position += length
+                node = child
+
+            self._evict_locked()
+
+    def clear(self, namespace: Optional[str] = None):
+        """清空缓存（指定命名空间时只清空该命名空间）"""
+        with self.lock:
+            if namespace is None:
+                self.roots.clear()
+                self.total_bytes = 0
+            elif namespace in self.roots:
+                self.total_bytes -= self._subtree_bytes(self.roots.pop(namespace))
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计，用于评估缓存容量"""
+        return {
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'misses': self.lookups - self.hits,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'saved_tokens': self.saved_tokens,
+            'saved_token_ratio': self.saved_tokens / self.lookup_tokens if self.lookup_tokens else 0.0,
+            'inserted_tokens': self.inserted_tokens,
+            'evicted_tokens': self.evicted_tokens,
+            'memory_mb': round(self.total_bytes / 1024 / 1024, 2),
+            'max_memory_mb': round(self.max_bytes / 1024 / 1024, 2)
+        }
+
+    @staticmethod
+    def _common_length(key: Tuple[int, ...], token_ids: List[int], start: int, limit: int) -> int:
+        length = 0
+        max_length = min(len(key), limit - start)
+        while length < max_length and key[length] == token_ids[start + length]:
+            length += 1
+        return length
+
+    def _split(self, node: RadixNode, length: int) -> RadixNode:
+        """在边的第length个token处拆分，返回新的上半段节点"""
+        parent = node.parent
+        upper = RadixNode(node.key[:length], KVCacheUtil.select(node.kv, 0, 0, length), parent)
+        upper.kv = tuple((k.clone(), v.clone()) for k, v in upper.kv)
+        upper.nbytes = KVCacheUtil.nbytes(upper.kv)
+        upper.last_access = node.last_access
+        parent.children[node.key[0]] = upper
+
+        self.total_bytes -= node.nbytes
+        node.key = node.key[length:]
+        node.kv = tuple((k[:, :, length:].clone(), v[:, :, length:].clone()) for k, v in node.kv)
+        node.nbytes = KVCacheUtil.nbytes(node.kv)
+        node.parent = upper
+        upper.children[node.key[0]] = node
+        self.total_bytes += upper.nbytes + node.nbytes
+        return upper
+
+    def _evict_locked(self):
+        """超出预算时淘汰最久未访问的叶子节点"""
+        while self.total_bytes > self.max_bytes:
+            leaves = [leaf for root in self.roots.values() for leaf in self._leaves(root)]
+            if not leaves:
+                return
+            victim = min(leaves, key=lambda leaf: leaf.last_access)
+            del victim.parent.children[victim.key[0]]
+            self.total_bytes -= victim.nbytes
+            self.evicted_tokens += len(victim.key)
+
+    def _leaves(self, node: RadixNode):
+        for child in node.children.values():
+            if child.children:
+                yield from self._leaves(child)
+            else:
+                yield child
+
+    def _subtree_bytes(self, node: RadixNode) -> int:
+        return node.nbytes + sum(self._subtree_bytes(child) for child in node.children.values())
@@ -0,0 +1,81 @@
+from typing import Optional
+from transformers import AutoConfig, AutoModelForCausalLM
+from peft import PeftModel
+from service.inference.WeightsFingerprint import WeightsFingerprint
+import transformers
+import hashlib
+import torch
+import os
+
+
+class QuantizedModelLoader:
+    """
+    int8动态量化模型加载 - 先合并LoRA再对Linear层做动态量化，量化后的state_dict缓存到磁盘加速重启；
+    缓存只保存权重，加载时由模型配置重建结构并做同样的量化后载入，不反序列化任意对象
+    """
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def cache_key(model_path: str, lora_adapter_path: Optional[str] = None) -> str:
+        """由权重指纹和torch、transformers版本生成缓存键（量化结果与两者的版本有关）"""
+        digest = hashlib.sha256()
+        digest.update(torch.__version__.encode('utf-8'))
+        digest.update(transformers.__version__.encode('utf-8'))
+        digest.update(WeightsFingerprint.of(model_path, lora_adapter_path).encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    @staticmethod
+    def load(model_path: str, lora_adapter_path: Optional[str] = None, cache_dir: Optional[str] = None):
+        """
+        加载int8动态量化模型（仅CPU）
+        Args:
+            model_path: 基础模型路径
+            lora_adapter_path: LoRA适配器路径（量化前合并进权重）
+            cache_dir: 量化模型缓存目录，为空时不缓存
+        Returns:
+            量化后的模型
+        """
+        cache_path = None
+        if cache_dir:
+            cache_path = os.path.join(cache_dir, f"int8-{QuantizedModelLoader.cache_key(model_path, lora_adapter_path)}.pt")
+            if os.path.exists(cache_path):
+                print(f"加载int8量化缓存: {cache_path}")
+                # 由配置构建同结构的模型并量化（LoRA合并不改变结构），再载入缓存的量化权重
+                model = AutoModelForCausalLM.from_config(AutoConfig.from_pretrained(model_path), dtype=torch.float32)
+                model.eval()
+                model = QuantizedModelLoader._quantize(model)
+                model.load_state_dict(torch.load(cache_path, map_location="cpu", weights_only=True))
+                return model
+
+        print("加载float32权重用于int8量化")
+        model = AutoModelForCausalLM.from_pretrained(
+            model_path,
+            device_map="cpu",
+            dtype=torch.float32,
+            use_cache=True
+        )
+
+        # 动态量化只作用于nn.Linear，LoRA需要先合并进基础权重
+        if lora_adapter_path:
+            print(f"合并LoRA适配器: {lora_adapter_path}")
+            model = PeftModel.from_pretrained(model, lora_adapter_path).merge_and_unload()
+
+        model.eval()
+        print("正在进行int8动态量化...")
+        model = QuantizedModelLoader._quantize(model)
+
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            temp_path = cache_path + ".tmp"
+            torch.save(model.state_dict(), temp_path)
+            os.replace(temp_path, cache_path)
+            print(f"int8量化模型已缓存: {cache_path}")
+
+        return model
+
+    @staticmethod
+    def _quantize(model):
+        """对全部nn.Linear做int8动态量化"""
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
@@ -0,0 +1,432 @@
+from typing import Dict, List, Optional, Tuple
+import hashlib
+
+# 正则语法树节点: ('chars', 码点区间列表) / ('cat', [节点]) / ('alt', [节点]) / ('repeat', 节点, 最少次数, 最多次数或None)
+Node = Tuple
+
+MAX_CODE_POINT = 0x10FFFF
+_DIGIT = [(0x30, 0x39)]
+_WORD = [(0x30, 0x39), (0x41, 0x5A), (0x5F, 0x5F), (0x61, 0x7A)]
+_SPACE = [(0x09, 0x0D), (0x20, 0x20)]
+_ESCAPED_CONTROL = {'n': 0x0A, 't': 0x09, 'r': 0x0D, 'f': 0x0C, 'v': 0x0B, '0': 0x00}
+
+
+def _normalize(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """排序并合并相邻或重叠的码点区间"""
+    merged: List[Tuple[int, int]] = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def _complement(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    result = []
+    start = 0
+    for lo, hi in _normalize(ranges):
+        if lo > start:
+            result.append((start, lo - 1))
+        start = hi + 1
+    if start <= MAX_CODE_POINT:
+        result.append((start, MAX_CODE_POINT))
+    return result
+
+
+def _utf8_sequences(lo: int, hi: int) -> List[List[Tuple[int, int]]]:
+    """
+    将码点区间拆分为若干UTF-8字节区间序列，每个序列的各字节位置取值相互独立（跳过代理区）
+    例如 [0x80, 0x7FF] -> [[0xC2, 0xDF], [0x80, 0xBF]]
+    """
+    sequences = []
+    stack = [(lo, hi)]
+    while stack:
+        lo, hi = stack.pop()
+        if lo > hi:
+            continue
+        if lo <= 0xDFFF and hi >= 0xD800:
+            stack.append((lo, 0xD7FF))
+            stack.append((0xE000, hi))
+            continue
+        # 按编码长度的边界拆分
+        split = next((boundary for boundary in (0x7F, 0x7FF, 0xFFFF) if lo <= boundary < hi), None)
+        if split is not None:
+            stack.append((lo, split))
+            stack.append((split + 1, hi))
+            continue
+        if hi <= 0x7F:
+            sequences.append([(lo, hi)])
+            continue
+        # 拆分到每个后续字节都覆盖完整区间或只有一个取值
+        length = len(chr(lo).encode('utf-8'))
+        for index in range(1, length):
+            mask = (1 << (6 * index)) - 1
+            if lo & ~mask != hi & ~mask:
+                if lo & mask:
+                    stack.append((lo, lo | mask))
+                    stack.append(((lo | mask) + 1, hi))
+                    break
+                if hi & mask != mask:
+                    stack.append((lo, (hi & ~mask) - 1))
+                    stack.append((hi & ~mask, hi))
+                    break
+        else:
+            sequences.append(list(zip(chr(lo).encode('utf-8'), chr(hi).encode('utf-8'))))
+    return sequences
+
+
+class _RegexParser:
+    """正则解析 - 支持字面量、转义、字符类、. 、分组、| 以及 * + ? {m} {m,} {m,n} 量词；整体按全匹配处理"""
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.position = 0
+
+    def parse(self) -> Node:
+        node = self._alternation()
+        if self.position != len(self.pattern):
+            raise ValueError(f"正则解析失败: 位置 {self.position} 处的 '{self.pattern[self.position]}' 无法匹配")
+        return node
+
+    def _peek(self) -> Optional[str]:
+        return self.pattern[self.position] if self.position < len(self.pattern) else None
+
+    def _next(self) -> str:
+        if self.position >= len(self.pattern):
+            raise ValueError("正则解析失败: 意外的结尾")
+        char = self.pattern[self.position]
+        self.position += 1
+        return char
+
+    def _alternation(self) -> Node:
+        branches = [self._concatenation()]
+        while self._peek() == '|':
+            self.position += 1
+            branches.append(self._concatenation())
+        return branches[0] if len(branches) == 1 else ('alt', branches)
+
+    def _concatenation(self) -> Node:
+        items = []
+        while self._peek() is not None and self._peek() not in '|)':
+            items.append(self._repetition())
+        return ('cat', items)
+
+    def _repetition(self) -> Node:
+        node = self._atom()
+        while True:
+            char = self._peek()
+            if char == '*':
+                minimum, maximum = 0, None
+            elif char == '+':
+                minimum, maximum = 1, None
+            elif char == '?':
+                minimum, maximum = 0, 1
+            elif char == '{' and self._is_counted():
+                minimum, maximum = self._counted()
+            else:
+                return node
+            if char != '{':
+                self.position += 1
+            # 非贪婪标记不影响可匹配的语言
+            if self._peek() == '?':
+                self.position += 1
+            node = ('repeat', node, minimum, maximum)
+
+    def _is_counted(self) -> bool:
+        end = self.pattern.find('}', self.position)
+        body = self.pattern[self.position + 1:end] if end > 0 else ''
+        return bool(body) and all(part.isdigit() or part == '' for part in body.split(',', 1)) and body[0].isdigit()
+
+    def _counted(self) -> Tuple[int, Optional[int]]:
+        end = self.pattern.index('}', self.position)
+        body = self.pattern[self.position + 1:end]
+        self.position = end + 1
+        if ',' not in body:
+            return int(body), int(body)
+        minimum, maximum = body.split(',', 1)
+        if maximum and int(maximum) < int(minimum):
+            raise ValueError(f"正则量词范围无效: {{{body}}}")
+        return int(minimum), int(maximum) if maximum else None
+
+    def _atom(self) -> Node:
+        char = self._next()
+        if char == '(':
+            if self.pattern.startswith('?:', self.position):
+                self.position += 2
+            elif self._peek() == '?':
+                raise ValueError("正则解析失败: 不支持环视、命名分组等扩展语法")
+            node = self._alternation()
+            if self._next() != ')':
+                raise ValueError("正则解析失败: 缺少 ')'")
+            return node
+        if char == '[':
+            return ('chars', self._char_class())
+        if char == '.':
+            return ('chars', _complement([(0x0A, 0x0A)]))
+        if char == '\\':
+            return ('chars', self._escape())
+        if char in '^$':
+            # 约束解码总是全匹配，锚点不改变语言
+            return ('cat', [])
+        if char in '*+?{':
+            raise ValueError(f"正则解析失败: 位置 {self.position - 1} 处的量词 '{char}' 前没有内容")
+        if char == ')':
+            raise ValueError("正则解析失败: 多余的 ')'")
+        return ('chars', [(ord(char), ord(char))])
+
+    def _escape(self) -> List[Tuple[int, int]]:
+        char = self._next()
+        classes = {'d': _DIGIT, 'w': _WORD, 's': _SPACE}
+        if char in classes:
+            return list(classes[char])
+        if char.lower() in classes:
+            return _complement(classes[char.lower()])
+        if char in _ESCAPED_CONTROL:
+            code = _ESCAPED_CONTROL[char]
+            return [(code, code)]
+        if char in 'xu':
+            digits = 2 if char == 'x' else 4
+            code = int(self.pattern[self.position:self.position + digits], 16)
+            self.position += digits
+            return [(code, code)]
+        return [(ord(char), ord(char))]
+
+    def _char_class(self) -> List[Tuple[int, int]]:
+        negate = self._peek() == '^'
+        if negate:
+            self.position += 1
+        ranges: List[Tuple[int, int]] = []
+        first = True
+        while True:
+            char = self._next()
+            if char == ']' and not first:
+                break
+            first = False
+            if char == '\\':
+                items = self._escape()
+            else:
+                items = [(ord(char), ord(char))]
+            # 区间 a-z（转义得到的字符类不能作为区间端点）
+            if len(items) == 1 and items[0][0] == items[0][1] and self._peek() == '-' \
+                    and self.position + 1 < len(self.pattern) and self.pattern[self.position + 1] != ']':
+                self.position += 1
+                end = self._next()
+                end_code = self._escape()[0][0] if end == '\\' else ord(end)
+                if end_code < items[0][0]:
+                    raise ValueError("正则字符类区间无效")
+                items = [(items[0][0], end_code)]
+            ranges.extend(items)
+        ranges = _normalize(ranges)
+        return _complement(ranges) if negate else ranges
+
+
+class RegexFSM:
+    """
+    正则表达式的字节级确定有限自动机 - 码点区间按UTF-8拆分为字节区间后构造NFA，子集构造得到DFA，
+    去掉无法到达接受状态的状态并最小化；按字节转移，BPE中只含半个汉字的token也能正确判断
+    """
+
+    DEAD = -1
+
+    def __init__(self, transitions: List[List[int]], accepting: List[bool]):
+        """
+        Args:
+            transitions: 每个状态对256个字节的转移，DEAD表示不允许；状态0为初始状态
+            accepting: 每个状态是否为接受状态
+        """
+        self.transitions = transitions
+        self.accepting = accepting
+
+    @property
+    def num_states(self) -> int:
+        return len(self.transitions)
+
+    @staticmethod
+    def fingerprint(pattern: str) -> str:
+        return hashlib.sha256(pattern.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def from_regex(cls, pattern: str, max_states: int = 4096) -> "RegexFSM":
+        """
+        编译正则表达式
+        Args:
+            pattern: 正则表达式（全匹配）
+            max_states: DFA状态数上限，超出时抛出ValueError
+        """
+        nfa = _NFA(max_states * 64)
+        start, end = nfa.build(_RegexParser(pattern).parse())
+        transitions, accepting = nfa.to_dfa(start, end, max_states)
+        transitions, accepting = cls._trim(transitions, accepting)
+        transitions, accepting = cls._minimize(transitions, accepting)
+        return cls(transitions, accepting)
+
+    def walk(self, state: int, data: bytes) -> int:
+        """从state出发读入一段字节，返回到达的状态（DEAD表示不匹配）"""
+        for byte in data:
+            if state == self.DEAD:
+                break
+            state = self.transitions[state][byte]
+        return state
+
+    def matches(self, text: str) -> bool:
+        state = self.walk(0, text.encode('utf-8'))
+        return state != self.DEAD and self.accepting[state]
+
+    @classmethod
+    def _trim(cls, transitions: List[List[int]], accepting: List[bool]) -> Tuple[List[List[int]], List[bool]]:
+        """删除无法到达接受状态的状态，使每个存活状态都还能完成匹配"""
+        reverse: Dict[int, set] = {}
+        for state, row in enumerate(transitions):
+            for target in set(row):
+                if target != cls.DEAD:
+                    reverse.setdefault(target, set()).add(state)
+        alive = {state for state, value in enumerate(accepting) if value}
+        stack = list(alive)
+        while stack:
+            for source in reverse.get(stack.pop(), ()):
+                if source not in alive:
+                    alive.add(source)
+                    stack.append(source)
+        if 0 not in alive:
+            raise ValueError("正则表达式不匹配任何字符串")
+        order = [state for state in range(len(transitions)) if state in alive]
+        renumber = {state: index for index, state in enumerate(order)}
+        return ([[renumber.get(target, cls.DEAD) for target in transitions[state]] for state in order],
+                [accepting[state] for state in order])
+
+    @classmethod
+    def _minimize(cls, transitions: List[List[int]], accepting: List[bool]) -> Tuple[List[List[int]], List[bool]]:
+        """分区细化最小化，减少需要预计算token掩码的状态数"""
+        classes = [1 if value else 0 for value in accepting]
+        while True:
+            signatures: Dict[Tuple, int] = {}
+            refined = []
+            for state, row in enumerate(transitions):
+                signature = (classes[state], tuple(cls.DEAD if target == cls.DEAD else classes[target] for target in row))
+                refined.append(signatures.setdefault(signature, len(signatures)))
+            if len(signatures) == len(set(classes)):
+                break
+            classes = refined
+        # 初始状态编号为0，其余按首次出现的顺序编号
+        order: Dict[int, int] = {}
+        for state in [0] + list(range(len(transitions))):
+            order.setdefault(classes[state], len(order))
+        result = [None] * len(order)
+        result_accepting = [False] * len(order)
+        for state, row in enumerate(transitions):
+            index = order[classes[state]]
+            if result[index] is None:
+                result[index] = [cls.DEAD if target == cls.DEAD else order[classes[target]] for target in row]
+                result_accepting[index] = accepting[state]
+        return result, result_accepting
+
+
+class _NFA:
+    """按字节区间转移的Thompson NFA"""
+
+    def __init__(self, max_states: int):
+        self.max_states = max_states
+        # 每个状态的 (起始字节, 结束字节, 目标状态) 与空转移
+        self.edges: List[List[Tuple[int, int, int]]] = []
+        self.epsilon: List[List[int]] = []
+
+    def _state(self) -> int:
+        if len(self.edges) >= self.max_states:
+            raise ValueError("正则表达式过于复杂（NFA状态数超出上限）")
+        self.edges.append([])
+        self.epsilon.append([])
+        return len(self.edges) - 1
+
+    def build(self, node: Node) -> Tuple[int, int]:
+        """为语法树节点构造片段，返回 (起始状态, 结束状态)；重复的节点每次重新构造"""
+        kind = node[0]
+        start = self._state()
+        if kind == 'chars':
+            end = self._state()
+            for lo, hi in node[1]:
+                for sequence in _utf8_sequences(lo, hi):
+                    current = start
+                    for index, (byte_lo, byte_hi) in enumerate(sequence):
+                        target = end if index == len(sequence) - 1 else self._state()
+                        self.edges[current].append((byte_lo, byte_hi, target))
+                        current = target
+            return start, end
+        if kind == 'cat':
+            current = start
+            for item in node[1]:
+                item_start, item_end = self.build(item)
+                self.epsilon[current].append(item_start)
+                current = item_end
+            return start, current
+        if kind == 'alt':
+            end = self._state()
+            for branch in node[1]:
+                branch_start, branch_end = self.build(branch)
+                self.epsilon[start].append(branch_start)
+                self.epsilon[branch_end].append(end)
+            return start, end
+        # repeat: 必需的副本依次连接，之后是可选副本（有上限）或循环（无上限）
+        _, item, minimum, maximum = node
+        current = start
+        for _ in range(minimum):
+            item_start, item_end = self.build(item)
+            self.epsilon[current].append(item_start)
+            current = item_end
+        end = self._state()
+        self.epsilon[current].append(end)
+        if maximum is None:
+            item_start, item_end = self.build(item)
+            self.epsilon[current].append(item_start)
+            self.epsilon[item_end].append(current)
+        else:
+            for _ in range(maximum - minimum):
+                item_start, item_end = self.build(item)
+                self.epsilon[current].append(item_start)
+                self.epsilon[item_end].append(end)
+                current = item_end
+        return start, end
+
+    def _closure(self, states) -> frozenset:
+        closure = set(states)
+        stack = list(states)
+        while stack:
+            for target in self.epsilon[stack.pop()]:
+                if target not in closure:
+                    closure.add(target)
+                    stack.append(target)
+        return frozenset(closure)
+
+    def to_dfa(self, start: int, end: int, max_states: int) -> Tuple[List[List[int]], List[bool]]:
+        """子集构造"""
+        initial = self._closure([start])
+        index = {initial: 0}
+        queue = [initial]
+        transitions: List[List[int]] = []
+        accepting: List[bool] = []
+        while len(transitions) < len(queue):
+            current = queue[len(transitions)]
+            targets: List[set] = [set() for _ in range(256)]
+            for state in current:
+                for lo, hi, target in self.edges[state]:
+                    for byte in range(lo, hi + 1):
+                        targets[byte].add(target)
+            row = []
+            closures: Dict[frozenset, frozenset] = {}
+            for byte_targets in targets:
+                if not byte_targets:
+                    row.append(RegexFSM.DEAD)
+                    continue
+                key = frozenset(byte_targets)
+                closure = closures.get(key)
+                if closure is None:
+                    closure = closures[key] = self._closure(key)
+                if closure not in index:
+                    if len(queue) >= max_states:
+                        raise ValueError(f"正则表达式过于复杂（DFA状态数超过 {max_states}）")
+                    index[closure] = len(queue)
+                    queue.append(closure)
+                row.append(index[closure])
+            transitions.append(row)
+            accepting.append(end in current)
+        return transitions, accepting
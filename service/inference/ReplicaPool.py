@@ -0,0 +1,502 @@
+from typing import List, Dict, Any, Optional, AsyncGenerator, Callable, Iterator, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from threading import Thread, Lock, Event
+from collections import OrderedDict
+from service.inference.InferenceService import InferenceService
+from service.inference.InferenceEngine import InferenceEngine
+from service.inference.AdapterManager import AdapterManager
+from service.inference.AsyncTokenStreamer import AsyncTokenStreamer
+from service.inference.IncrementalDetokenizer import IncrementalDetokenizer
+from service.inference.WeightsFingerprint import WeightsFingerprint
+from service.inference.MergedModelCache import MergedModelCache
+from service.inference.ConstraintCompiler import ConstraintCompiler
+from service.inference.InferenceWorkerPool import QueueFullError
+import multiprocessing
+import functools
+import itertools
+import asyncio
+import queue
+import torch
+import math
+import time
+import os
+
+
+def plan_core_sets(num_workers: int, threads_per_worker: Optional[int] = None) -> List[List[int]]:
+    """
+    将当前进程可用的CPU核心按连续区间划分给各个副本
+    Args:
+        num_workers: 副本进程数
+        threads_per_worker: 每个副本的线程数，为空时平均分配可用核心
+    Returns:
+        每个副本绑定的核心列表（核心不足时循环复用）
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        available = sorted(os.sched_getaffinity(0))
+    else:
+        available = list(range(os.cpu_count() or 1))
+    threads = threads_per_worker or max(1, len(available) // num_workers)
+    return [[available[(index * threads + offset) % len(available)] for offset in range(threads)]
+            for index in range(num_workers)]
+
+
+class _PipeStreamer:
+    """副本进程内的token流 - 推理引擎投递的token id经结果队列发回主进程"""
+
+    def __init__(self, request_id: int, responses):
+        self.request_id = request_id
+        self.responses = responses
+        self.error: Optional[BaseException] = None
+
+    def put(self, value):
+        for token_id in value.reshape(-1).tolist():
+            self.responses.put((self.request_id, 'token', token_id))
+
+    def end(self):
+        self.responses.put((self.request_id, 'end', str(self.error) if self.error is not None else None))
+
+
+def _replica_main(index: int, cores: Optional[List[int]], num_threads: int, model_key: Tuple[str, Optional[str], str],
+                  service_config: Dict[str, Any], requests, responses):
+    """
+    副本进程入口：绑定CPU核心、设置线程数、加载模型副本，然后处理主进程分发的请求
+    请求格式: (request_id, 'submit', (messages, config, stream)) / (request_id, 'call', (method, args, cancellable))
+            / (request_id, 'cancel', None) / None
+    """
+    try:
+        if cores and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(num_threads)
+        # 副本之间已经按进程并行，算子间并行只会与其他副本争抢核心
+        torch.set_num_interop_threads(1)
+
+        service = InferenceService(model_key[0], model_key[1], dtype=model_key[2], config=service_config)
+        engine_config = service_config.get('engine', {}) or {}
+        engine = InferenceEngine(
+            service,
+            max_batch_size=engine_config.get('max_batch_size', 8),
+            max_queue_size=engine_config.get('max_queue_size', 100),
+            paged_kv=engine_config.get('paged_kv'),
+            prefill_chunk_size=engine_config.get('prefill_chunk_size', 0)
+        )
+    except Exception as e:
+        responses.put((None, 'failed', (index, str(e))))
+        return
+
+    responses.put((None, 'ready', (index, os.getpid())))
+    # 批量推理、投机解码等阻塞调用在单独的线程中执行，调度线程继续处理连续批处理请求
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"replica-{index}-call")
+    # request_id -> (future, 取消事件)，主进程的请求被取消时据此结束生成
+    inflight: Dict[int, Tuple[Future, Optional[Event]]] = {}
+
+    def reply(request_id: int, future: Future):
+        inflight.pop(request_id, None)
+        if future.cancelled():
+            responses.put((request_id, 'cancelled', None))
+            return
+        error = future.exception()
+        if error is None:
+            responses.put((request_id, 'result', future.result()))
+        else:
+            retry_after = getattr(error, 'retry_after', None) if isinstance(error, QueueFullError) else None
+            responses.put((request_id, 'error', (str(error), retry_after)))
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        request_id, kind, payload = message
+        if kind == 'cancel':
+            entry = inflight.get(request_id)
+            if entry is not None:
+                future, cancel_event = entry
+                if cancel_event is not None:
+                    cancel_event.set()
+                # 推理引擎中的序列在下一个token边界结束；已开始执行的调用由取消事件结束
+                future.cancel()
+            continue
+        cancel_event = None
+        try:
+            if kind == 'submit':
+                messages, config, stream = payload
+                streamer = _PipeStreamer(request_id, responses) if stream else None
+                future = engine.submit(messages, config, streamer)
+            else:
+                method, args, cancellable = payload
+                if cancellable:
+                    cancel_event = Event()
+                    future = executor.submit(getattr(service, method), *args, cancel_event=cancel_event)
+                else:
+                    future = executor.submit(getattr(service, method), *args)
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+        inflight[request_id] = (future, cancel_event)
+        future.add_done_callback(functools.partial(reply, request_id))
+
+    engine.shutdown()
+    executor.shutdown(wait=False)
+
+
+class _Replica:
+    """主进程中记录的副本状态"""
+
+    def __init__(self, index: int, cores: Optional[List[int]], process, requests):
+        self.index = index
+        self.cores = cores
+        self.process = process
+        self.requests = requests
+        self.pid: Optional[int] = None
+        # 已分发且尚未返回结果的请求数
+        self.inflight = 0
+        self.completed = 0
+
+
+class ReplicaPool:
+    """
+    多进程推理副本池 - 每个副本进程持有一份模型、独立的torch线程数和CPU亲和性，
+    各自运行连续批处理引擎；主进程不加载权重，请求分发给在途请求最少的副本。
+    接口与InferenceEngine一致（submit / generate / generate_stream / stats / shutdown），可直接替换。
+    safetensors权重按mmap加载，dtype与磁盘一致时各副本尽可能共享操作系统页缓存中的只读权重。
+    """
+
+    # 记录会话所在副本的最大会话数
+    MAX_TRACKED_SESSIONS = 100000
+
+    def __init__(self, model_key: Tuple[str, Optional[str], str], service_config: Dict[str, Any], tokenizer):
+        """
+        启动副本进程并等待模型加载完成
+        Args:
+            model_key: (model_path, lora_adapter_path, dtype)
+            service_config: config.yaml中的inference配置（replicas段控制副本数与线程数）
+            tokenizer: 主进程中用于流式解码的tokenizer
+        """
+        replica_config = service_config.get('replicas', {}) or {}
+        engine_config = service_config.get('engine', {}) or {}
+        self.tokenizer = tokenizer
+        self.num_workers = max(1, replica_config.get('num_workers', 2))
+        self.max_batch_size = engine_config.get('max_batch_size', 8)
+        self.max_queue_size = engine_config.get('max_queue_size', 100)
+
+        core_sets = plan_core_sets(self.num_workers, replica_config.get('threads_per_worker'))
+        self.threads_per_worker = len(core_sets[0])
+        if not replica_config.get('cpu_affinity', True):
+            core_sets = [None] * self.num_workers
+
+        # spawn：子进程不继承主进程已初始化的torch线程池与事件循环
+        context = multiprocessing.get_context('spawn')
+        self.responses = context.Queue()
+        self.replicas: List[_Replica] = []
+        for index, cores in enumerate(core_sets):
+            requests = context.Queue()
+            process = context.Process(
+                target=_replica_main,
+                args=(index, cores, self.threads_per_worker, model_key, service_config, requests, self.responses),
+                name=f"inference-replica-{index}",
+                daemon=True
+            )
+            process.start()
+            self.replicas.append(_Replica(index, cores, process, requests))
+            print(f"启动推理副本 {index}: 线程数 {self.threads_per_worker}, CPU核心 {cores if cores else '不绑定'}")
+
+        # request_id -> (future, streamer, replica, 分发时间)
+        self.pending: Dict[int, Tuple[Future, Optional[AsyncTokenStreamer], _Replica, float]] = {}
+        # 会话固定由同一个副本处理，才能复用该副本保存的会话KV
+        self.session_replicas: "OrderedDict[str, int]" = OrderedDict()
+        self.lock = Lock()
+        self._request_counter = itertools.count()
+        self._stopped = False
+
+        # 统计信息
+        self.total_requests = 0
+        self.total_rejected = 0
+        self.total_finished = 0
+        self.total_request_time = 0.0
+
+        self._wait_ready()
+        self.thread = Thread(target=self._collect, name="replica-collector", daemon=True)
+        self.thread.start()
+
+    def _wait_ready(self):
+        """等待所有副本加载模型，任一副本失败时停止全部副本"""
+        ready = 0
+        while ready < len(self.replicas):
+            try:
+                _, kind, (index, detail) = self.responses.get(timeout=5)
+            except queue.Empty:
+                # 副本进程异常退出（如内存不足被杀）时不会回报失败
+                dead = [replica.index for replica in self.replicas
+                        if replica.pid is None and not replica.process.is_alive()]
+                if dead:
+                    self.shutdown()
+                    raise RuntimeError(f"推理副本 {dead} 在加载模型时退出")
+                continue
+            if kind == 'failed':
+                self.shutdown()
+                raise RuntimeError(f"推理副本 {index} 加载模型失败: {detail}")
+            self.replicas[index].pid = detail
+            ready += 1
+        print(f"推理副本池已启动，副本数: {self.num_workers}")
+
+    def _dispatch(self, kind: str, payload: Tuple, streamer: Optional[AsyncTokenStreamer] = None,
+                  session_id: Optional[str] = None) -> Future:
+        """
+        将请求分发给在途请求最少的副本（带session_id的请求分发给该会话上次使用的副本）
+        Raises:
+            QueueFullError: 所有副本的批处理槽位与等待队列都已占满
+        """
+        future: Future = Future()
+        with self.lock:
+            if self._stopped:
+                raise RuntimeError("推理副本池已停止")
+            if self._inflight_locked() >= self.num_workers * self.max_batch_size + self.max_queue_size:
+                self.total_rejected += 1
+                raise QueueFullError(f"推理副本队列已满（{self.max_queue_size}），请稍后重试",
+                                     self._retry_after_locked())
+            replica = self._pick_replica_locked(session_id)
+            request_id = next(self._request_counter)
+            self.pending[request_id] = (future, streamer, replica, time.time())
+            replica.inflight += 1
+            self.total_requests += 1
+        replica.requests.put((request_id, kind, payload))
+        # 主进程中的请求被取消（客户端断开）时通知副本结束生成，副本回报后再释放在途计数
+        future.add_done_callback(
+            lambda done: replica.requests.put((request_id, 'cancel', None)) if done.cancelled() else None
+        )
+        return future
+
+    def _pick_replica_locked(self, session_id: Optional[str]) -> _Replica:
+        if session_id is not None:
+            index = self.session_replicas.get(session_id)
+            if index is not None and self.replicas[index].process.is_alive():
+                self.session_replicas.move_to_end(session_id)
+                return self.replicas[index]
+        replica = min(self.replicas, key=lambda item: (item.inflight, item.index))
+        if session_id is not None:
+            self.session_replicas[session_id] = replica.index
+            while len(self.session_replicas) > self.MAX_TRACKED_SESSIONS:
+                self.session_replicas.popitem(last=False)
+        return replica
+
+    def submit(self, messages: List[Dict[str, str]], config: Dict[str, Any],
+               streamer: Optional[AsyncTokenStreamer] = None) -> Future:
+        """提交生成请求，副本进程中的推理引擎负责连续批处理"""
+        return self._dispatch('submit', (messages, config, streamer is not None), streamer, config.get('session_id'))
+
+    def call(self, method: str, *args, session_id: Optional[str] = None, cancellable: bool = False) -> Future:
+        """
+        在某个副本进程中调用InferenceService的方法（批量推理、投机解码等）
+        cancellable: 方法接受cancel_event参数，Future被取消时副本设置该事件以结束执行中的调用
+        """
+        return self._dispatch('call', (method, args, cancellable), session_id=session_id)
+
+    async def generate(self, messages: List[Dict[str, str]], config: Dict[str, Any],
+                       constraint=None) -> Dict[str, Any]:
+        """
+        普通推理（非流式），等待结果期间不阻塞事件循环
+        constraint: 主进程预编译的约束索引，只用于写入磁盘缓存，副本进程从磁盘缓存加载，不跨进程传递
+        """
+        return await asyncio.wrap_future(self.submit(messages, config))
+
+    def generate_stream(self, messages: List[Dict[str, str]], config: Dict[str, Any],
+                        on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                        constraint=None) -> AsyncGenerator[str, None]:
+        """流式推理（SSE），与InferenceEngine.generate_stream相同"""
+        streamer = AsyncTokenStreamer(asyncio.get_running_loop(), skip_prompt=False)
+        future = self.submit(messages, config, streamer)
+        if on_result is not None:
+            future.add_done_callback(
+                lambda done: on_result(done.result()) if not done.cancelled() and done.exception() is None else None
+            )
+        detokenizer = IncrementalDetokenizer(self.tokenizer, config.get('enable_thinking', False), config.get('stop'))
+        return InferenceEngine.cancel_on_close(detokenizer.iter_sse(streamer), future)
+
+    def _collect(self):
+        """收集副本进程返回的token与结果"""
+        while True:
+            request_id, kind, value = self.responses.get()
+            if kind == 'stop':
+                return
+            with self.lock:
+                entry = self.pending.get(request_id)
+            if entry is None:
+                continue
+            future, streamer, replica, submitted_at = entry
+
+            if kind == 'token':
+                if not future.cancelled():
+                    streamer.put(torch.tensor([value]))
+                continue
+            if kind == 'end':
+                if value is not None:
+                    streamer.error = RuntimeError(value)
+                streamer.end()
+                continue
+
+            with self.lock:
+                del self.pending[request_id]
+                replica.inflight -= 1
+                replica.completed += 1
+                self.total_finished += 1
+                self.total_request_time += time.time() - submitted_at
+            if future.done():
+                # 已取消的请求（副本回报cancelled，或取消前已完成的结果）
+                continue
+            if kind == 'result':
+                future.set_result(value)
+            elif kind == 'cancelled':
+                future.cancel()
+            else:
+                message, retry_after = value
+                future.set_exception(QueueFullError(message, retry_after) if retry_after is not None
+                                     else RuntimeError(message))
+
+    def _inflight_locked(self) -> int:
+        return sum(replica.inflight for replica in self.replicas)
+
+    def _retry_after_locked(self) -> int:
+        waiting = max(0, self._inflight_locked() - self.num_workers * self.max_batch_size)
+        average_request_time = self.total_request_time / self.total_finished if self.total_finished else 1.0
+        return max(1, math.ceil(average_request_time * waiting / (self.num_workers * self.max_batch_size)))
+
+    def estimate_retry_after(self) -> int:
+        """按平均请求耗时与全部副本的批处理槽位估算排队请求清空所需的秒数"""
+        with self.lock:
+            return self._retry_after_locked()
+
+    def shutdown(self):
+        """停止所有副本进程，未完成的请求以异常结束"""
+        with self.lock:
+            self._stopped = True
+            pending = list(self.pending.values())
+            self.pending.clear()
+        for replica in self.replicas:
+            if replica.process.is_alive():
+                replica.requests.put(None)
+        for replica in self.replicas:
+            replica.process.join(timeout=5)
+            if replica.process.is_alive():
+                replica.process.terminate()
+        self.responses.put((None, 'stop', None))
+
+        error = RuntimeError("推理副本池已停止")
+        for future, streamer, _, _ in pending:
+            if streamer is not None:
+                streamer.error = error
+                streamer.end()
+            if not future.done():
+                future.set_exception(error)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        副本池运行统计
+        waiting/running 按每个副本的批大小由在途请求数估算（副本内部的排队情况不回传主进程）
+        """
+        with self.lock:
+            replicas = [{
+                'index': replica.index,
+                'pid': replica.pid,
+                'alive': replica.process.is_alive(),
+                'cores': replica.cores,
+                'inflight': replica.inflight,
+                'completed': replica.completed
+            } for replica in self.replicas]
+            running = sum(min(replica.inflight, self.max_batch_size) for replica in self.replicas)
+            return {
+                'waiting': self._inflight_locked() - running,
+                'max_queue_size': self.max_queue_size,
+                'total_rejected': self.total_rejected,
+                'avg_queue_wait_seconds': None,
+                'max_queue_wait_seconds': None,
+                'running': running,
+                'max_batch_size': self.max_batch_size,
+                'total_requests': self.total_requests,
+                'total_finished': self.total_finished,
+                'avg_request_seconds': self.total_request_time / self.total_finished if self.total_finished else 0.0,
+                'num_workers': self.num_workers,
+                'threads_per_worker': self.threads_per_worker,
+                'replicas': replicas
+            }
+
+
+class ReplicaInferenceService(InferenceService):
+    """
+    副本池模式下主进程中的推理服务 - 只加载tokenizer，提示词渲染、响应缓存键和批量推理的分桶在主进程完成，
+    生成交给ReplicaPool中的副本进程；只支持模型自身的适配器，不能按请求切换adapter_id
+    """
+
+    def __init__(self, model_path: str, lora_adapter_path: Optional[str] = None, dtype: str = "bfloat16",
+                 config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        print(f"以副本池模式加载模型: {model_path}")
+        self.model_path = model_path
+        self.lora_adapter_path = lora_adapter_path
+        self.model_id = f"{model_path}|{lora_adapter_path or ''}|{dtype}"
+        self.model_version = WeightsFingerprint.of(model_path, lora_adapter_path)
+        self.tokenizer = self.load_tokenizer(model_path)
+        self.backend = 'replicas'
+        # 权重只存在于副本进程中
+        self.model = None
+        self.quantized = dtype == "int8"
+        merged_config = config.get('merged_lora', {}) or {}
+        self.merged = bool(lora_adapter_path) and merged_config.get('enabled', False) and not self.quantized
+        if self.merged:
+            # 在主进程中合并一次，各副本直接加载缓存，避免每个副本各自合并
+            MergedModelCache.from_config(merged_config).build(model_path, lora_adapter_path, dtype)
+        self.adapters = AdapterManager(self, dynamic=False)
+        # 约束在主进程中编译并写入磁盘缓存（请求提交前预编译），副本进程直接加载
+        self.constraints = ConstraintCompiler(self.tokenizer, self.eos_token_ids, config.get('constrained', {}) or {})
+        self.prefix_cache = None
+        # 会话KV保存在处理该会话的副本进程中
+        self.session_cache = None
+        self.compiled_decoder = None
+        self.speculative_config = config.get('speculative', {}) or {}
+        self.draft_model = None
+
+        self.pool = ReplicaPool((model_path, lora_adapter_path, dtype), config, self.tokenizer)
+
+    def memory_footprint(self) -> int:
+        # 主进程不持有权重，不计入注册表的内存预算
+        return 0
+
+    def drop_session(self, session_id: str) -> bool:
+        with self.pool.lock:
+            known = session_id in self.pool.session_replicas
+        if not known:
+            return False
+        return self.pool.call('drop_session', session_id, session_id=session_id).result()
+
+    def generate(self, messages: List[Dict[str, str]], config: Dict[str, Any]) -> Dict[str, Any]:
+        return self.pool.submit(messages, config).result()
+
+    def generate_speculative(self, messages: List[Dict[str, str]], config: Dict[str, Any],
+                             cancel_event: Optional[Event] = None) -> Dict[str, Any]:
+        future = self.pool.call('generate_speculative', messages, config, cancellable=True)
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except FutureTimeoutError:
+                if cancel_event is not None and cancel_event.is_set():
+                    future.cancel()
+
+    async def generate_stream(self, messages: List[Dict[str, str]], config: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        async for chunk in self.pool.generate_stream(messages, config):
+            yield chunk
+
+    def _map_micro_batches(self, micro_batches: List[List[List[int]]],
+                           config: Dict[str, Any]) -> Iterator[Tuple[int, List[List[int]]]]:
+        """各micro-batch分发给不同副本并行生成（同时在途的micro-batch数不超过副本数），按完成顺序产出"""
+        batches = iter(enumerate(micro_batches))
+        futures: Dict[Future, int] = {}
+        for position, batch_prompt_ids in itertools.islice(batches, self.pool.num_workers):
+            futures[self.pool.call('_generate_micro_batch', batch_prompt_ids, config)] = position
+        while futures:
+            future = next(as_completed(futures))
+            position = futures.pop(future)
+            outputs = future.result()
+            for next_position, batch_prompt_ids in itertools.islice(batches, 1):
+                futures[self.pool.call('_generate_micro_batch', batch_prompt_ids, config)] = next_position
+            yield position, outputs
+
+    def _generate_micro_batch(self, batch_prompt_ids: List[List[int]], config: Dict[str, Any]) -> List[List[int]]:
+        return self.pool.call('_generate_micro_batch', batch_prompt_ids, config).result()
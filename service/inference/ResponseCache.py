@@ -0,0 +1,184 @@
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
+from threading import Lock
+from service.inference.Sampler import Sampler
+import hashlib
+import sqlite3
+import json
+import time
+import os
+
+# 影响生成结果的推理参数，其余参数（batch_size、length_bucketing等）不参与缓存键
+_KEY_FIELDS = ('max_new_tokens', 'enable_thinking', 'temperature', 'top_p', 'top_k', 'seed', 'speculative', 'stop',
+               'json_schema', 'regex')
+# 贪心解码时与结果无关的采样参数
+_SAMPLING_FIELDS = ('temperature', 'top_p', 'top_k', 'seed', 'speculative')
+
+
+class ResponseCache:
+    """精确匹配响应缓存 - 确定性请求（贪心解码或固定seed）按 (模型, 适配器, 提示词, 推理参数) 缓存结果，内存LRU + 可选SQLite"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, db_path: Optional[str] = None):
+        """
+        初始化响应缓存
+        Args:
+            max_entries: 内存中缓存的最大条数，超出后淘汰最久未使用的条目
+            ttl_seconds: 条目有效期（秒），0表示不过期
+            db_path: SQLite文件路径，为空时只使用内存
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (value, expires_at, model_id, model_version, adapter)
+        self.entries: "OrderedDict[str, Tuple[Dict[str, Any], float, str, str, str]]" = OrderedDict()
+        self.lock = Lock()
+
+        self.db: Optional[sqlite3.Connection] = None
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, model_id TEXT, model_version TEXT, adapter TEXT, "
+                "value TEXT, expires_at REAL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_model ON response_cache (model_id, adapter)")
+            self.db.commit()
+
+        # 统计信息
+        self.lookups = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def is_cacheable(config: Dict[str, Any]) -> bool:
+        """只有确定性请求（贪心解码或指定seed）的单个结果可以复用，n-best采样的多个候选不缓存"""
+        if (config.get('n') or 1) > 1:
+            return False
+        return Sampler.is_greedy(config) or config.get('seed') is not None
+
+    @staticmethod
+    def make_key(model_id: str, model_version: str, adapter: str, adapter_path: Optional[str], prompt: str,
+                 config: Dict[str, Any]) -> str:
+        """
+        生成缓存键
+        Args:
+            model_id: 模型标识（模型路径、LoRA路径、dtype）
+            model_version: 模型权重文件的指纹，权重变化后旧条目不再命中
+            adapter: 适配器名称
+            adapter_path: 适配器路径
+            prompt: 渲染chat_template后的提示词
+            config: 推理配置
+        """
+        fields = {name: config.get(name) for name in _KEY_FIELDS}
+        fields['max_new_tokens'] = config.get('max_new_tokens', 512)
+        fields['enable_thinking'] = bool(config.get('enable_thinking', False))
+        fields['speculative'] = bool(config.get('speculative', False))
+        fields['stop'] = sorted(config.get('stop') or [])
+        if Sampler.is_greedy(config):
+            for name in _SAMPLING_FIELDS:
+                fields.pop(name)
+        payload = json.dumps([model_id, model_version, adapter, adapter_path, prompt, fields],
+                             ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """查找缓存，内存未命中时查找SQLite并回填内存"""
+        now = time.time()
+        with self.lock:
+            self.lookups += 1
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[1] and entry[1] < now:
+                    del self.entries[key]
+                else:
+                    self.entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[0]
+
+            if self.db is None:
+                return None
+            row = self.db.execute(
+                "SELECT value, expires_at, model_id, model_version, adapter FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] and row[1] < now:
+                self.db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self.db.commit()
+                return None
+
+            value = json.loads(row[0])
+            self._put_memory_locked(key, value, row[1], row[2], row[3], row[4])
+            self.disk_hits += 1
+            return value
+
+    def put(self, key: str, value: Dict[str, Any], model_id: str, model_version: str, adapter: str):
+        """写入缓存"""
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds else 0
+        with self.lock:
+            self._put_memory_locked(key, value, expires_at, model_id, model_version, adapter)
+            self.stores += 1
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, model_id, model_version, adapter, value, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model_id, model_version, adapter, json.dumps(value, ensure_ascii=False), expires_at)
+                )
+                self.db.commit()
+
+    def invalidate(self, model_id: str, adapter: Optional[str] = None, keep_version: Optional[str] = None):
+        """
+        失效模型（或模型上某个适配器）的缓存条目
+        Args:
+            model_id: 模型标识
+            adapter: 只失效该适配器的条目
+            keep_version: 保留该权重版本的条目（模型重新加载但权重未变时）
+        """
+        with self.lock:
+            stale = [key for key, entry in self.entries.items()
+                     if entry[2] == model_id and (adapter is None or entry[4] == adapter)
+                     and (keep_version is None or entry[3] != keep_version)]
+            for key in stale:
+                del self.entries[key]
+            if self.db is None:
+                self.invalidations += len(stale)
+            else:
+                # SQLite中包含全部条目，按删除行数统计
+                sql = "DELETE FROM response_cache WHERE model_id = ?"
+                params: List[Any] = [model_id]
+                if adapter is not None:
+                    sql += " AND adapter = ?"
+                    params.append(adapter)
+                if keep_version is not None:
+                    sql += " AND model_version != ?"
+                    params.append(keep_version)
+                self.invalidations += self.db.execute(sql, params).rowcount
+                self.db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        hits = self.memory_hits + self.disk_hits
+        return {
+            'lookups': self.lookups,
+            'hits': hits,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'hit_rate': hits / self.lookups if self.lookups else 0.0,
+            'entries': len(self.entries),
+            'max_entries': self.max_entries,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'disk_enabled': self.db is not None
+        }
+
+    def _put_memory_locked(self, key: str, value: Dict[str, Any], expires_at: float, model_id: str,
+                           model_version: str, adapter: str):
+        self.entries[key] = (value, expires_at, model_id, model_version, adapter)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
@@ -0,0 +1,63 @@
+from typing import Any, Dict, Optional
+import torch
+
+
+class Sampler:
+    """采样器 - 按请求的temperature/top_k/top_p从logits中选取下一个token"""
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def is_greedy(config: Dict[str, Any]) -> bool:
+        """temperature为0或关闭采样时使用贪心解码"""
+        return not config.get('do_sample', True) or config.get('temperature', 0.7) <= 0
+
+    @staticmethod
+    def warp(logits: torch.Tensor, config: Dict[str, Any]) -> torch.Tensor:
+        """
+        对单行logits应用temperature、top_k、top_p
+        Args:
+            logits: 形状 [vocab_size]
+            config: 推理配置
+        Returns:
+            处理后的logits（被过滤的位置为-inf）
+        """
+        logits = logits.float()
+        temperature = config.get('temperature', 0.7)
+        if temperature > 0:
+            logits = logits / temperature
+
+        top_k = config.get('top_k', 20)
+        if top_k and top_k > 0:
+            top_k = min(top_k, logits.size(-1))
+            kth_value = torch.topk(logits, top_k).values[-1]
+            logits = logits.masked_fill(logits < kth_value, float('-inf'))
+
+        top_p = config.get('top_p', 0.8)
+        if top_p is not None and top_p < 1.0:
+            sorted_logits, sorted_indices = torch.sort(logits, descending=True)
+            sorted_probs = torch.softmax(sorted_logits, dim=-1)
+            # 保留累计概率首次超过top_p的token
+            remove = torch.cumsum(sorted_probs, dim=-1) - sorted_probs > top_p
+            sorted_logits = sorted_logits.masked_fill(remove, float('-inf'))
+            logits = torch.full_like(logits, float('-inf')).scatter(0, sorted_indices, sorted_logits)
+
+        return logits
+
+    @staticmethod
+    def sample(logits: torch.Tensor, config: Dict[str, Any], generator: Optional[torch.Generator] = None) -> int:
+        """
+        从单行logits中选取下一个token
+        Args:
+            logits: 形状 [vocab_size]
+            config: 推理配置
+            generator: 随机数生成器（固定seed时使用）
+        Returns:
+            token id
+        """
+        if Sampler.is_greedy(config):
+            return int(torch.argmax(logits).item())
+
+        probs = torch.softmax(Sampler.warp(logits, config), dim=-1)
+        return int(torch.multinomial(probs, 1, generator=generator).item())
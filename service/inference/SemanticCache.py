@@ -0,0 +1,439 @@
+from typing import Dict, Any, List, Optional, Tuple
+from threading import Lock
+from service.inference.ResponseCache import ResponseCache
+import json
+import math
+import time
+import os
+import torch
+
+
+class VectorIndex:
+    """
+    向量近似最近邻索引（IVF）- 条目较少时精确检索；达到训练规模后用k-means把向量划分到倒排列表，
+    查询只在与查询向量最接近的nprobe个列表中做内积；条目数翻倍后重新训练
+    向量需已归一化，内积即余弦相似度
+    """
+
+    # k-means迭代次数
+    TRAIN_ITERATIONS = 10
+
+    def __init__(self, dim: int, min_train_size: int = 1024, nprobe: int = 8):
+        """
+        Args:
+            dim: 向量维度
+            min_train_size: 条目数达到该值后训练倒排列表，之前精确检索
+            nprobe: 每次查询检索的倒排列表数
+        """
+        self.dim = dim
+        self.min_train_size = min_train_size
+        self.nprobe = nprobe
+        self.vectors = torch.empty((0, dim), dtype=torch.float32)
+        self.size = 0
+        # 每个条目所在的倒排列表，未训练时为空
+        self.centroids: Optional[torch.Tensor] = None
+        self.assign = torch.empty(0, dtype=torch.long)
+        # 倒排列表：每个列表中的行号，以及每行在其列表中的位置（删除时O(1)定位）
+        self.lists: List[List[int]] = []
+        self.slots: List[int] = []
+        self.trained_size = 0
+        self.trainings = 0
+
+    def add(self, vectors: torch.Tensor) -> List[int]:
+        """追加向量，返回其行号"""
+        vectors = vectors.detach().to(torch.float32).cpu().reshape(-1, self.dim)
+        count = vectors.shape[0]
+        if self.size + count > self.vectors.shape[0]:
+            # 容量按倍数增长，避免每次追加都复制全部向量
+            capacity = max(self.size + count, self.vectors.shape[0] * 2, 64)
+            grown = torch.empty((capacity, self.dim), dtype=torch.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+            grown_assign = torch.zeros(capacity, dtype=torch.long)
+            grown_assign[:self.size] = self.assign[:self.size]
+            self.assign = grown_assign
+
+        rows = list(range(self.size, self.size + count))
+        self.vectors[self.size:self.size + count] = vectors
+        if self.centroids is not None:
+            assign = torch.argmax(vectors @ self.centroids.T, dim=1)
+            self.assign[self.size:self.size + count] = assign
+            for row, list_id in zip(rows, assign.tolist()):
+                self.slots.append(len(self.lists[list_id]))
+                self.lists[list_id].append(row)
+        else:
+            self.slots.extend([0] * count)
+        self.size += count
+
+        if self.size >= self.min_train_size and self.size >= self.trained_size * 2:
+            self.train()
+        return rows
+
+    def remove(self, row: int) -> Optional[int]:
+        """
+        删除一行：最后一行移动到被删除的位置
+        Returns:
+            被移动的原行号（删除的就是最后一行时为None）
+        """
+        last = self.size - 1
+        if self.centroids is not None:
+            # 从所在列表中删除：列表末尾的行移到其位置
+            rows = self.lists[int(self.assign[row])]
+            slot = self.slots[row]
+            rows[slot] = rows[-1]
+            self.slots[rows[slot]] = slot
+            rows.pop()
+        self.size -= 1
+        if row == last:
+            self.slots.pop()
+            return None
+        self.vectors[row] = self.vectors[last]
+        self.assign[row] = self.assign[last]
+        self.slots[row] = self.slots[last]
+        self.slots.pop()
+        if self.centroids is not None:
+            self.lists[int(self.assign[row])][self.slots[row]] = row
+        return last
+
+    def search(self, queries: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        每个查询向量的最近邻
+        Args:
+            queries: [num_queries, dim]
+        Returns:
+            (相似度, 行号)，索引为空时行号为-1
+        """
+        queries = queries.detach().to(torch.float32).cpu().reshape(-1, self.dim)
+        num_queries = queries.shape[0]
+        if self.size == 0:
+            return torch.full((num_queries,), -1.0), torch.full((num_queries,), -1, dtype=torch.long)
+        vectors = self.vectors[:self.size]
+        if self.centroids is None:
+            scores = queries @ vectors.T
+            best_scores, best_rows = scores.max(dim=1)
+            return best_scores, best_rows
+
+        probes = torch.topk(queries @ self.centroids.T, min(self.nprobe, self.centroids.shape[0]), dim=1).indices
+        best_scores = torch.full((num_queries,), -1.0)
+        best_rows = torch.full((num_queries,), -1, dtype=torch.long)
+        for position in range(num_queries):
+            # 只访问被检索的倒排列表中的行
+            rows = [row for list_id in probes[position].tolist() for row in self.lists[list_id]]
+            if not rows:
+                continue
+            candidates = torch.tensor(rows, dtype=torch.long)
+            scores = vectors[candidates] @ queries[position]
+            best = int(torch.argmax(scores).item())
+            best_scores[position] = scores[best]
+            best_rows[position] = candidates[best]
+        return best_scores, best_rows
+
+    def train(self):
+        """球面k-means：列表数取条目数的平方根，以随机抽取的条目初始化质心"""
+        vectors = self.vectors[:self.size]
+        num_lists = max(1, int(math.sqrt(self.size)))
+        generator = torch.Generator().manual_seed(self.size)
+        centroids = vectors[torch.randperm(self.size, generator=generator)[:num_lists]].clone()
+        assign = torch.argmax(vectors @ centroids.T, dim=1)
+        for _ in range(self.TRAIN_ITERATIONS):
+            sums = torch.zeros_like(centroids).index_add_(0, assign, vectors)
+            counts = torch.bincount(assign, minlength=num_lists)
+            # 空列表保留原质心
+            centroids = torch.where((counts > 0).unsqueeze(1), torch.nn.functional.normalize(sums, dim=1), centroids)
+            assign = torch.argmax(vectors @ centroids.T, dim=1)
+
+        self.centroids = centroids
+        self.assign[:self.size] = assign
+        self._build_lists()
+        self.trained_size = self.size
+        self.trainings += 1
+
+    def _build_lists(self):
+        """按每行所在的列表重建倒排列表"""
+        self.lists = [[] for _ in range(self.centroids.shape[0])]
+        self.slots = []
+        for row, list_id in enumerate(self.assign[:self.size].tolist()):
+            self.slots.append(len(self.lists[list_id]))
+            self.lists[list_id].append(row)
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            'vectors': self.vectors[:self.size].clone(),
+            'centroids': self.centroids,
+            'assign': self.assign[:self.size].clone(),
+            'trained_size': self.trained_size
+        }
+
+    def load_state_dict(self, state: Dict[str, Any]):
+        self.vectors = state['vectors'].to(torch.float32)
+        self.size = self.vectors.shape[0]
+        self.centroids = state['centroids']
+        self.assign = state['assign'].to(torch.long)
+        self.trained_size = state['trained_size']
+        if self.centroids is not None:
+            self._build_lists()
+        else:
+            self.slots = [0] * self.size
+
+
+class _Namespace:
+    """同一模型、适配器与推理参数下的缓存条目（只有同一模型产生的向量可以比较）"""
+
+    def __init__(self, key: str, dim: int, index_config: Dict[str, Any]):
+        self.key = key
+        self.index = VectorIndex(dim, **index_config)
+        # 与索引行号对齐的条目信息
+        self.values: List[Dict[str, Any]] = []
+        self.expires_at: List[float] = []
+        self.last_used: List[float] = []
+        self.meta: Dict[str, str] = {}
+        self.dirty = 0
+
+    def remove(self, row: int):
+        moved = self.index.remove(row)
+        for column in (self.values, self.expires_at, self.last_used):
+            if moved is not None:
+                column[row] = column[moved]
+            column.pop()
+
+
+class SemanticCache:
+    """
+    语义响应缓存 - 提示词经模型前向计算得到的向量与已缓存提示词的最近邻相似度超过阈值时，直接返回缓存的结果；
+    条目按 (模型, 适配器, 推理参数) 分区建立近似最近邻索引，总条数超出上限时淘汰最久未命中的条目，
+    索引与结果保存在 save_path 目录下，重启后继续使用
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, save_path: Optional[str] = None, threshold: float = 0.97, max_entries: int = 10000,
+                 ttl_seconds: float = 86400, min_train_size: int = 1024, nprobe: int = 8, save_every: int = 32,
+                 batch_size: int = 16, max_prompt_tokens: int = 512):
+        """
+        Args:
+            save_path: 索引保存目录，为空时只使用内存
+            threshold: 命中所需的最低余弦相似度
+            max_entries: 所有分区的最大条目数
+            ttl_seconds: 条目有效期（秒），0表示不过期
+            min_train_size: 分区条目数达到该值后建立倒排列表
+            nprobe: 每次查询检索的倒排列表数
+            save_every: 分区累计多少次写入后保存到磁盘
+            batch_size: 计算提示词向量时每次前向计算的提示词数
+            max_prompt_tokens: 计算向量时每条提示词保留的最后token数
+        """
+        self.save_path = save_path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.index_config = {'min_train_size': min_train_size, 'nprobe': nprobe}
+        self.save_every = save_every
+        self.batch_size = batch_size
+        self.max_prompt_tokens = max_prompt_tokens
+        self.namespaces: Dict[str, _Namespace] = {}
+        self.lock = Lock()
+
+        # 分区 -> 模型信息（包含只在磁盘上的分区，用于失效）
+        self.manifest: Dict[str, Dict[str, str]] = {}
+        if save_path:
+            os.makedirs(save_path, exist_ok=True)
+            manifest_path = os.path.join(save_path, self.MANIFEST)
+            if os.path.exists(manifest_path):
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    self.manifest = json.load(f)
+
+        # 统计信息
+        self.lookups = 0
+        self.hits = 0
+        self.expired = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.hit_similarity_sum = 0.0
+
+    @staticmethod
+    def namespace_key(model_id: str, model_version: str, adapter: str, adapter_path: Optional[str],
+                      config: Dict[str, Any]) -> str:
+        """分区键：与响应缓存键相同的字段，但不含提示词"""
+        return ResponseCache.make_key(model_id, model_version, adapter, adapter_path, "", config)
+
+    @property
+    def size(self) -> int:
+        return sum(namespace.index.size for namespace in self.namespaces.values())
+
+    def get(self, namespace_key: str, embeddings: torch.Tensor) -> List[Optional[Tuple[Dict[str, Any], float]]]:
+        """
+        查找一组提示词向量的缓存结果
+        Args:
+            namespace_key: 分区键
+            embeddings: 已归一化的提示词向量 [num_prompts, dim]
+        Returns:
+            每条提示词的 (缓存结果, 相似度)，未命中为None
+        """
+        now = time.time()
+        with self.lock:
+            self.lookups += embeddings.shape[0]
+            namespace = self._namespace_locked(namespace_key, embeddings.shape[-1])
+            if namespace is None or namespace.index.size == 0:
+                return [None] * embeddings.shape[0]
+
+            scores, rows = namespace.index.search(embeddings)
+            results: List[Optional[Tuple[Dict[str, Any], float]]] = []
+            expired_rows = set()
+            for score, row in zip(scores.tolist(), rows.tolist()):
+                if row < 0 or score < self.threshold or row in expired_rows:
+                    results.append(None)
+                    continue
+                if namespace.expires_at[row] and namespace.expires_at[row] < now:
+                    expired_rows.add(row)
+                    results.append(None)
+                    continue
+                namespace.last_used[row] = now
+                self.hits += 1
+                self.hit_similarity_sum += score
+                results.append((namespace.values[row], score))
+
+            # 过期条目在本次查询结束后删除（删除会移动行号）
+            for row in sorted(expired_rows, reverse=True):
+                namespace.remove(row)
+                namespace.dirty += 1
+                self.expired += 1
+            return results
+
+    def put(self, namespace_key: str, embeddings: torch.Tensor, values: List[Dict[str, Any]], model_id: str,
+            model_version: str, adapter: str):
+        """写入一组提示词向量及其生成结果"""
+        if not values:
+            return
+        now = time.time()
+        expires_at = now + self.ttl_seconds if self.ttl_seconds else 0
+        with self.lock:
+            namespace = self._namespace_locked(namespace_key, embeddings.shape[-1], create=True)
+            namespace.meta = {'model_id': model_id, 'model_version': model_version, 'adapter': adapter}
+            namespace.index.add(embeddings)
+            namespace.values.extend(values)
+            namespace.expires_at.extend([expires_at] * len(values))
+            namespace.last_used.extend([now] * len(values))
+            namespace.dirty += len(values)
+            self.stores += len(values)
+            self._evict_locked()
+            if namespace.dirty >= self.save_every:
+                self._save_locked(namespace)
+
+    def invalidate(self, model_id: str, adapter: Optional[str] = None, keep_version: Optional[str] = None):
+        """
+        失效模型（或模型上某个适配器）的缓存分区，参数含义与ResponseCache.invalidate相同
+        """
+        with self.lock:
+            stale = [key for key, meta in self.manifest.items()
+                     if meta['model_id'] == model_id and (adapter is None or meta['adapter'] == adapter)
+                     and (keep_version is None or meta['model_version'] != keep_version)]
+            stale += [key for key, namespace in self.namespaces.items()
+                      if key not in self.manifest and namespace.meta.get('model_id') == model_id
+                      and (adapter is None or namespace.meta.get('adapter') == adapter)
+                      and (keep_version is None or namespace.meta.get('model_version') != keep_version)]
+            for key in stale:
+                namespace = self.namespaces.pop(key, None)
+                if namespace is not None:
+                    self.invalidations += namespace.index.size
+                self.manifest.pop(key, None)
+                path = self._path(key)
+                if path and os.path.exists(path):
+                    os.remove(path)
+            if stale:
+                self._save_manifest_locked()
+
+    def flush(self):
+        """保存所有有未保存写入的分区"""
+        with self.lock:
+            for namespace in self.namespaces.values():
+                if namespace.dirty:
+                    self._save_locked(namespace)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        with self.lock:
+            namespaces = list(self.namespaces.values())
+            return {
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+                'avg_hit_similarity': self.hit_similarity_sum / self.hits if self.hits else 0.0,
+                'threshold': self.threshold,
+                'entries': sum(namespace.index.size for namespace in namespaces),
+                'max_entries': self.max_entries,
+                'namespaces': len(namespaces),
+                'indexed_namespaces': sum(namespace.index.centroids is not None for namespace in namespaces),
+                'index_trainings': sum(namespace.index.trainings for namespace in namespaces),
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'invalidations': self.invalidations,
+                'disk_enabled': self.save_path is not None
+            }
+
+    def _path(self, key: str) -> Optional[str]:
+        return os.path.join(self.save_path, f"{key}.pt") if self.save_path else None
+
+    def _namespace_locked(self, key: str, dim: int, create: bool = False) -> Optional[_Namespace]:
+        """获取分区，内存中没有时从磁盘加载"""
+        namespace = self.namespaces.get(key)
+        if namespace is not None:
+            return namespace
+        path = self._path(key)
+        if key in self.manifest and path and os.path.exists(path):
+            state = torch.load(path, weights_only=True)
+            namespace = _Namespace(key, dim, self.index_config)
+            namespace.index.load_state_dict(state['index'])
+            namespace.values = json.loads(state['values'])
+            namespace.expires_at = state['expires_at'].tolist()
+            namespace.last_used = state['last_used'].tolist()
+            namespace.meta = self.manifest[key]
+            self.namespaces[key] = namespace
+            self._evict_locked()
+            return namespace
+        if not create:
+            return None
+        namespace = _Namespace(key, dim, self.index_config)
+        self.namespaces[key] = namespace
+        return namespace
+
+    def _evict_locked(self):
+        """总条目数超出上限时淘汰最久未命中的条目"""
+        excess = self.size - self.max_entries
+        while excess > 0:
+            namespace, row = min(
+                ((namespace, min(range(namespace.index.size), key=namespace.last_used.__getitem__))
+                 for namespace in self.namespaces.values() if namespace.index.size),
+                key=lambda item: item[0].last_used[item[1]]
+            )
+            namespace.remove(row)
+            namespace.dirty += 1
+            self.evictions += 1
+            excess -= 1
+
+    def _save_locked(self, namespace: _Namespace):
+        namespace.dirty = 0
+        path = self._path(namespace.key)
+        if path is None:
+            return
+        state = {
+            'index': namespace.index.state_dict(),
+            'values': json.dumps(namespace.values, ensure_ascii=False),
+            'expires_at': torch.tensor(namespace.expires_at, dtype=torch.float64),
+            'last_used': torch.tensor(namespace.last_used, dtype=torch.float64)
+        }
+        temp_path = f"{path}.tmp-{os.getpid()}"
+        torch.save(state, temp_path)
+        os.replace(temp_path, path)
+        if self.manifest.get(namespace.key) != namespace.meta:
+            self.manifest[namespace.key] = namespace.meta
+            self._save_manifest_locked()
+
+    def _save_manifest_locked(self):
+        if not self.save_path:
+            return
+        path = os.path.join(self.save_path, self.MANIFEST)
+        temp_path = f"{path}.tmp-{os.getpid()}"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+        os.replace(temp_path, path)
@@ -0,0 +1,223 @@
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
+from threading import Lock
+from service.inference.KVCacheUtil import KVCacheUtil, LegacyCache
+import hashlib
+import torch
+import time
+import os
+
+
+class SessionEntry:
+    """一个会话在上一轮结束时的KV状态"""
+
+    __slots__ = ('adapter', 'token_ids', 'kv', 'nbytes', 'last_access')
+
+    def __init__(self, adapter: str, token_ids: List[int], kv: Optional[LegacyCache], nbytes: int):
+        self.adapter = adapter
+        self.token_ids = token_ids
+        self.kv = kv
+        self.nbytes = nbytes
+        self.last_access = time.time()
+
+
+class SessionKVStore:
+    """
+    会话KV缓存 - 按session_id保存上一轮对话结束时的token与KV，下一轮与新提示词取最长公共前缀后只prefill新增部分；
+    内存按字节LRU淘汰，淘汰的会话写入磁盘，再次访问时读回
+    （历史轮次的thinking内容会被chat_template去掉，此时复用到上一轮助手回复之前）
+    """
+
+    def __init__(self, namespace: str, max_memory_mb: float = 1024, spill_dir: Optional[str] = None,
+                 max_disk_mb: float = 8192, ttl_seconds: float = 3600, min_reuse_tokens: int = 16):
+        """
+        初始化会话KV缓存
+        Args:
+            namespace: 模型标识（含权重版本），区分不同模型写入磁盘的会话文件
+            max_memory_mb: 内存中会话KV的预算（MB）
+            spill_dir: 淘汰会话的落盘目录，为空时直接丢弃
+            max_disk_mb: 落盘文件总大小上限（MB），超出后删除最久未访问的会话
+            ttl_seconds: 会话闲置超过该时间后失效，0表示不过期
+            min_reuse_tokens: 公共前缀低于该长度时不复用
+        """
+        self.namespace = namespace
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self.spill_dir = spill_dir
+        self.ttl_seconds = ttl_seconds
+        self.min_reuse_tokens = min_reuse_tokens
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+        # 内存中的会话，以及已落盘的会话（kv为空，nbytes为文件大小）
+        self.entries: "OrderedDict[str, SessionEntry]" = OrderedDict()
+        self.spilled: "OrderedDict[str, SessionEntry]" = OrderedDict()
+        self.total_bytes = 0
+        self.disk_bytes = 0
+        self.lock = Lock()
+
+        # 统计信息
+        self.lookups = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.lookup_tokens = 0
+        self.reused_tokens = 0
+        self.spills = 0
+        self.expired = 0
+
+    def match(self, session_id: str, adapter: str, token_ids: List[int]) -> Tuple[int, Optional[LegacyCache]]:
+        """
+        查找会话上一轮的KV与本轮提示词的最长公共前缀
+        Returns:
+            (复用的token数, 对应的KV缓存)；至少保留最后一个token由调用方prefill
+        """
+        entry = self._get(session_id)
+        with self.lock:
+            self.lookups += 1
+            self.lookup_tokens += len(token_ids)
+        if entry is None or entry.adapter != adapter:
+            return 0, None
+
+        limit = min(len(entry.token_ids), len(token_ids) - 1)
+        length = 0
+        while length < limit and entry.token_ids[length] == token_ids[length]:
+            length += 1
+        if length < max(self.min_reuse_tokens, 1):
+            return 0, None
+
+        with self.lock:
+            self.hits += 1
+            self.reused_tokens += length
+        return length, KVCacheUtil.select(entry.kv, 0, 0, length)
+
+    def put(self, session_id: str, adapter: str, token_ids: List[int], kv: LegacyCache):
+        """
+        保存会话本轮结束时的KV（kv需覆盖全部token_ids），替换上一轮的状态
+        kv会被复制一份，避免持有整批张量的视图
+        """
+        kv = tuple((key[:, :, :len(token_ids)].clone(), value[:, :, :len(token_ids)].clone()) for key, value in kv)
+        entry = SessionEntry(adapter, list(token_ids), kv, KVCacheUtil.nbytes(kv))
+        with self.lock:
+            self._remove_locked(session_id)
+            self.entries[session_id] = entry
+            self.total_bytes += entry.nbytes
+            victims = self._evict_locked()
+        self._spill(victims)
+
+    def drop(self, session_id: str) -> bool:
+        """删除会话（内存与磁盘）"""
+        with self.lock:
+            return self._remove_locked(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        return {
+            'sessions': len(self.entries),
+            'spilled_sessions': len(self.spilled),
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'reused_token_ratio': self.reused_tokens / self.lookup_tokens if self.lookup_tokens else 0.0,
+            'spills': self.spills,
+            'expired': self.expired,
+            'memory_mb': round(self.total_bytes / 1024 / 1024, 2),
+            'max_memory_mb': round(self.max_bytes / 1024 / 1024, 2),
+            'disk_mb': round(self.disk_bytes / 1024 / 1024, 2)
+        }
+
+    def _get(self, session_id: str) -> Optional[SessionEntry]:
+        """取出会话状态，已落盘的会话读回内存"""
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is not None:
+                if self._expired(entry):
+                    self._remove_locked(session_id)
+                    self.expired += 1
+                    return None
+                entry.last_access = time.time()
+                self.entries.move_to_end(session_id)
+                return entry
+
+            spilled = self.spilled.pop(session_id, None)
+            if spilled is None:
+                return None
+            self.disk_bytes -= spilled.nbytes
+            expired = self._expired(spilled)
+            if expired:
+                self.expired += 1
+
+        path = self._path(session_id)
+        try:
+            if expired:
+                return None
+            state = torch.load(path, weights_only=True)
+        except (OSError, RuntimeError) as e:
+            print(f"读取会话KV失败: {session_id}, 错误: {e}")
+            return None
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+        entry = SessionEntry(spilled.adapter, state['token_ids'], tuple(tuple(layer) for layer in state['kv']), 0)
+        entry.nbytes = KVCacheUtil.nbytes(entry.kv)
+        with self.lock:
+            self.disk_hits += 1
+            if session_id not in self.entries:
+                self.entries[session_id] = entry
+                self.total_bytes += entry.nbytes
+            victims = self._evict_locked()
+        self._spill(victims)
+        return entry
+
+    def _spill(self, victims: List[Tuple[str, SessionEntry]]):
+        """将淘汰的会话写入磁盘（在锁外执行），超出磁盘预算时删除最久未访问的会话文件"""
+        if not self.spill_dir:
+            return
+        for session_id, entry in victims:
+            path = self._path(session_id)
+            temp_path = path + ".tmp"
+            torch.save({'token_ids': entry.token_ids, 'kv': [list(layer) for layer in entry.kv]}, temp_path)
+            os.replace(temp_path, path)
+            entry.kv = None
+            entry.nbytes = os.path.getsize(path)
+            with self.lock:
+                if session_id in self.entries:
+                    # 落盘期间会话已有新一轮的状态
+                    os.remove(path)
+                    continue
+                self.spilled[session_id] = entry
+                self.disk_bytes += entry.nbytes
+                self.spills += 1
+                while self.disk_bytes > self.max_disk_bytes and self.spilled:
+                    oldest_id = next(iter(self.spilled))
+                    self._remove_locked(oldest_id)
+
+    def _evict_locked(self) -> List[Tuple[str, SessionEntry]]:
+        """超出内存预算时移出最久未访问的会话，返回待落盘的会话"""
+        victims = []
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            session_id, entry = self.entries.popitem(last=False)
+            self.total_bytes -= entry.nbytes
+            if not self._expired(entry):
+                victims.append((session_id, entry))
+        return victims
+
+    def _remove_locked(self, session_id: str) -> bool:
+        entry = self.entries.pop(session_id, None)
+        if entry is not None:
+            self.total_bytes -= entry.nbytes
+        spilled = self.spilled.pop(session_id, None)
+        if spilled is not None:
+            self.disk_bytes -= spilled.nbytes
+            path = self._path(session_id)
+            if os.path.exists(path):
+                os.remove(path)
+        return entry is not None or spilled is not None
+
+    def _expired(self, entry: SessionEntry) -> bool:
+        return bool(self.ttl_seconds) and time.time() - entry.last_access > self.ttl_seconds
+
+    def _path(self, session_id: str) -> str:
+        digest = hashlib.sha256(f"{self.namespace}|{session_id}".encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.spill_dir, f"session-{digest}.pt")
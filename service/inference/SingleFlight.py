@@ -0,0 +1,151 @@
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+
+
+class StreamFlight:
+    """一次进行中的流式生成，输出片段保留到生成结束，后加入的订阅者从头回放"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.condition = asyncio.Condition()
+        self.subscribers = 0
+        # 消费生成流的后台任务，所有订阅者都断开时取消
+        self.task: Optional[asyncio.Task] = None
+
+    async def pump(self, stream: AsyncGenerator[str, None]):
+        """消费生成流并广播给所有订阅者（与任何一个客户端连接无关）"""
+        try:
+            async for chunk in stream:
+                async with self.condition:
+                    self.chunks.append(chunk)
+                    self.condition.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            # 被取消时关闭生成流，底层请求随之取消
+            await stream.aclose()
+            async with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def subscribe(self) -> AsyncGenerator[str, None]:
+        # 订阅时立即计数，避免先到的订阅者开始消费前被其他订阅者的断开误判为无人订阅
+        self.subscribers += 1
+        return self._replay()
+
+    async def _replay(self) -> AsyncGenerator[str, None]:
+        index = 0
+        try:
+            while True:
+                async with self.condition:
+                    while index >= len(self.chunks) and not self.done:
+                        await self.condition.wait()
+                    if index < len(self.chunks):
+                        chunk = self.chunks[index]
+                        index += 1
+                    elif self.error is not None:
+                        raise self.error
+                    else:
+                        return
+                yield chunk
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and self.task is not None and not self.task.done():
+                self.task.cancel()
+
+
+class Flight:
+    """一次进行中的非流式生成及其等待方数量"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """相同请求合并 - 缓存键相同的确定性请求同时到达时，只执行一次生成，其余请求共享结果或token流"""
+
+    def __init__(self):
+        self.flights: Dict[str, Flight] = {}
+        self.streams: Dict[str, StreamFlight] = {}
+
+        # 统计信息
+        self.leaders = 0
+        self.coalesced = 0
+        self.stream_leaders = 0
+        self.stream_coalesced = 0
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        执行或加入一次非流式生成
+        Args:
+            key: 请求的缓存键
+            fn: 没有进行中的相同请求时执行的生成协程
+        Returns:
+            (生成结果, 是否合并到已有请求)
+        等待方被取消（客户端断开）时只有最后一个离开的等待方会取消生成
+        """
+        flight = self.flights.get(key)
+        coalesced = flight is not None
+        if coalesced:
+            self.coalesced += 1
+        else:
+            flight = Flight(asyncio.ensure_future(fn()))
+            self.flights[key] = flight
+            self.leaders += 1
+            flight.task.add_done_callback(lambda _: self._finish(key, flight))
+
+        flight.waiters += 1
+        try:
+            # shield: 某个等待方被取消时不影响其他等待方
+            return await asyncio.shield(flight.task), coalesced
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def _finish(self, key: str, flight: Flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        # 没有等待方时标记异常已读取，避免事件循环告警
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def stream(self, key: str, start: Callable[[], AsyncGenerator[str, None]]) -> Tuple[AsyncGenerator[str, None], bool]:
+        """
+        执行或加入一次流式生成
+        Args:
+            key: 请求的缓存键
+            start: 没有进行中的相同请求时调用，返回生成流（入队失败时直接抛出异常）
+        Returns:
+            (订阅的token流, 是否合并到已有请求)
+        """
+        flight = self.streams.get(key)
+        if flight is not None and not flight.done:
+            self.stream_coalesced += 1
+            return flight.subscribe(), True
+
+        stream = start()
+        flight = StreamFlight()
+        self.streams[key] = flight
+        self.stream_leaders += 1
+
+        subscription = flight.subscribe()
+        flight.task = asyncio.ensure_future(flight.pump(stream))
+        flight.task.add_done_callback(lambda _: self.streams.pop(key, None) if self.streams.get(key) is flight else None)
+        return subscription, False
+
+    def stats(self) -> Dict[str, Any]:
+        """合并统计"""
+        return {
+            'in_flight': len(self.flights),
+            'streams_in_flight': len(self.streams),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced,
+            'stream_leaders': self.stream_leaders,
+            'stream_coalesced': self.stream_coalesced,
+            'coalesced_ratio': (self.coalesced + self.stream_coalesced) /
+                               max(self.leaders + self.coalesced + self.stream_leaders + self.stream_coalesced, 1)
+        }
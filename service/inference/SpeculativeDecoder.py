@@ -0,0 +1,174 @@
+from typing import List, Dict, Any, Optional, Set
+from transformers import DynamicCache
+from service.inference.Sampler import Sampler
+from service.inference.GenerationBudget import GenerationBudget
+import torch
+import time
+
+
+class SpeculativeDecoder:
+    """投机解码 - 小模型一次提议k个token，目标模型一次前向验证，接受/拒绝采样保证输出分布与目标模型一致"""
+
+    def __init__(self, target_model, draft_model, eos_token_ids: Set[int], num_speculative_tokens: int = 4):
+        """
+        初始化投机解码器
+        Args:
+            target_model: 目标模型
+            draft_model: 草稿模型（需与目标模型共用词表）
+            eos_token_ids: 结束token集合
+            num_speculative_tokens: 每轮草稿模型提议的token数k
+        """
+        self.target_model = target_model
+        self.draft_model = draft_model
+        self.eos_token_ids = eos_token_ids
+        self.num_speculative_tokens = num_speculative_tokens
+
+    @torch.inference_mode()
+    def generate(self, prompt_ids: List[int], config: Dict[str, Any],
+                 budget: Optional[GenerationBudget] = None) -> Dict[str, Any]:
+        """
+        投机解码生成
+        Args:
+            prompt_ids: 提示词token id
+            config: 推理配置（num_speculative_tokens可覆盖默认k）
+            budget: 请求预算，每轮验证后检查，触发时以其原因结束
+        Returns:
+            output_ids与本次请求的接受率、加速比统计
+        """
+        k = max(1, config.get('num_speculative_tokens') or self.num_speculative_tokens)
+        max_new_tokens = config.get('max_new_tokens', 512)
+        greedy = Sampler.is_greedy(config)
+        generator = None
+        if config.get('seed') is not None:
+            generator = torch.Generator(device=self.target_model.device).manual_seed(config['seed'])
+
+        start_time = time.time()
+        tokens = list(prompt_ids)
+        prompt_length = len(prompt_ids)
+        target_cache, draft_cache = DynamicCache(), DynamicCache()
+
+        # prefill：两个模型的缓存都覆盖除最后一个token以外的全部token
+        self._forward(self.target_model, tokens[:-1], target_cache)
+        self._forward(self.draft_model, tokens[:-1], draft_cache)
+
+        proposed = accepted = target_passes = 0
+        finished = False
+        finish_reason = None
+        while finish_reason is None and not finished and len(tokens) - prompt_length < max_new_tokens:
+            remaining = max_new_tokens - (len(tokens) - prompt_length)
+            num_draft = min(k, remaining)
+
+            # 草稿模型逐个提议token
+            draft_tokens, draft_probs = [], []
+            for _ in range(num_draft):
+                # 输入草稿缓存尚未覆盖的全部token（上一轮全部接受时会多于一个）
+                sequence = tokens + draft_tokens
+                logits = self._forward(self.draft_model, sequence[draft_cache.get_seq_length():], draft_cache)
+                probs = self._probs(logits[-1], config, greedy)
+                token_id = self._pick(probs, greedy, generator)
+                draft_tokens.append(token_id)
+                draft_probs.append(probs)
+                if token_id in self.eos_token_ids:
+                    break
+            proposed += len(draft_tokens)
+
+            # 目标模型一次前向验证：输入最后一个已确认token与全部草稿token
+            target_length = target_cache.get_seq_length()
+            logits = self._forward(self.target_model, tokens[target_length:] + draft_tokens, target_cache)
+            target_passes += 1
+            # logits[-(n+1)] 对应第一个草稿token位置的分布
+            verify_logits = logits[-(len(draft_tokens) + 1):]
+
+            new_tokens = []
+            for index, token_id in enumerate(draft_tokens):
+                target_probs = self._probs(verify_logits[index], config, greedy)
+                draft_prob = draft_probs[index]
+                vocab = min(target_probs.size(-1), draft_prob.size(-1))
+                if greedy:
+                    ok = int(torch.argmax(target_probs).item()) == token_id
+                else:
+                    ratio = target_probs[token_id] / draft_prob[token_id].clamp_min(1e-10)
+                    ok = torch.rand(1, generator=generator, device=target_probs.device).item() < ratio.item()
+
+                if ok:
+                    new_tokens.append(token_id)
+                    accepted += 1
+                    if token_id in self.eos_token_ids:
+                        break
+                    continue
+
+                # 拒绝：从 max(0, p - q) 归一化后的分布中重新采样
+                if greedy:
+                    new_tokens.append(int(torch.argmax(target_probs).item()))
+                else:
+                    residual = (target_probs[:vocab] - draft_prob[:vocab]).clamp_min(0)
+                    if residual.sum() <= 0:
+                        residual = target_probs[:vocab]
+                    new_tokens.append(int(torch.multinomial(residual / residual.sum(), 1, generator=generator).item()))
+                break
+            else:
+                # 全部接受：再从目标模型的下一个位置额外采样一个token
+                if not draft_tokens or draft_tokens[-1] not in self.eos_token_ids:
+                    bonus_probs = self._probs(verify_logits[len(draft_tokens)], config, greedy)
+                    new_tokens.append(self._pick(bonus_probs, greedy, generator))
+
+            new_tokens = new_tokens[:remaining]
+            tokens.extend(new_tokens)
+            if any(token_id in self.eos_token_ids for token_id in new_tokens):
+                finished = True
+            if budget is not None:
+                for token_id in new_tokens:
+                    budget.push(token_id)
+                finish_reason = budget.finish_reason()
+
+            # 回退缓存，使其只覆盖已确认token（不含最后一个）
+            target_cache.crop(len(tokens) - 1)
+            draft_cache.crop(min(draft_cache.get_seq_length(), len(tokens) - 1))
+
+        output_ids = tokens[prompt_length:]
+        elapsed = time.time() - start_time
+        generated = len(output_ids)
+        return {
+            'output_ids': output_ids,
+            'finish_reason': finish_reason or ("stop" if finished else "length"),
+            'speculative': {
+                'num_speculative_tokens': k,
+                'proposed_tokens': proposed,
+                'accepted_tokens': accepted,
+                'acceptance_rate': accepted / proposed if proposed else 0.0,
+                'target_forward_passes': target_passes,
+                # 普通解码每个token需要一次目标模型前向，以此估算加速比
+                'speedup': generated / target_passes if target_passes else 0.0,
+                'elapsed_seconds': elapsed,
+                'tokens_per_second': generated / elapsed if elapsed > 0 else 0.0
+            }
+        }
+
+    @staticmethod
+    def _forward(model, input_ids: List[int], cache: DynamicCache) -> Optional[torch.Tensor]:
+        """在缓存之后追加input_ids做一次前向，返回 [len(input_ids), vocab] 的logits"""
+        if not input_ids:
+            return None
+        past_length = cache.get_seq_length()
+        device = model.device
+        inputs = torch.tensor([input_ids], device=device)
+        outputs = model(
+            input_ids=inputs,
+            attention_mask=torch.ones((1, past_length + len(input_ids)), dtype=torch.long, device=device),
+            position_ids=torch.arange(past_length, past_length + len(input_ids), device=device).unsqueeze(0),
+            past_key_values=cache,
+            use_cache=True
+        )
+        return outputs.logits[0].float()
+
+    @staticmethod
+    def _probs(logits: torch.Tensor, config: Dict[str, Any], greedy: bool) -> torch.Tensor:
+        if greedy:
+            return torch.softmax(logits, dim=-1)
+        return torch.softmax(Sampler.warp(logits, config), dim=-1)
+
+    @staticmethod
+    def _pick(probs: torch.Tensor, greedy: bool, generator: Optional[torch.Generator]) -> int:
+        if greedy:
+            return int(torch.argmax(probs).item())
+        return int(torch.multinomial(probs, 1, generator=generator).item())
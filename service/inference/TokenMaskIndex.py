@@ -0,0 +1,185 @@
+from typing import Dict, Any, List, Optional, Set, Tuple
+from transformers import LogitsProcessor
+from service.inference.RegexFSM import RegexFSM
+from threading import Lock
+import torch
+
+
+class TokenMaskIndex:
+    """
+    token掩码索引 - 对正则DFA的每个状态预先计算词表中哪些token读入后不会走到死状态，
+    解码时按当前状态取出一行布尔掩码对logits做一次masked_fill；
+    掩码相同的状态共用一行（字符串内部等状态的允许集合相同），磁盘与内存中只保存去重后的行
+    """
+
+    # 每次并行推进的DFA状态数（[状态数, 词表大小] 的int64中间结果）
+    STATE_CHUNK = 32
+
+    def __init__(self, fsm: RegexFSM, token_bytes: List[bytes], state_rows: torch.Tensor, row_masks: torch.Tensor,
+                 row_accepting: torch.Tensor, eos_token_ids: Set[int]):
+        """
+        Args:
+            fsm: 正则的字节级DFA
+            token_bytes: 每个token对应的字节（特殊token为空，不允许出现）
+            state_rows: 每个DFA状态使用的掩码行 [num_states]
+            row_masks: 去重后的掩码 [num_rows, len(token_bytes)]，不含结束token
+            row_accepting: 每行对应的状态是否为接受状态（接受状态允许结束token）[num_rows]
+            eos_token_ids: 结束token
+        """
+        self.fsm = fsm
+        self.token_bytes = token_bytes
+        self.state_rows = state_rows.tolist()
+        self.row_masks = row_masks
+        self.row_accepting = row_accepting
+        self.eos_token_ids = set(eos_token_ids)
+        # 无法继续匹配时（不会出现在正常解码中）只允许结束
+        self.dead_row = row_masks.shape[0]
+        # (设备, logits宽度) -> 补齐到模型词表并加入结束token的掩码
+        self._device_masks: Dict[Tuple[str, int], torch.Tensor] = {}
+        self._lock = Lock()
+
+    @property
+    def num_states(self) -> int:
+        return self.fsm.num_states
+
+    @property
+    def num_rows(self) -> int:
+        return self.row_masks.shape[0]
+
+    @classmethod
+    def build(cls, fsm: RegexFSM, token_bytes: List[bytes], eos_token_ids: Set[int]) -> "TokenMaskIndex":
+        """
+        按DFA计算全部状态的token掩码：token按字节长度降序排列，逐个字节位置对一批状态 x 全部token
+        做一次查表推进，只处理长度超过该位置的token
+        """
+        num_states = fsm.num_states
+        vocab_size = len(token_bytes)
+        sink = num_states
+        table = torch.tensor(fsm.transitions + [[RegexFSM.DEAD] * 256], dtype=torch.long)
+        table[table == RegexFSM.DEAD] = sink
+
+        lengths = torch.tensor([len(data) for data in token_bytes], dtype=torch.long)
+        order = torch.argsort(lengths, descending=True)
+        sorted_lengths = lengths[order]
+        max_length = int(sorted_lengths[0].item()) if vocab_size else 0
+        padded = bytearray()
+        for index in order.tolist():
+            padded += token_bytes[index].ljust(max_length, b'\0')
+        token_matrix = torch.frombuffer(padded, dtype=torch.uint8).view(vocab_size, max_length).long() \
+            if max_length else torch.zeros((vocab_size, 0), dtype=torch.long)
+        # 长度超过每个字节位置的token数（降序排列后为前缀）
+        active_counts = [int((sorted_lengths > position).sum().item()) for position in range(max_length)]
+
+        masks = torch.zeros((num_states, vocab_size), dtype=torch.bool)
+        for start in range(0, num_states, cls.STATE_CHUNK):
+            end = min(num_states, start + cls.STATE_CHUNK)
+            states = torch.arange(start, end, dtype=torch.long).unsqueeze(1).repeat(1, vocab_size)
+            for position, count in enumerate(active_counts):
+                states[:, :count] = table[states[:, :count], token_matrix[:count, position]]
+            allowed = (states != sink) & (sorted_lengths > 0)
+            masks[start:end, order] = allowed
+
+        accepting = torch.tensor(fsm.accepting, dtype=torch.bool)
+        keyed = torch.cat([masks, accepting.unsqueeze(1)], dim=1).to(torch.uint8)
+        rows, state_rows = torch.unique(keyed, dim=0, return_inverse=True)
+        rows = rows.bool()
+        return cls(fsm, token_bytes, state_rows, rows[:, :-1].contiguous(), rows[:, -1].contiguous(), eos_token_ids)
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            'transitions': torch.tensor(self.fsm.transitions, dtype=torch.int32),
+            'accepting': torch.tensor(self.fsm.accepting, dtype=torch.bool),
+            'state_rows': torch.tensor(self.state_rows, dtype=torch.long),
+            'row_masks': self.row_masks,
+            'row_accepting': self.row_accepting
+        }
+
+    @classmethod
+    def from_state_dict(cls, state: Dict[str, Any], token_bytes: List[bytes], eos_token_ids: Set[int]) -> "TokenMaskIndex":
+        fsm = RegexFSM(state['transitions'].tolist(), state['accepting'].tolist())
+        return cls(fsm, token_bytes, state['state_rows'], state['row_masks'], state['row_accepting'], eos_token_ids)
+
+    def next_state(self, state: int, token_id: int) -> int:
+        """读入一个token后的状态（结束token不改变状态）"""
+        if token_id in self.eos_token_ids or state == RegexFSM.DEAD:
+            return state
+        if token_id >= len(self.token_bytes) or not self.token_bytes[token_id]:
+            return RegexFSM.DEAD
+        return self.fsm.walk(state, self.token_bytes[token_id])
+
+    def is_accepting(self, state: int) -> bool:
+        return state != RegexFSM.DEAD and self.fsm.accepting[state]
+
+    def masks(self, states: List[int], logits: torch.Tensor) -> torch.Tensor:
+        """
+        一组状态的允许token掩码
+        Args:
+            states: 每行的DFA状态
+            logits: [batch, vocab] 或 [vocab]，用于确定设备与宽度
+        Returns:
+            与logits同形状的布尔掩码
+        """
+        table = self._masks_for(logits.device, logits.shape[-1])
+        rows = [self.dead_row if state == RegexFSM.DEAD else self.state_rows[state] for state in states]
+        if logits.dim() == 1:
+            return table[rows[0]]
+        return table[torch.tensor(rows, device=logits.device)]
+
+    def _masks_for(self, device: torch.device, width: int) -> torch.Tensor:
+        """补齐到logits宽度（模型词表通常大于tokenizer词表，多出的id不允许）并加入结束token，按设备缓存"""
+        key = (str(device), width)
+        table = self._device_masks.get(key)
+        if table is not None:
+            return table
+        with self._lock:
+            table = self._device_masks.get(key)
+            if table is not None:
+                return table
+            columns = min(width, self.row_masks.shape[1])
+            table = torch.zeros((self.num_rows + 1, width), dtype=torch.bool)
+            table[:self.num_rows, :columns] = self.row_masks[:, :columns]
+            eos_ids = [token_id for token_id in self.eos_token_ids if token_id < width]
+            # 接受状态、没有任何可用token的状态和死状态允许结束
+            finishing = torch.cat([self.row_accepting | ~table[:self.num_rows].any(dim=1), torch.tensor([True])])
+            for token_id in eos_ids:
+                table[:, token_id] = finishing
+            table = table.to(device)
+            self._device_masks[key] = table
+            return table
+
+
+class TokenConstraint:
+    """单条序列的约束状态：采样前屏蔽不允许的token，采样后推进DFA"""
+
+    def __init__(self, index: TokenMaskIndex):
+        self.index = index
+        self.state = 0
+
+    def apply(self, logits: torch.Tensor) -> torch.Tensor:
+        """logits: [vocab]"""
+        return logits.masked_fill(~self.index.masks([self.state], logits), float('-inf'))
+
+    def advance(self, token_id: int):
+        self.state = self.index.next_state(self.state, token_id)
+
+    @property
+    def complete(self) -> bool:
+        """已生成的内容完整匹配约束"""
+        return self.index.is_accepting(self.state)
+
+
+class ConstraintLogitsProcessor(LogitsProcessor):
+    """将token掩码索引用于transformers的generate：每步按各行的DFA状态批量屏蔽logits"""
+
+    def __init__(self, index: TokenMaskIndex):
+        self.index = index
+        self.states: Optional[List[int]] = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self.states is None:
+            # 第一次调用时input_ids只有提示词
+            self.states = [0] * input_ids.shape[0]
+        else:
+            for row, token_id in enumerate(input_ids[:, -1].tolist()):
+                self.states[row] = self.index.next_state(self.states[row], token_id)
+        return scores.masked_fill(~self.index.masks(self.states, scores), float('-inf'))
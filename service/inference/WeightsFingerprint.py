@@ -0,0 +1,33 @@
+from typing import Optional
+import hashlib
+import os
+
+
+class WeightsFingerprint:
+    """模型权重指纹 - 由模型/适配器目录中各文件的路径、大小和修改时间生成，权重文件变化后指纹随之变化"""
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def of(model_path: str, lora_adapter_path: Optional[str] = None) -> str:
+        """
+        计算模型（及适配器）的权重指纹
+        Args:
+            model_path: 基础模型路径
+            lora_adapter_path: LoRA适配器路径（可选）
+        Returns:
+            16位十六进制指纹
+        """
+        digest = hashlib.sha256()
+        for path in (model_path, lora_adapter_path):
+            if not path:
+                continue
+            digest.update(os.path.abspath(path).encode('utf-8'))
+            if os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    file_path = os.path.join(path, name)
+                    if os.path.isfile(file_path):
+                        stat = os.stat(file_path)
+                        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+        return digest.hexdigest()[:16]
@@ -0,0 +1,122 @@
+import requests
+import tempfile
+import json
+import time
+import os
+import sys
+
+# 设置UTF-8编码，避免Windows控制台编码问题
+if sys.platform == 'win32' and hasattr(sys.stdout, 'buffer'):
+    import io
+
+    if not isinstance(sys.stdout, io.TextIOWrapper) or sys.stdout.encoding != 'utf-8':
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+
+class BulkInferenceAPITest:
+    """离线批量推理API测试类"""
+
+    def __init__(self, base_url: str = "http://127.0.0.1:8801"):
+        self.base_url = base_url
+        self.test_data_dir = os.path.join(os.path.dirname(__file__), "data")
+        self.work_dir = tempfile.mkdtemp(prefix="bulk_inference_")
+
+    def _prepare_input(self) -> str:
+        """从 train_sample.json 中取出用户提问，生成每行一个prompt的输入文件"""
+        input_path = os.path.join(self.work_dir, "prompts.jsonl")
+        with open(os.path.join(self.test_data_dir, "train_sample.json"), 'r', encoding='utf-8') as source, \
+                open(input_path, 'w', encoding='utf-8') as target:
+            for index, line in enumerate(source):
+                if not line.strip():
+                    continue
+                conversations = json.loads(line)['conversations']
+                prompt = next(message['content'] for message in conversations if message['role'] == 'user')
+                target.write(json.dumps({"id": index, "prompt": prompt}, ensure_ascii=False) + "\n")
+        return input_path
+
+    def test_bulk_inference(self, model_path: str):
+        """测试离线批量推理任务：启动、轮询进度、检查输出"""
+        print("=" * 50)
+        print("测试离线批量推理API")
+        print("=" * 50)
+
+        request_data = {
+            "model_path": model_path,
+            "input_path": self._prepare_input(),
+            "output_path": os.path.join(self.work_dir, "results.jsonl"),
+            "max_tokens": 50,
+            "temperature": 0,
+            "batch_size": 4
+        }
+
+        print(f"\n请求数据:")
+        print(json.dumps(request_data, indent=2, ensure_ascii=False))
+
+        try:
+            print(f"\n发送任务请求到: {self.base_url}/api/bulk/start")
+            response = requests.post(f"{self.base_url}/api/bulk/start", json=request_data, timeout=30)
+            response.raise_for_status()
+            task_id = response.json()['task_id']
+            print(f"任务ID: {task_id}")
+
+            # 轮询任务状态
+            while True:
+                status = requests.get(f"{self.base_url}/api/bulk/status/{task_id}", timeout=30).json()['data']
+                print(f"状态: {status['status']}, 进度: {status['progress']:.1f}%, "
+                      f"已处理: {status['processed_lines']} 行, 吞吐: {status['lines_per_second']:.2f} 行/秒, "
+                      f"剩余: {status['eta_seconds']}")
+                if status['status'] in ('completed', 'failed', 'cancelled'):
+                    break
+                time.sleep(2)
+
+            with open(request_data["output_path"], 'r', encoding='utf-8') as f:
+                results = [json.loads(line) for line in f if line.strip()]
+            print(f"\n输出 {len(results)} 行，示例:")
+            print(json.dumps(results[:2], indent=2, ensure_ascii=False))
+
+            if status['status'] == 'completed':
+                print("\n✅ 离线批量推理测试成功")
+            else:
+                print(f"\n❌ 离线批量推理测试失败: {status.get('error_message')}")
+
+            return status
+
+        except Exception as e:
+            print(f"\n❌ 离线批量推理测试失败: {e}")
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"响应状态码: {e.response.status_code}")
+                print(f"响应内容: {e.response.text}")
+            return {"error": str(e)}
+
+    def run_all_tests(self, model_path: str):
+        """运行所有离线批量推理API测试"""
+        print("\n" + "=" * 60)
+        print("开始运行离线批量推理API测试")
+        print("=" * 60)
+
+        # 测试1: 离线批量推理
+        print("\n\n【测试1】离线批量推理API")
+        bulk_result = self.test_bulk_inference(model_path)
+
+        print("\n" + "=" * 60)
+        print("离线批量推理API测试完成")
+        print("=" * 60)
+
+        return {"bulk": bulk_result}
+
+
+if __name__ == "__main__":
+    import yaml
+
+    config_path = os.path.join(os.path.dirname(__file__), "..", "config.yaml")
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+            model_path = config['model']['base_model_path']
+    except Exception as e:
+        print(f"❌ 读取配置文件失败: {e}")
+        sys.exit(1)
+
+    tester = BulkInferenceAPITest()
+    tester.run_all_tests(model_path)
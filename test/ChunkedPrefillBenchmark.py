@@ -0,0 +1,173 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from service.inference.InferenceService import InferenceService
+from service.inference.KVCacheUtil import KVCacheUtil
+
+# 设置UTF-8编码，避免Windows控制台编码问题
+if sys.platform == 'win32' and hasattr(sys.stdout, 'buffer'):
+    import io
+
+    if not isinstance(sys.stdout, io.TextIOWrapper) or sys.stdout.encoding != 'utf-8':
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+
+class PeakMemoryMonitor:
+    """峰值内存监控 - GPU上读取CUDA分配器的峰值，CPU上由采样线程读取进程常驻内存（RSS）"""
+
+    def __init__(self, device: torch.device, interval: float = 0.005):
+        self.device = device
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+            self.baseline = torch.cuda.memory_allocated(self.device)
+        else:
+            self.baseline = self.peak = self._rss()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            self.peak = torch.cuda.max_memory_allocated(self.device)
+        else:
+            self._stopped.set()
+            self._thread.join()
+
+    @property
+    def peak_mb(self) -> float:
+        """相对开始时增加的峰值内存（MB）"""
+        return (self.peak - self.baseline) / (1024 * 1024)
+
+    def _sample(self):
+        while not self._stopped.is_set():
+            self.peak = max(self.peak, self._rss())
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _rss() -> int:
+        try:
+            with open('/proc/self/statm', 'r') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ChunkedPrefillBenchmark:
+    """分块prefill对比测试 - 同一段长提示词按不同分块大小prefill，比较峰值激活内存、总耗时与单块最长耗时"""
+
+    def __init__(self, model_path: str, config: dict = None, prompt_tokens: int = 4096,
+                 chunk_sizes: list = None):
+        self.model_path = model_path
+        self.config = dict(config or {})
+        self.config['prefix_cache'] = {'enabled': False}
+        self.config['session_cache'] = {'enabled': False}
+        self.config['compile'] = {'enabled': False}
+        self.prompt_tokens = prompt_tokens
+        # 0表示整段提示词一次prefill（分块前的行为）
+        self.chunk_sizes = chunk_sizes or [0, 256, 512, 1024]
+
+    def benchmark_chunk_size(self, service: InferenceService, prompt_ids: list, chunk_size: int) -> dict:
+        """与推理引擎的 _prefill_chunk 相同的方式逐块prefill，返回最后一个位置的logits用于校验"""
+        model = service.model
+        device = model.device
+        total = len(prompt_ids)
+        step = chunk_size or total
+        chunk_seconds = []
+        logits = None
+
+        start_time = time.time()
+        with PeakMemoryMonitor(device) as monitor, torch.inference_mode():
+            past = None
+            for start in range(0, total, step):
+                end = min(total, start + step)
+                chunk_start = time.time()
+                outputs = model(
+                    input_ids=torch.tensor([prompt_ids[start:end]], device=device),
+                    attention_mask=torch.ones((1, end), dtype=torch.long, device=device),
+                    position_ids=torch.arange(start, end, device=device).unsqueeze(0),
+                    past_key_values=KVCacheUtil.to_cache(past),
+                    use_cache=True,
+                    logits_to_keep=1
+                )
+                past = KVCacheUtil.to_legacy(outputs.past_key_values)
+                logits = outputs.logits[0, -1].float()
+                if device.type == 'cuda':
+                    torch.cuda.synchronize(device)
+                chunk_seconds.append(time.time() - chunk_start)
+            del past, outputs
+        total_seconds = time.time() - start_time
+
+        result = {
+            'chunk_size': chunk_size,
+            'chunks': len(chunk_seconds),
+            'peak_memory_mb': round(monitor.peak_mb, 1),
+            'total_seconds': round(total_seconds, 3),
+            # 分块后其他序列的解码最多等待一个块的时间
+            'max_chunk_seconds': round(max(chunk_seconds), 3)
+        }
+        print(json.dumps(result, ensure_ascii=False))
+        return result, logits
+
+    def run_all_tests(self):
+        """加载模型，依次测试各分块大小，并校验与一次prefill的logits一致"""
+        service = InferenceService(self.model_path, config=self.config)
+        vocab_size = service.model.config.vocab_size
+        generator = torch.Generator().manual_seed(0)
+        prompt_ids = torch.randint(0, vocab_size, (self.prompt_tokens,), generator=generator).tolist()
+        print(f"提示词长度: {len(prompt_ids)} tokens，设备: {service.model.device}")
+
+        results = []
+        reference = None
+        for chunk_size in self.chunk_sizes:
+            result, logits = self.benchmark_chunk_size(service, prompt_ids, chunk_size)
+            if reference is None:
+                reference = logits
+            result['max_logit_diff'] = round((logits - reference).abs().max().item(), 4)
+            results.append(result)
+
+        print("\n" + "=" * 60)
+        print("对比结果")
+        print("=" * 60)
+        for result in results:
+            label = "不分块" if result['chunk_size'] == 0 else f"chunk={result['chunk_size']}"
+            print(f"{label:>12}: 峰值内存 +{result['peak_memory_mb']} MB, 总耗时 {result['total_seconds']}秒, "
+                  f"单块最长 {result['max_chunk_seconds']}秒, logits最大差异 {result['max_logit_diff']}")
+        return results
+
+
+if __name__ == "__main__":
+    import yaml
+
+    config_path = os.path.join(os.path.dirname(__file__), "..", "config.yaml")
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+            model_path = config['model']['base_model_path']
+    except Exception as e:
+        print(f"❌ 读取配置文件失败: {e}")
+        sys.exit(1)
+
+    inference_config = config.get('inference', {})
+    chunk_size = (inference_config.get('engine', {}) or {}).get('prefill_chunk_size', 512)
+    tester = ChunkedPrefillBenchmark(model_path, config=inference_config,
+                                     chunk_sizes=sorted({0, 256, chunk_size or 512, 1024}))
+    tester.run_all_tests()
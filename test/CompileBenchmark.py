@@ -0,0 +1,118 @@
+import json
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from service.inference.InferenceService import InferenceService
+from service.inference.KVCacheUtil import KVCacheUtil
+
+# 设置UTF-8编码，避免Windows控制台编码问题
+if sys.platform == 'win32' and hasattr(sys.stdout, 'buffer'):
+    import io
+
+    if not isinstance(sys.stdout, io.TextIOWrapper) or sys.stdout.encoding != 'utf-8':
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+
+class CompileBenchmark:
+    """编译解码对比测试 - 在每个 (批大小, KV长度) 分桶上比较eager与torch.compile单步解码的tokens/s"""
+
+    def __init__(self, model_path: str, config: dict = None, steps: int = 20):
+        self.model_path = model_path
+        self.config = dict(config or {})
+        self.config['prefix_cache'] = {'enabled': False}
+        self.config['session_cache'] = {'enabled': False}
+        self.config['compile'] = dict(self.config.get('compile', {}) or {}, enabled=True, warmup=True)
+        self.steps = steps
+
+    def benchmark_bucket(self, service: InferenceService, batch_size: int, kv_length: int) -> dict:
+        """测试单个分桶：相同的输入分别按eager与编译路径解码steps步"""
+        model = service.model
+        decoder = service.compiled_decoder
+        num_kv_heads, head_dim = decoder.kv_shape
+        device = model.device
+
+        past = tuple(
+            (torch.randn(batch_size, num_kv_heads, kv_length, head_dim, dtype=model.dtype, device=device) * 0.1,
+             torch.randn(batch_size, num_kv_heads, kv_length, head_dim, dtype=model.dtype, device=device) * 0.1)
+            for _ in range(model.config.num_hidden_layers)
+        )
+        input_ids = torch.randint(0, model.config.vocab_size, (batch_size, 1), device=device)
+        attention_mask = torch.ones((batch_size, kv_length + 1), dtype=torch.long, device=device)
+        position_ids = torch.full((batch_size, 1), kv_length, dtype=torch.long, device=device)
+
+        with torch.inference_mode():
+            start_time = time.time()
+            for _ in range(self.steps):
+                outputs = model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                                past_key_values=KVCacheUtil.to_cache(past), use_cache=True)
+            eager_seconds = time.time() - start_time
+            eager_logits = outputs.logits[:, -1, :].float()
+
+            start_time = time.time()
+            compiled = None
+            for _ in range(self.steps):
+                compiled = decoder.forward(input_ids, attention_mask, position_ids, past)
+                if compiled is None:
+                    break
+            compiled_seconds = time.time() - start_time
+
+        tokens = batch_size * self.steps
+        result = {
+            'batch': batch_size,
+            'length': kv_length,
+            'eager_tokens_per_second': round(tokens / eager_seconds, 2),
+            'compiled_tokens_per_second': None,
+            'speedup': None,
+            'max_logit_diff': None
+        }
+        if compiled is not None:
+            result['compiled_tokens_per_second'] = round(tokens / compiled_seconds, 2)
+            result['speedup'] = round(eager_seconds / compiled_seconds, 2)
+            # 编译前后的数值差异（融合算子的累加顺序不同，bfloat16下有少量误差）
+            result['max_logit_diff'] = round((compiled[0].float() - eager_logits).abs().max().item(), 4)
+        print(json.dumps(result, ensure_ascii=False))
+        return result
+
+    def run_all_tests(self):
+        """加载模型并编译全部分桶，逐个分桶对比"""
+        load_start = time.time()
+        service = InferenceService(self.model_path, config=self.config)
+        print(f"模型加载与编译耗时: {time.time() - load_start:.1f}秒")
+        if service.compiled_decoder is None or service.compiled_decoder.failed:
+            print("❌ 编译解码路径不可用，已回退eager模式")
+            return []
+
+        decoder = service.compiled_decoder
+        results = [self.benchmark_bucket(service, batch_size, length)
+                   for batch_size in decoder.batch_buckets for length in decoder.length_buckets]
+
+        print("\n" + "=" * 60)
+        print("对比结果")
+        print("=" * 60)
+        for result in results:
+            print(f"batch={result['batch']:>3}, length={result['length']:>5}: "
+                  f"eager {result['eager_tokens_per_second']} tokens/s, "
+                  f"compiled {result['compiled_tokens_per_second']} tokens/s, 加速比 {result['speedup']}")
+        return results
+
+
+if __name__ == "__main__":
+    import yaml
+
+    config_path = os.path.join(os.path.dirname(__file__), "..", "config.yaml")
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+            model_path = config['model']['base_model_path']
+    except Exception as e:
+        print(f"❌ 读取配置文件失败: {e}")
+        sys.exit(1)
+
+    tester = CompileBenchmark(model_path, config=config.get('inference', {}))
+    tester.run_all_tests()
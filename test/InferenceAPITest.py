@@ -1,5 +1,6 @@
 import requests
 import json
+import time
 import os
 import sys
 
@@ -129,7 +130,8 @@ class InferenceAPITest:
                 "Python是什么？"
             ],
             "max_tokens": 50,
-            "temperature": 0.7
+            "temperature": 0.7,
+            "batch_size": 2
         }
 
         print(f"\n请求数据:")
@@ -163,6 +165,265 @@ class InferenceAPITest:
                 print(f"响应内容: {e.response.text}")
             return {"error": str(e)}
 
+    def test_batch_inference_stream(self, model_path: str):
+        """测试批量推理API（NDJSON流式返回）"""
+        print("\n" + "=" * 50)
+        print("测试批量推理API（流式）")
+        print("=" * 50)
+
+        # 准备请求数据
+        request_data = {
+            "model_path": model_path,
+            "prompts": [
+                "1+1等于几？",
+                "Python是什么？",
+                "介绍一下机器学习"
+            ],
+            "max_tokens": 50,
+            "temperature": 0.7,
+            "batch_size": 2,
+            "stream": True
+        }
+
+        print(f"\n请求数据:")
+        print(json.dumps(request_data, indent=2, ensure_ascii=False))
+
+        try:
+            print(f"\n发送批量推理请求到: {self.base_url}/api/inference/batch")
+            response = requests.post(
+                f"{self.base_url}/api/inference/batch",
+                json=request_data,
+                headers={"Content-Type": "application/json"},
+                stream=True,
+                timeout=300
+            )
+            response.raise_for_status()
+
+            print(f"\n批量推理结果（按完成顺序）:")
+            results = {}
+            summary = None
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                item = json.loads(line.decode('utf-8'))
+                print(json.dumps(item, ensure_ascii=False))
+                if 'index' in item:
+                    results[item['index']] = item['result']
+                elif item.get('done'):
+                    summary = item
+
+            if summary and len(results) == len(request_data["prompts"]):
+                print("\n✅ 批量推理（流式）测试成功")
+            else:
+                print("\n❌ 批量推理（流式）测试失败")
+
+            return {"results": results, "summary": summary}
+
+        except Exception as e:
+            print(f"\n❌ 批量推理（流式）测试失败: {e}")
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"响应状态码: {e.response.status_code}")
+            return {"error": str(e)}
+
+    def test_session_chat(self, model_path: str, turns: int = 3):
+        """测试多轮对话会话KV复用：同一session_id逐轮追加消息，观察每轮耗时"""
+        print("\n" + "=" * 50)
+        print("测试多轮对话会话API")
+        print("=" * 50)
+
+        session_id = f"session-test-{int(time.time())}"
+        messages = []
+        latencies = []
+        try:
+            for turn in range(turns):
+                messages.append({"role": "user", "content": f"第{turn + 1}轮：请用一句话介绍一种水果"})
+                request_data = {
+                    "messages": messages,
+                    "max_tokens": 50,
+                    "temperature": 0.7,
+                    "session_id": session_id
+                }
+                start = time.time()
+                response = requests.post(f"{self.base_url}/api/inference/chat", json=request_data, timeout=300)
+                response.raise_for_status()
+                result = response.json()
+                latencies.append(time.time() - start)
+                print(f"第{turn + 1}轮 耗时: {latencies[-1]:.2f}s, 回复: {result['content']}")
+                messages.append({"role": "assistant", "content": result['content']})
+
+            requests.delete(f"{self.base_url}/api/inference/sessions/{session_id}", timeout=30)
+            print("\n✅ 多轮对话会话测试成功")
+            return {"latencies": latencies}
+
+        except Exception as e:
+            print(f"\n❌ 多轮对话会话测试失败: {e}")
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"响应状态码: {e.response.status_code}")
+                print(f"响应内容: {e.response.text}")
+            return {"error": str(e)}
+
+    def test_stream_disconnect(self, model_path: str, read_tokens: int = 5):
+        """测试流式推理中途断开：读取若干token后关闭连接，通过引擎统计确认生成被取消"""
+        print("\n" + "=" * 50)
+        print("测试流式推理客户端断开")
+        print("=" * 50)
+
+        request_data = {
+            "messages": [{"role": "user", "content": "请详细介绍一下深度学习的发展历史"}],
+            "max_tokens": 1024,
+            "temperature": 0.7
+        }
+        try:
+            before = requests.get(f"{self.base_url}/api/inference/engine/stats", timeout=30).json()['data']
+            with requests.post(f"{self.base_url}/api/inference/chat/stream", json=request_data,
+                               stream=True, timeout=300) as response:
+                response.raise_for_status()
+                received = 0
+                for line in response.iter_lines():
+                    if line:
+                        received += 1
+                    if received >= read_tokens:
+                        break
+            # 序列在下一个token边界结束，稍等后查看统计
+            time.sleep(2)
+            after = requests.get(f"{self.base_url}/api/inference/engine/stats", timeout=30).json()['data']
+            cancelled = after['cancelled'] - before['cancelled']
+            wasted = after['wasted_tokens'] - before['wasted_tokens']
+            print(f"读取 {received} 个片段后断开，取消请求数: {cancelled}，浪费token数: {wasted}")
+            print("\n✅ 流式推理客户端断开测试成功" if cancelled else "\n❌ 生成未被取消")
+            return {"cancelled": cancelled, "wasted_tokens": wasted}
+
+        except Exception as e:
+            print(f"\n❌ 流式推理客户端断开测试失败: {e}")
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"响应状态码: {e.response.status_code}")
+                print(f"响应内容: {e.response.text}")
+            return {"error": str(e)}
+
+    def test_n_best_chat(self, model_path: str, n: int = 4):
+        """测试n-best采样：一次请求返回n个候选，按累计对数概率从高到低排列"""
+        print("\n" + "=" * 50)
+        print("测试n-best采样API")
+        print("=" * 50)
+
+        request_data = {
+            "messages": [{"role": "user", "content": "给一家咖啡店起个名字"}],
+            "max_tokens": 50,
+            "temperature": 0.9,
+            "n": n
+        }
+        try:
+            start = time.time()
+            response = requests.post(f"{self.base_url}/api/inference/chat", json=request_data, timeout=300)
+            response.raise_for_status()
+            result = response.json()
+            choices = result.get("choices") or []
+            print(f"耗时: {time.time() - start:.2f}s")
+            for choice in choices:
+                print(f"[{choice['index']}] logprob={choice['cumulative_logprob']:.2f} "
+                      f"({choice['finish_reason']}): {choice['content']}")
+            ordered = all(choices[i]['cumulative_logprob'] >= choices[i + 1]['cumulative_logprob']
+                          for i in range(len(choices) - 1))
+            print("\n✅ n-best采样测试成功" if len(choices) == n and ordered else "\n❌ n-best采样测试失败")
+            return result
+
+        except Exception as e:
+            print(f"\n❌ n-best采样测试失败: {e}")
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"响应状态码: {e.response.status_code}")
+                print(f"响应内容: {e.response.text}")
+            return {"error": str(e)}
+
+    def test_json_schema_chat(self, model_path: str):
+        """测试约束解码：按JSON Schema生成，返回内容应能直接解析并包含必需字段"""
+        print("\n" + "=" * 50)
+        print("测试约束解码API（JSON Schema）")
+        print("=" * 50)
+
+        schema = {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "age": {"type": "integer"},
+                "hobbies": {"type": "array", "items": {"type": "string"}, "maxItems": 3}
+            },
+            "required": ["name", "age"]
+        }
+        request_data = {
+            "messages": [{"role": "user", "content": "虚构一个人物，用JSON给出姓名、年龄和爱好"}],
+            "max_tokens": 200,
+            "temperature": 0.7,
+            "json_schema": schema
+        }
+        try:
+            # 第一次请求包含约束的编译时间，第二次命中索引缓存
+            for attempt in range(2):
+                start = time.time()
+                response = requests.post(f"{self.base_url}/api/inference/chat", json=request_data, timeout=300)
+                response.raise_for_status()
+                result = response.json()
+                print(f"第{attempt + 1}次 耗时: {time.time() - start:.2f}s, 输出: {result['content']}")
+            data = json.loads(result['content'])
+            valid = isinstance(data.get("name"), str) and isinstance(data.get("age"), int)
+            print("\n✅ 约束解码测试成功" if valid else "\n❌ 输出缺少必需字段")
+            return result
+
+        except Exception as e:
+            print(f"\n❌ 约束解码测试失败: {e}")
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"响应状态码: {e.response.status_code}")
+                print(f"响应内容: {e.response.text}")
+            return {"error": str(e)}
+
+    def test_semantic_cache(self, model_path: str):
+        """
+        测试语义缓存（需开启inference.semantic_cache）：措辞不同的相同问题应命中语义缓存；
+        只差一个数字的相似问题（近似但答案不同）不能命中
+        """
+        print("\n" + "=" * 50)
+        print("测试语义缓存API")
+        print("=" * 50)
+
+        # (先发送的问题, 后发送的问题, 后者是否应命中语义缓存)
+        pairs = [
+            ("什么是机器学习？请简要回答。", "请简要回答：什么是机器学习？", True),
+            ("1+1等于几？", "2+2等于几？", False)
+        ]
+        try:
+            passed = True
+            for first, second, expect_hit in pairs:
+                results = []
+                for prompt in (first, second):
+                    request_data = {
+                        "messages": [{"role": "user", "content": prompt}],
+                        "max_tokens": 128,
+                        "temperature": 0
+                    }
+                    start = time.time()
+                    response = requests.post(f"{self.base_url}/api/inference/chat", json=request_data, timeout=300)
+                    response.raise_for_status()
+                    result = response.json()
+                    results.append(result)
+                    print(f"提示词: {prompt} 耗时: {time.time() - start:.2f}s, metrics: {result.get('metrics')}")
+
+                hit = (results[-1].get('metrics') or {}).get('response_cache') == "semantic_hit"
+                if hit != expect_hit:
+                    passed = False
+                    print(f"❌ {second}: " + ("应命中语义缓存（可调低threshold）" if expect_hit
+                                              else f"不应命中语义缓存，却返回了「{first}」的结果（可调高threshold）"))
+
+            stats = requests.get(f"{self.base_url}/api/inference/cache/stats", timeout=30).json()['data']
+            print(f"语义缓存统计: {json.dumps(stats['semantic_cache'], ensure_ascii=False)}")
+            print("\n✅ 语义缓存测试成功" if passed else "\n❌ 语义缓存测试失败")
+            return stats['semantic_cache']
+
+        except Exception as e:
+            print(f"\n❌ 语义缓存测试失败: {e}")
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"响应状态码: {e.response.status_code}")
+                print(f"响应内容: {e.response.text}")
+            return {"error": str(e)}
+
     def run_all_tests(self, model_path: str):
         """运行所有推理服务API测试"""
         print("\n" + "=" * 60)
@@ -186,6 +447,30 @@ class InferenceAPITest:
         # # 测试3: 批量推理
         # print("\n\n【测试3】批量推理API")
         # batch_result = self.test_batch_inference(model_path)
+        #
+        # # 测试4: 批量推理（NDJSON流式）
+        # print("\n\n【测试4】批量推理API（流式）")
+        # batch_stream_result = self.test_batch_inference_stream(model_path)
+        #
+        # # 测试5: 多轮对话会话
+        # print("\n\n【测试5】多轮对话会话API")
+        # session_result = self.test_session_chat(model_path)
+        #
+        # # 测试6: 流式推理客户端断开
+        # print("\n\n【测试6】流式推理客户端断开")
+        # disconnect_result = self.test_stream_disconnect(model_path)
+        #
+        # # 测试7: n-best采样
+        # print("\n\n【测试7】n-best采样API")
+        # n_best_result = self.test_n_best_chat(model_path)
+        #
+        # # 测试8: 约束解码（JSON Schema）
+        # print("\n\n【测试8】约束解码API")
+        # json_schema_result = self.test_json_schema_chat(model_path)
+        #
+        # # 测试9: 语义缓存
+        # print("\n\n【测试9】语义缓存API")
+        # semantic_cache_result = self.test_semantic_cache(model_path)
 
         print("\n" + "=" * 60)
         print("推理服务API测试完成")
@@ -195,7 +480,8 @@ class InferenceAPITest:
             "chat": chat_result
             # ,
             # "stream": stream_result,
-            # "batch": batch_result
+            # "batch": batch_result,
+            # "batch_stream": batch_stream_result
         }
 
 
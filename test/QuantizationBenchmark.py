@@ -0,0 +1,160 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from service.inference.InferenceService import InferenceService
+
+# 设置UTF-8编码，避免Windows控制台编码问题
+if sys.platform == 'win32' and hasattr(sys.stdout, 'buffer'):
+    import io
+
+    if not isinstance(sys.stdout, io.TextIOWrapper) or sys.stdout.encoding != 'utf-8':
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+
+class QuantizationBenchmark:
+    """int8动态量化对比测试 - 在相同提示词上比较 bfloat16 / float32 / int8 的延迟、内存和困惑度"""
+
+    def __init__(self, model_path: str, lora_adapter_path: str = None, config: dict = None):
+        self.model_path = model_path
+        self.lora_adapter_path = lora_adapter_path
+        self.config = dict(config or {})
+        # 对比时关闭前缀缓存，避免第二次请求命中缓存
+        self.config['prefix_cache'] = {'enabled': False}
+        self.test_data_dir = os.path.join(os.path.dirname(__file__), "data")
+        self.prompts = [
+            "你好，请介绍一下你自己",
+            "什么是机器学习？",
+            "用Python写一个快速排序"
+        ]
+
+    def benchmark(self, dtype: str, max_new_tokens: int = 64):
+        """测试单个精度"""
+        print("=" * 50)
+        print(f"测试精度: {dtype}")
+        print("=" * 50)
+
+        load_start = time.time()
+        service = InferenceService(self.model_path, self.lora_adapter_path, dtype=dtype, config=self.config)
+        load_time = time.time() - load_start
+
+        latencies = []
+        generated_tokens = 0
+        outputs = []
+        with torch.inference_mode():
+            for prompt in self.prompts:
+                text = service.build_prompt([{"role": "user", "content": prompt}], False)
+                inputs = service.tokenizer([text], return_tensors="pt").to(service.model.device)
+                start_time = time.time()
+                # 贪心解码，保证不同精度的输出可以直接对比
+                output_ids = service.model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
+                latencies.append(time.time() - start_time)
+                new_ids = output_ids[0][inputs.input_ids.shape[1]:]
+                generated_tokens += len(new_ids)
+                outputs.append(service.tokenizer.decode(new_ids, skip_special_tokens=True))
+
+        result = {
+            'dtype': dtype,
+            'load_seconds': round(load_time, 2),
+            'avg_latency_seconds': round(sum(latencies) / len(latencies), 3),
+            'tokens_per_second': round(generated_tokens / sum(latencies), 2),
+            'model_memory_mb': round(service.memory_footprint() / 1024 / 1024, 1),
+            'peak_rss_mb': self._peak_rss_mb(),
+            'perplexity': round(self._perplexity(service), 4),
+            'outputs': outputs
+        }
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+
+        del service
+        return result
+
+    def _perplexity(self, service: InferenceService) -> float:
+        """在 train_sample.json 上计算困惑度（与评估服务的计算方式一致）"""
+        total_loss = 0.0
+        total_samples = 0
+        with open(os.path.join(self.test_data_dir, "train_sample.json"), 'r', encoding='utf-8') as f:
+            samples = [json.loads(line) for line in f if line.strip()]
+
+        with torch.inference_mode():
+            for sample in samples:
+                text = service.tokenizer.apply_chat_template(sample['conversations'], tokenize=False)
+                inputs = service.tokenizer(text, return_tensors="pt").to(service.model.device)
+                outputs = service.model(**inputs, labels=inputs.input_ids)
+                total_loss += outputs.loss.item()
+                total_samples += 1
+        return torch.exp(torch.tensor(total_loss / max(total_samples, 1))).item()
+
+    @staticmethod
+    def _peak_rss_mb():
+        """进程峰值常驻内存（Windows上不可用时返回None）"""
+        try:
+            import resource
+        except ImportError:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux单位为KB，macOS为字节
+        return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+    def run_all_tests(self, dtypes=("bfloat16", "float32", "int8")):
+        """
+        每种精度在单独的子进程中测试后汇总：ru_maxrss是进程级的单调峰值，
+        在同一进程中依次测试时后面精度的峰值内存只是前面精度的峰值
+        """
+        results = []
+        for dtype in dtypes:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                output_path = os.path.join(temp_dir, "result.json")
+                completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--dtype', dtype,
+                                            '--output', output_path])
+                if completed.returncode != 0 or not os.path.exists(output_path):
+                    print(f"❌ 精度 {dtype} 测试失败（退出码 {completed.returncode}）")
+                    continue
+                with open(output_path, 'r', encoding='utf-8') as f:
+                    results.append(json.load(f))
+
+        print("\n" + "=" * 60)
+        print("对比结果")
+        print("=" * 60)
+        for result in results:
+            print(f"{result['dtype']:>10}: 延迟 {result['avg_latency_seconds']}s, "
+                  f"{result['tokens_per_second']} tokens/s, 模型内存 {result['model_memory_mb']}MB, "
+                  f"峰值内存 {result['peak_rss_mb']}MB, 困惑度 {result['perplexity']}")
+        return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import yaml
+
+    parser = argparse.ArgumentParser(description="int8动态量化对比测试")
+    parser.add_argument('dtypes', nargs='*', default=["bfloat16", "float32", "int8"])
+    # 子进程模式：只测试一种精度，结果写入output
+    parser.add_argument('--dtype')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    config_path = os.path.join(os.path.dirname(__file__), "..", "config.yaml")
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+            model_path = config['model']['base_model_path']
+    except Exception as e:
+        print(f"❌ 读取配置文件失败: {e}")
+        sys.exit(1)
+
+    tester = QuantizationBenchmark(model_path, config=config.get('inference', {}))
+    if args.dtype:
+        result = tester.benchmark(args.dtype)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+    else:
+        tester.run_all_tests(args.dtypes)